@@ -1,16 +1,175 @@
+import hmac
+import math
+import os
+from datetime import datetime, timezone
+
 import validators
-from fastapi import APIRouter, HTTPException, Request, Body
-from fastapi.responses import RedirectResponse
-from pydantic import AnyUrl, ValidationError
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse, RedirectResponse, StreamingResponse
+from pydantic import AnyUrl, TypeAdapter, ValidationError
+
+from db.database import Backends, settings
+from db.transfer import compressor, export_short_urls, import_short_urls
+from api.instrumentation import track_endpoint
+from api.redirect_policy import RedirectPolicy, header_dict
+from processing.analytics import ClickAnalytics
+from processing.circuit_breaker import CircuitOpenError
+from processing.metrics import MetricsRegistry
+from processing.rate_limit import RateLimiter
+from processing.short_url_filter import IMPORT_DELAY
+from processing.shortener import StaleOriginalURL, URLShortener
+from processing.warmup import CacheWarmer
+
+# Maximum number of items accepted by the batch endpoints
+MAX_BATCH_SIZE = 1000
+
+# Validates the items of a batch one by one, so an invalid URL only fails its own item
+url_adapter = TypeAdapter(AnyUrl)
+
+# Create the instance of application's router, labelling metrics with the endpoint serving a request
+router = APIRouter(tags=["APIs for the URL Shortener"], dependencies=[Depends(track_endpoint)])
+
+# Header flagging a response served from the stale copy of a mapping while MongoDB is unreachable
+STALE_HEADER = "X-Served-Stale"
+
+# Registry of the metrics exposed at /metrics
+metrics = MetricsRegistry()
+
+# Status and caching headers of redirects, shared with the fast path
+redirect_policy = RedirectPolicy(settings.redirect_status, settings.redirect_cache_max_age,
+                                 settings.redirect_cache_min_lifetime)
+
+# The storage clients of this worker, the URL Shortener built on them, the per-worker click
+# counters of redirects (None when analytics are disabled), the cache warmer and the rate limiter
+# (None when rate limiting is disabled), all created by the first request or the application
+# startup rather than at import
+backends: Backends | None = None
+shortener: URLShortener | None = None
+analytics: ClickAnalytics | None = None
+warmer: CacheWarmer | None = None
+rate_limiter: RateLimiter | None = None
+
+
+def get_shortener() -> URLShortener:
+    """
+    Get the URL Shortener of this worker, creating it and its storage clients on first use.
+
+    A shortener inherited from the process this worker was forked from is replaced rather
+    than shared, since the connections of its clients belong to the parent.
+
+    Returns:
+        URLShortener: The shortener backed by the storage backend and Memcache with a per-worker cache in front.
+    """
+    global backends, shortener, analytics, warmer, rate_limiter
+    if shortener is not None and (backends is None or backends.pid == os.getpid()):
+        return shortener
+
+    if shortener is not None:
+        unregister_collectors()
+    backends = Backends(settings)
+    shortener = URLShortener(backends.storage, backends.async_memcache, backends.local_cache,
+                             backends.key_allocator, settings.negative_cache_ttl, backends.expiry_write_behind,
+                             metrics, backends.mongodb_breaker, settings.memcache_ttl, settings.stale_cache_ttl,
+                             backends.short_url_filter, backends.cdn_purger.purge if backends.cdn_purger else None)
+    metrics.register_collector(backends.async_memcache.collect)
+    analytics = backends.click_analytics
+    if analytics:
+        metrics.register_collector(analytics.collect)
+    if shortener.code_filter:
+        metrics.register_collector(shortener.code_filter.collect)
+    warmer = backends.cache_warmer
+    metrics.register_collector(warmer.collect)
+    rate_limiter = backends.rate_limiter
+    if rate_limiter:
+        metrics.register_collector(rate_limiter.collect)
+    return shortener
+
+
+def get_analytics() -> ClickAnalytics | None:
+    """
+    Get the click analytics of this worker.
+
+    Returns:
+        ClickAnalytics: The click counters, or None when analytics are disabled.
+    """
+    get_shortener()
+    return analytics
+
+
+def get_warmer() -> CacheWarmer:
+    """
+    Get the cache warmer of this worker.
+
+    Returns:
+        CacheWarmer: The warmer loading the most requested mappings into the caches.
+    """
+    get_shortener()
+    return warmer
+
+
+def get_rate_limiter() -> RateLimiter | None:
+    """
+    Get the rate limiter of this worker.
+
+    Returns:
+        RateLimiter: The per-client request budgets, or None when rate limiting is disabled.
+    """
+    get_shortener()
+    return rate_limiter
 
-from db.database import mongodb, memcache
-from processing.shortener import URLShortener
 
-# Create the instance of application's router
-router = APIRouter(tags=["APIs for the URL Shortener"])
+def unregister_collectors() -> None:
+    """ Stop reporting the metrics of the current shortener and of the components created along with it. """
+    metrics.unregister_collector(shortener.collect)
+    if backends is not None:
+        metrics.unregister_collector(backends.async_memcache.collect)
+    if shortener.code_filter:
+        metrics.unregister_collector(shortener.code_filter.collect)
+    if analytics:
+        metrics.unregister_collector(analytics.collect)
+    if warmer:
+        metrics.unregister_collector(warmer.collect)
+    if rate_limiter:
+        metrics.unregister_collector(rate_limiter.collect)
 
-# Initialize URL Shortener with MongoDB and Memcache as storage
-shortener = URLShortener(mongodb, memcache)
+
+async def close_backends() -> None:
+    """ Close the storage clients created by `get_shortener` and stop reporting their metrics. """
+    global backends, shortener, analytics, warmer, rate_limiter
+    if backends is None:
+        return
+    unregister_collectors()
+    await backends.close()
+    backends = shortener = analytics = warmer = rate_limiter = None
+
+
+def unavailable(error: CircuitOpenError) -> HTTPException:
+    """
+    Describe a lookup rejected because MongoDB is unhealthy.
+
+    Args:
+        error (CircuitOpenError): The error raised by the shortener.
+
+    Returns:
+        HTTPException: A 503 response telling the client when to retry.
+    """
+    return HTTPException(status_code=503, detail=str(error),
+                         headers={"Retry-After": str(max(1, math.ceil(error.retry_after)))})
+
+
+def rate_limited(budget: str, retry_after: float) -> HTTPException:
+    """
+    Describe a request rejected because its client is over budget.
+
+    Args:
+        budget (str): The budget the request was charged to.
+        retry_after (float): Seconds after which the client may retry.
+
+    Returns:
+        HTTPException: A 429 response telling the client when to retry.
+    """
+    return HTTPException(status_code=429, detail=f"Too many {budget} requests, retry later",
+                         headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
 
 
 @router.post("/shorten/", summary="Shorten a given URL",
@@ -21,7 +180,8 @@ shortener = URLShortener(mongodb, memcache)
 async def shorten_url(request: Request,
                       original_url: AnyUrl = Body(..., description="The original URL to be shortened"),
                       expiration_in_hrs: int = Body(72,
-                                                    description="Number of hours until the short URL expires", gt=0)):
+                                                    description="Number of hours until the short URL expires", gt=0),
+                      shortener: URLShortener = Depends(get_shortener)):
     """
     Shorten a given URL.
 
@@ -29,6 +189,7 @@ async def shorten_url(request: Request,
         request (Request): The incoming request object.
         original_url (AnyUrl): The original URL to be shortened.
         expiration_in_hrs (int, optional): Number of hours until the short URL expires, default is 72.
+        shortener (URLShortener): The URL Shortener of this worker.
 
     Returns:
         dict: A dictionary containing the shortened URL.
@@ -39,7 +200,7 @@ async def shorten_url(request: Request,
     except ValidationError:
         raise HTTPException(status_code=400, detail="Invalid URL provided")
 
-    short_url = shortener.generate_short_url(str(original_url), expiration_in_hrs)
+    short_url = await shortener.generate_short_url(str(original_url), expiration_in_hrs)
     complete_short_url = f'{request.base_url}{short_url}'
     return {"short_url": complete_short_url}
 
@@ -51,12 +212,14 @@ async def shorten_url(request: Request,
                            "it raises an HTTPException.")
 async def delete_short_url(short_url: dict = Body(...,
                                                   example={"short_url": "your_short_url"},
-                                                  description="The short URL to be deleted")):
+                                                  description="The short URL to be deleted"),
+                           shortener: URLShortener = Depends(get_shortener)):
     """
     Delete a shortened URL.
 
     Args:
         short_url (dict): The request body containing the short URL to be deleted.
+        shortener (URLShortener): The URL Shortener of this worker.
 
     Returns:
         dict: The status message.
@@ -74,7 +237,7 @@ async def delete_short_url(short_url: dict = Body(...,
         short_url_value = short_url_value.rsplit('/', 1)[-1]
 
         # Delete the short URL
-        shortener.delete_short_url(short_url_value)
+        await shortener.delete_short_url(short_url_value)
 
         # Return success message
         return {"message": "Short URL deleted successfully"}
@@ -88,25 +251,337 @@ async def delete_short_url(short_url: dict = Body(...,
                         "It expects a request body containing the short URL. It returns a dictionary containing "
                         "the original URL. If the short URL does not exist in the system or has expired, "
                         "it raises an HTTPException.")
-async def fetch_original_url(short_url: str):
+async def fetch_original_url(short_url: str, response: Response, shortener: URLShortener = Depends(get_shortener)):
     """
     Get the original URL mapped to the given short URL.
 
     Args:
         short_url (str): The short URL.
+        response (Response): The outgoing response, flagged when the original URL is served stale.
+        shortener (URLShortener): The URL Shortener of this worker.
 
     Returns:
         dict: A dictionary containing the original URL
 
     Raises:
-        HTTPException: If the short URL does not exist in the system or is expired.
+        HTTPException: If the short URL does not exist in the system or is expired, or MongoDB is unavailable.
     """
     try:
         short_url = short_url.rsplit('/', 1)[-1]
-        original_url = shortener.get_original_url(short_url)
+        original_url = await shortener.get_original_url(short_url)
+        if isinstance(original_url, StaleOriginalURL):
+            response.headers[STALE_HEADER] = "1"
         return {"original_url": original_url}
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
+    except CircuitOpenError as e:
+        raise unavailable(e)
+
+
+@router.post("/shorten/batch", summary="Shorten a batch of URLs",
+             description="This API method shortens up to 1000 URLs at once. It accepts the list of original URLs "
+                         "and an optional number of hours until the short URLs expire, defaulting to 72 hours. "
+                         "Original URLs that already have a short URL get their expiry extended. It returns one "
+                         "result per original URL, in order, containing either the shortened URL or an error.")
+async def shorten_urls(request: Request,
+                       original_urls: list[str] = Body(..., description="The original URLs to be shortened",
+                                                       max_length=MAX_BATCH_SIZE),
+                       expiration_in_hrs: int = Body(72,
+                                                     description="Number of hours until the short URLs expire", gt=0),
+                       shortener: URLShortener = Depends(get_shortener)):
+    """
+    Shorten a batch of URLs.
+
+    Args:
+        request (Request): The incoming request object.
+        original_urls (list[str]): The original URLs to be shortened.
+        expiration_in_hrs (int, optional): Number of hours until the short URLs expire, default is 72.
+        shortener (URLShortener): The URL Shortener of this worker.
+
+    Returns:
+        dict: A dictionary containing a result for every original URL.
+    """
+    # Every URL counts against the shorten budget of the client identified by the rate limit middleware
+    client = getattr(request.state, "rate_limit_client", None)
+    if rate_limiter and client:
+        retry_after = rate_limiter.check("shorten", client, max(1, len(original_urls)))
+        if retry_after is not None:
+            raise rate_limited("shorten", retry_after)
+
+    results: list[dict] = [{"original_url": original_url} for original_url in original_urls]
+    valid_urls = {}
+    for index, original_url in enumerate(original_urls):
+        try:
+            valid_urls[index] = str(url_adapter.validate_python(original_url))
+        except ValidationError:
+            results[index]["error"] = "Invalid URL provided"
+
+    short_urls = await shortener.generate_short_urls(list(valid_urls.values()), expiration_in_hrs)
+    for index, short_url in zip(valid_urls, short_urls):
+        if isinstance(short_url, ValueError):
+            results[index]["error"] = str(short_url)
+        else:
+            results[index]["short_url"] = f'{request.base_url}{short_url}'
+    return {"results": results}
+
+
+@router.post("/resolve/batch", summary="Get the original URLs of a batch of short URLs",
+             description="This API method retrieves the original URLs associated with up to 1000 short URLs at "
+                         "once. It returns one result per short URL, in order, containing either the original URL "
+                         "or an error if the short URL does not exist in the system or has expired.")
+async def resolve_short_urls(short_urls: list[str] = Body(..., embed=True, description="The short URLs to resolve",
+                                                          max_length=MAX_BATCH_SIZE),
+                             shortener: URLShortener = Depends(get_shortener)):
+    """
+    Get the original URLs mapped to a batch of short URLs.
+
+    Args:
+        short_urls (list[str]): The short URLs.
+        shortener (URLShortener): The URL Shortener of this worker.
+
+    Returns:
+        dict: A dictionary containing a result for every short URL.
+    """
+    codes = [short_url.rsplit('/', 1)[-1] for short_url in short_urls]
+    try:
+        original_urls = await shortener.get_original_urls(codes)
+    except CircuitOpenError as e:
+        raise unavailable(e)
+    results = []
+    for short_url, original_url in zip(short_urls, original_urls):
+        if isinstance(original_url, ValueError):
+            results.append({"short_url": short_url, "error": str(original_url)})
+        else:
+            results.append({"short_url": short_url, "original_url": original_url})
+            if isinstance(original_url, StaleOriginalURL):
+                results[-1]["stale"] = True
+    return {"results": results}
+
+
+def require_analytics(analytics: ClickAnalytics | None = Depends(get_analytics)) -> ClickAnalytics:
+    """
+    Get the click analytics, failing the request when they are disabled.
+
+    Args:
+        analytics (ClickAnalytics, optional): The click counters of this worker.
+
+    Returns:
+        ClickAnalytics: The click analytics of this worker.
+
+    Raises:
+        HTTPException: If click analytics are disabled.
+    """
+    if analytics is None:
+        raise HTTPException(status_code=404, detail="Click analytics are disabled")
+    return analytics
+
+
+@router.get("/analytics/top", summary="Get the most clicked short URLs",
+            description="This API method returns the short URLs with the most redirects, most clicked first. "
+                        "It accepts the maximum number of short URLs and an optional number of hours to count "
+                        "the clicks of, counting all clicks by default. Clicks are written in batches, so the "
+                        "most recent ones may not be counted yet.")
+async def top_links(limit: int = Query(10, gt=0, le=1000, description="Maximum number of short URLs"),
+                    hours: float | None = Query(None, gt=0, description="Only count the clicks of the last hours"),
+                    analytics: ClickAnalytics = Depends(require_analytics)):
+    """
+    Get the most clicked short URLs.
+
+    Args:
+        limit (int): Maximum number of short URLs to return.
+        hours (float, optional): Only count the clicks of the last hours.
+        analytics (ClickAnalytics): The click counters of this worker.
+
+    Returns:
+        dict: A dictionary containing the short URLs and their click counts.
+    """
+    return {"links": await analytics.top_links(limit, hours)}
+
+
+@router.get("/analytics/{short_url}", summary="Get the clicks of a short URL over time",
+            description="This API method returns the number of redirects of a short URL per time bucket, oldest "
+                        "first, together with their total. It accepts an optional number of hours to return the "
+                        "buckets of, returning all buckets by default.")
+async def link_history(short_url: str,
+                       hours: float | None = Query(None, gt=0, description="Only return the last hours"),
+                       analytics: ClickAnalytics = Depends(require_analytics)):
+    """
+    Get the clicks of a short URL per time bucket.
+
+    Args:
+        short_url (str): The short URL.
+        hours (float, optional): Only return the buckets of the last hours.
+        analytics (ClickAnalytics): The click counters of this worker.
+
+    Returns:
+        dict: A dictionary containing the click count of every bucket and the total.
+    """
+    buckets = await analytics.history(short_url, hours)
+    return {
+        "short_url": short_url,
+        "total": sum(bucket["count"] for bucket in buckets),
+        "buckets": [{"start": datetime.fromtimestamp(bucket["bucket"], timezone.utc).isoformat(),
+                     "count": bucket["count"]} for bucket in buckets],
+    }
+
+
+def require_admin(authorization: str | None = Header(None, description="`Bearer` and the admin token")) -> None:
+    """
+    Reject requests to the admin endpoints that do not carry the admin token.
+
+    Args:
+        authorization (str, optional): The Authorization header of the request.
+
+    Raises:
+        HTTPException: If no admin token is configured or the request does not carry it.
+    """
+    if not settings.admin_token:
+        raise HTTPException(status_code=403, detail="The admin endpoints are disabled, set ADMIN_TOKEN to enable them")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip().encode(), settings.admin_token.encode()):
+        raise HTTPException(status_code=401, detail="Invalid or missing admin token",
+                            headers={"WWW-Authenticate": "Bearer"})
+
+
+@router.post("/admin/warmup", summary="Warm the caches", dependencies=[Depends(require_admin)], status_code=202,
+             description="This API method starts loading the most clicked and the most recent short URLs into "
+                         "the caches in the background. It accepts optional numbers of most clicked and most "
+                         "recent short URLs, defaulting to the configured ones. The progress is returned by "
+                         "`GET /admin/warmup`. If a warm-up is running already, it raises an HTTPException.")
+async def start_warmup(top: int | None = Query(None, ge=0, le=1000000, description="Number of most clicked URLs"),
+                       recent: int | None = Query(None, ge=0, le=1000000, description="Number of most recent URLs"),
+                       warmer: CacheWarmer = Depends(get_warmer)):
+    """
+    Start a cache warm-up in the background.
+
+    Args:
+        top (int, optional): Number of most clicked short URLs to load.
+        recent (int, optional): Number of most recent short URLs to load.
+        warmer (CacheWarmer): The cache warmer of this worker.
+
+    Returns:
+        dict: The status message.
+
+    Raises:
+        HTTPException: If a warm-up is running already.
+    """
+    if not warmer.start(top, recent):
+        raise HTTPException(status_code=409, detail="A cache warm-up is running already")
+    return {"message": "Cache warm-up started"}
+
+
+@router.get("/admin/warmup", summary="Get the progress of the cache warm-up", dependencies=[Depends(require_admin)],
+            description="This API method returns the state of the last cache warm-up of the worker answering, "
+                        "the number of mappings it loaded from each source and how many seconds it took.")
+async def warmup_progress(warmer: CacheWarmer = Depends(get_warmer)):
+    """
+    Get the progress of the last cache warm-up.
+
+    Args:
+        warmer (CacheWarmer): The cache warmer of this worker.
+
+    Returns:
+        dict: The state, the numbers of mappings read and loaded and the duration in seconds.
+    """
+    return warmer.progress
+
+
+@router.get("/admin/export", summary="Export the short URLs", dependencies=[Depends(require_admin)],
+            description="This API method streams the short URLs in short URL order as NDJSON, one JSON object per "
+                        "line, or in the compact binary format, optionally compressed with gzip or zstd. It accepts "
+                        "the short URL to continue an interrupted export after and whether to include expired "
+                        "short URLs. If the compression is not available, it raises an HTTPException.")
+async def export_urls(fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|binary)$",
+                                       description="Format of the export"),
+                      compression: str = Query("none", pattern="^(none|gzip|zstd)$",
+                                               description="Compression of the export"),
+                      after: str | None = Query(None, description="Continue after this short URL"),
+                      include_expired: bool = Query(False, description="Export expired short URLs as well"),
+                      shortener: URLShortener = Depends(get_shortener)):
+    """
+    Stream an export of the short URLs.
+
+    Args:
+        fmt (str): `ndjson` or `binary`.
+        compression (str): `none`, `gzip` or `zstd`.
+        after (str, optional): The last short URL of an interrupted export.
+        include_expired (bool): Export expired short URLs as well.
+        shortener (URLShortener): The URL shortener of this worker.
+
+    Returns:
+        StreamingResponse: The export, read from the storage as fast as the client takes it.
+
+    Raises:
+        HTTPException: If the compression is not available.
+    """
+    try:
+        compressor(compression)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    chunks = (data async for data, _ in export_short_urls(shortener.mongodb, fmt, compression, after,
+                                                          include_expired))
+    file_name = "short_urls." + ("bin" if fmt == "binary" else "ndjson") + {"gzip": ".gz", "zstd": ".zst"}.get(
+        compression, "")
+    return StreamingResponse(chunks, media_type="application/x-ndjson" if fmt == "ndjson" and compression == "none"
+                             else "application/octet-stream",
+                             headers={"Content-Disposition": f'attachment; filename="{file_name}"'})
+
+
+@router.post("/admin/import", summary="Import short URLs", dependencies=[Depends(require_admin)],
+             description="This API method reads an export from the request body as it arrives and upserts its "
+                         "short URLs with their expiration dates. It accepts the format and compression of the "
+                         "export, the number of records written by an interrupted import to skip and whether to "
+                         "include expired short URLs. It returns the numbers of records read, written and expired. "
+                         "If the export is invalid or the storage is unavailable, it raises an HTTPException "
+                         "telling where to resume.")
+async def import_urls(request: Request,
+                      fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|binary)$",
+                                       description="Format of the export"),
+                      compression: str = Query("none", pattern="^(none|gzip|zstd)$",
+                                               description="Compression of the export"),
+                      skip: int = Query(0, ge=0, description="Number of records written by an earlier import"),
+                      include_expired: bool = Query(False, description="Import expired short URLs as well"),
+                      shortener: URLShortener = Depends(get_shortener)):
+    """
+    Import an export streamed in the request body.
+
+    Args:
+        request (Request): The request, whose body is the export.
+        fmt (str): `ndjson` or `binary`.
+        compression (str): `none`, `gzip` or `zstd`.
+        skip (int): Number of leading records to skip.
+        include_expired (bool): Import expired short URLs as well.
+        shortener (URLShortener): The URL shortener of this worker.
+
+    Returns:
+        dict: The numbers of records read, written and expired, and the checkpoint.
+
+    Raises:
+        HTTPException: If the export is invalid or the storage is unavailable.
+    """
+    progress = {}
+    try:
+        return await import_short_urls(shortener.mongodb, request.stream(), fmt, compression, skip, include_expired,
+                                       allocator=shortener.allocator, progress=progress,
+                                       on_batch=shortener.refresh_short_urls,
+                                       import_delay=IMPORT_DELAY if settings.short_url_filter else 0.0)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=f"{ve}. Resume with skip={progress.get('checkpoint', skip)}")
+    except shortener.unavailable_errors as e:
+        raise HTTPException(status_code=503, detail=f"The storage is unavailable: {e}. "
+                                                    f"Resume with skip={progress.get('checkpoint', skip)}")
+
+
+@router.get("/metrics", include_in_schema=False,
+            description="This API method exposes the application metrics in the Prometheus text format.")
+async def export_metrics():
+    """
+    Expose the metrics of this worker.
+
+    Returns:
+        PlainTextResponse: The metrics in the Prometheus text exposition format.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 @router.get("/{short_url}", include_in_schema=False,
@@ -114,21 +589,33 @@ async def fetch_original_url(short_url: str):
                         "It expects the short URL as part of the request URL path. If the short URL exists "
                         "in the system and is not expired, it returns a redirection response to the original URL. "
                         "If the short URL does not exist or has expired, it raises an HTTPException.")
-async def redirect_to_original_url(short_url: str):
+async def redirect_to_original_url(short_url: str, shortener: URLShortener = Depends(get_shortener),
+                                   analytics: ClickAnalytics | None = Depends(get_analytics)):
     """
     Redirect to the original URL based on the short URL.
 
     Args:
         short_url (str): The short URL used for redirection.
+        shortener (URLShortener): The URL Shortener of this worker.
+        analytics (ClickAnalytics, optional): The click counters of this worker.
 
     Returns:
-        RedirectResponse: A redirection response to be routed to the original URL.
+        RedirectResponse: A redirection response to be routed to the original URL, with the status and caching
+            headers of the redirect policy.
 
     Raises:
-        HTTPException: If the short URL does not exist in the system or is expired.
+        HTTPException: If the short URL does not exist in the system or is expired, or MongoDB is unavailable.
     """
     try:
-        original_url = shortener.get_original_url(short_url)
-        return RedirectResponse(url=original_url)
+        original_url = await shortener.get_original_url(short_url)
+        if analytics:
+            analytics.record(short_url)
+        status_code, headers = redirect_policy.redirect(original_url)
+        response = RedirectResponse(url=original_url, status_code=status_code, headers=header_dict(headers))
+        if isinstance(original_url, StaleOriginalURL):
+            response.headers[STALE_HEADER] = "1"
+        return response
     except ValueError as e:
-        raise HTTPException(status_code=404, detail=str(e))
+        raise HTTPException(status_code=404, detail=str(e), headers=header_dict(redirect_policy.not_found()) or None)
+    except CircuitOpenError as e:
+        raise unavailable(e)
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import math
+import re
+from pathlib import Path
+from urllib.parse import quote
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from api import endpoints
+from processing.circuit_breaker import CircuitOpenError
+from processing.metrics import current_endpoint
+from processing.shortener import StaleOriginalURL
+
+# A single path segment made of base58 characters, the alphabet of every generated short URL
+SHORT_URL_PATH = re.compile(r'/([1-9A-HJ-NP-Za-km-z]+)')
+
+# Path of the route the fast path stands in for, used to label metrics the same way
+REDIRECT_ROUTE = '/{short_url}'
+
+JSON_HEADERS = [(b'content-type', b'application/json')]
+REDIRECT_HEADERS = [(b'content-length', b'0')]
+STALE_HEADERS = [(endpoints.STALE_HEADER.lower().encode(), b'1')]
+
+
+def json_body(detail: str) -> bytes:
+    # Encoded the way FastAPI encodes HTTPException responses
+    return json.dumps({'detail': detail}, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+class RedirectFastPath:
+    def __init__(self, app: ASGIApp, routes: list, index_path: str = 'static/index.html') -> None:
+        """
+        Initialize an ASGI layer answering redirects and the index page without going through FastAPI.
+
+        `GET` requests for a single path segment that can be a short URL are resolved through
+        the shortener and answered with a redirect built from pre-encoded headers, skipping
+        routing, dependency resolution and response classes. `GET /` is answered from an
+        in-memory copy of the index page with an ETag. Everything else, including paths of
+        other routes that look like short URLs, is handed to the wrapped application.
+
+        Args:
+            app (ASGIApp): The wrapped application.
+            routes (list): The routes of the application, including the catch-all redirect route.
+            index_path (str): Path of the index page.
+        """
+        self.app = app
+        self.route = next(route for route in routes if getattr(route, 'path', None) == REDIRECT_ROUTE)
+        # Single segment routes like /metrics or /docs win over the catch-all redirect route
+        self.reserved = frozenset(route.path.strip('/') for route in routes if '{' not in getattr(route, 'path', '{'))
+
+        self.index = Path(index_path).read_bytes()
+        self.index_etag = f'"{hashlib.md5(self.index).hexdigest()}"'.encode()
+        self.index_headers = [(b'content-type', b'text/html; charset=utf-8'),
+                              (b'content-length', str(len(self.index)).encode()), (b'etag', self.index_etag)]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or scope['method'] != 'GET':
+            await self.app(scope, receive, send)
+            return
+        if scope['path'] == '/':
+            await self._send_index(scope, send)
+            return
+
+        match = SHORT_URL_PATH.fullmatch(scope['path'])
+        if match is None or match[1] in self.reserved:
+            await self.app(scope, receive, send)
+            return
+        await self._redirect(scope, match[1], send)
+
+    async def _redirect(self, scope: Scope, short_url: str, send: Send) -> None:
+        scope['route'] = self.route
+        current_endpoint.set(f'GET {REDIRECT_ROUTE}')
+        try:
+            original_url = await endpoints.get_shortener().get_original_url(short_url)
+        except ValueError as e:
+            await self._send(send, 404, JSON_HEADERS + endpoints.redirect_policy.not_found(), json_body(str(e)))
+            return
+        except CircuitOpenError as e:
+            retry_after = str(max(1, math.ceil(e.retry_after))).encode()
+            await self._send(send, 503, JSON_HEADERS + [(b'retry-after', retry_after)], json_body(str(e)))
+            return
+        if endpoints.analytics:
+            endpoints.analytics.record(short_url)
+
+        # Quoted the way RedirectResponse quotes the location
+        location = quote(original_url, safe=":/%#?=@[]!$&'()*+,;").encode('latin-1')
+        status, caching_headers = endpoints.redirect_policy.redirect(original_url)
+        headers = REDIRECT_HEADERS + [(b'location', location)] + caching_headers
+        if isinstance(original_url, StaleOriginalURL):
+            headers += STALE_HEADERS
+        await self._send(send, status, headers, b'')
+
+    async def _send_index(self, scope: Scope, send: Send) -> None:
+        for name, value in scope['headers']:
+            if name == b'if-none-match' and (value.strip() == b'*' or self.index_etag in
+                                             (tag.strip() for tag in value.split(b','))):
+                await self._send(send, 304, [(b'etag', self.index_etag)], b'')
+                return
+        await self._send(send, 200, self.index_headers, self.index)
+
+    @staticmethod
+    async def _send(send: Send, status: int, headers: list, body: bytes) -> None:
+        if body and not any(name == b'content-length' for name, _ in headers):
+            headers = headers + [(b'content-length', str(len(body)).encode())]
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
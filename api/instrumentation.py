@@ -0,0 +1,53 @@
+import time
+
+from fastapi import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from processing.metrics import MetricsRegistry, current_endpoint
+
+
+async def track_endpoint(request: Request) -> None:
+    """
+    Record the route serving the request, so metrics recorded by the shortener carry it as a label.
+
+    Args:
+        request (Request): The incoming request object.
+    """
+    route = request.scope.get('route')
+    current_endpoint.set(f'{request.method} {route.path}' if route else request.method)
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp, metrics: MetricsRegistry) -> None:
+        """
+        Initialize an ASGI middleware recording the latency and status of every HTTP request.
+
+        Args:
+            app (ASGIApp): The wrapped application.
+            metrics (MetricsRegistry): Registry receiving the request histogram.
+        """
+        self.app = app
+        self.requests = metrics.histogram('http_request_duration_seconds', 'Duration of HTTP requests.',
+                                          ('endpoint', 'status'))
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the scope, the raw path would explode the label set
+            route = scope.get('route')
+            endpoint = f"{scope['method']} {route.path}" if route else 'unmatched'
+            self.requests.labels(endpoint, str(status)).observe(time.perf_counter() - started)
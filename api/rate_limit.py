@@ -0,0 +1,81 @@
+import hashlib
+from typing import Iterable
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from api import endpoints
+from api.fast_path import JSON_HEADERS, SHORT_URL_PATH, json_body
+
+# Paths of the routes charged to the shorten budget
+SHORTEN_PATHS = frozenset(('/shorten/', '/shorten/batch'))
+
+# Paths of the routes charging their budget themselves, once they know how many URLs a request holds
+CHARGED_BY_ENDPOINT = frozenset(('/shorten/batch',))
+
+
+class RateLimitMiddleware:
+    def __init__(self, app: ASGIApp, routes: list, api_key_header: str = 'X-API-Key',
+                 api_keys: Iterable[str] = ()) -> None:
+        """
+        Initialize an ASGI layer rejecting clients over their request budgets before any routing.
+
+        `POST` requests shortening URLs are charged to the `shorten` budget and `GET` requests
+        for a single path segment that can be a short URL to the `redirect` budget, of the
+        client identified by its API key header when it carries one of `api_keys`, else its IP
+        address, so a client cannot get fresh budgets by making up keys. A client over budget is
+        answered `429 Too Many Requests` with a `Retry-After` header. The identity of the
+        client is left in the request state as `rate_limit_client`, for the batch endpoint
+        charging one request per URL.
+
+        Args:
+            app (ASGIApp): The wrapped application.
+            routes (list): The routes of the application, whose single segment paths are not redirects.
+            api_key_header (str): Name of the header carrying the API key of a client.
+            api_keys (Iterable[str]): The API keys identifying clients on their own.
+        """
+        self.app = app
+        self.reserved = frozenset(route.path.strip('/') for route in routes if '{' not in getattr(route, 'path', '{'))
+        self.api_key_header = api_key_header.lower().encode('latin-1')
+        # A digest keeps API keys out of Memcache and makes any of them a valid key part
+        encoded_keys = [api_key.encode('latin-1') for api_key in api_keys]
+        self.api_keys = {api_key: 'key:' + hashlib.blake2b(api_key, digest_size=12).hexdigest()
+                         for api_key in encoded_keys}
+
+    def _budget(self, scope: Scope) -> str | None:
+        method, path = scope['method'], scope['path']
+        if method == 'POST' and path in SHORTEN_PATHS:
+            return 'shorten'
+        if method == 'GET' and (match := SHORT_URL_PATH.fullmatch(path)) and match[1] not in self.reserved:
+            return 'redirect'
+        return None
+
+    def _client(self, scope: Scope) -> str:
+        if self.api_keys:
+            for name, value in scope['headers']:
+                if name == self.api_key_header and value in self.api_keys:
+                    return self.api_keys[value]
+        client = scope.get('client')
+        return f'ip:{client[0]}' if client else 'ip:unknown'
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or (budget := self._budget(scope)) is None:
+            await self.app(scope, receive, send)
+            return
+        limiter = endpoints.get_rate_limiter()
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        client = self._client(scope)
+        scope.setdefault('state', {})['rate_limit_client'] = client
+        retry_after = None if scope['path'] in CHARGED_BY_ENDPOINT else limiter.check(budget, client)
+        if retry_after is None:
+            await self.app(scope, receive, send)
+            return
+
+        error = endpoints.rate_limited(budget, retry_after)
+        body = json_body(error.detail)
+        headers = JSON_HEADERS + [(b'content-length', str(len(body)).encode()),
+                                  (b'retry-after', error.headers['Retry-After'].encode())]
+        await send({'type': 'http.response.start', 'status': error.status_code, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
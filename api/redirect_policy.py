@@ -0,0 +1,81 @@
+import math
+import time
+from email.utils import formatdate
+from typing import Callable
+
+from processing.shortener import StaleOriginalURL
+
+# Status codes a redirect may be answered with
+REDIRECT_STATUSES = (301, 302, 307, 308)
+
+# The temporary counterpart of each status, for redirects that must not be cached
+TEMPORARY_STATUSES = {301: 302, 308: 307}
+
+NO_STORE = [(b'cache-control', b'no-store')]
+
+
+def header_dict(headers: list[tuple[bytes, bytes]]) -> dict[str, str]:
+    """ Turn raw header pairs into the headers of a Starlette response or HTTPException. """
+    return {name.decode('latin-1'): value.decode('latin-1') for name, value in headers}
+
+
+class RedirectPolicy:
+    def __init__(self, status: int = 307, max_age: float = 0, min_lifetime: float = 300,
+                 clock: Callable[[], float] = time.time) -> None:
+        """
+        Initialize the policy choosing the status and caching headers of redirects.
+
+        A short URL keeps its original URL until it expires: re-shortening only moves the
+        expiry later, so browsers and CDNs may cache its redirect for its remaining lifetime.
+        Redirects get `Cache-Control: max-age` and `Expires` for that lifetime, capped at
+        `max_age` seconds, which also bounds how long a deleted link may be served by a cache
+        that was not purged. Links expiring within `min_lifetime` seconds, redirects of unknown
+        lifetime or served stale while MongoDB is down, and not found answers are sent with
+        `Cache-Control: no-store`, the permanent statuses turned into their temporary ones.
+
+        Args:
+            status (int): Status of cacheable redirects, 301, 302, 307 or 308.
+            max_age (float): Maximum seconds a redirect may be cached, 0 leaves out the caching headers.
+            min_lifetime (float): Remaining lifetime in seconds below which a redirect is not cached.
+            clock (Callable): Returns the current unix time, injectable for tests.
+        """
+        if status not in REDIRECT_STATUSES:
+            raise ValueError(f"Redirect status must be one of {REDIRECT_STATUSES}, not {status}")
+        self.status = status
+        self.max_age = max_age
+        self.min_lifetime = min_lifetime
+        self.clock = clock
+        self.uncached_status = TEMPORARY_STATUSES.get(status, status)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_age > 0
+
+    def redirect(self, original_url: str) -> tuple[int, list[tuple[bytes, bytes]]]:
+        """
+        Choose the status and caching headers of a redirect.
+
+        Args:
+            original_url (str): The original URL, an `OriginalURL` knowing when its short URL expires.
+
+        Returns:
+            tuple: The status code and the caching headers as raw header pairs.
+        """
+        if not self.enabled:
+            return self.status, []
+        expires_at = getattr(original_url, 'expires_at', None)
+        now = self.clock()
+        if expires_at is None or isinstance(original_url, StaleOriginalURL) or expires_at - now < self.min_lifetime:
+            return self.uncached_status, NO_STORE
+        max_age = math.floor(min(expires_at - now, self.max_age))
+        return self.status, [(b'cache-control', b'public, max-age=%d' % max_age),
+                             (b'expires', formatdate(now + max_age, usegmt=True).encode())]
+
+    def not_found(self) -> list[tuple[bytes, bytes]]:
+        """
+        Choose the caching headers of a short URL that does not exist, has expired or was deleted.
+
+        Returns:
+            list: The caching headers as raw header pairs.
+        """
+        return NO_STORE if self.enabled else []
@@ -0,0 +1,67 @@
+"""
+Redirect latency with click analytics turned off and on.
+
+Drives `GET /{short_url}` of `main.app` in-process through httpx against the in-process
+storage stand-ins, once without analytics and once recording every click, with a short
+flush interval and a slow analytics write so flushes overlap the redirects.
+
+    python -m benchmarks.bench_analytics --requests 5000 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import random
+
+import httpx
+
+from api import endpoints
+from benchmarks.suite import drive, key_sampler
+from main import app
+from processing.analytics import ClickAnalytics
+from processing.shortener import URLShortener
+from tests.fakes import FakeMemcache, FakeMongoDB
+
+
+async def redirects(args: argparse.Namespace, analytics_enabled: bool) -> dict:
+    rng = random.Random(args.seed)
+    mongodb = FakeMongoDB(latency=args.mongo_latency_ms / 1000)
+    endpoints.shortener = URLShortener(mongodb, FakeMemcache(latency=args.memcache_latency_ms / 1000))
+    analytics = ClickAnalytics(mongodb, interval=args.flush_interval) if analytics_enabled else None
+    endpoints.analytics = analytics
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        codes = []
+        for n in range(args.keys):
+            response = await client.post('/shorten/', json={'original_url': f'https://example.com/{n}'})
+            codes.append(response.json()['short_url'].rsplit('/', 1)[-1])
+        sample = key_sampler(codes, 'zipf', 1.1, rng)
+
+        if analytics:
+            analytics.start()
+        result = await drive(client, [lambda code=sample(): client.get(f'/{code}') for _ in range(args.requests)],
+                             args.concurrency)
+        if analytics:
+            await analytics.stop()
+            result.update(recorded=analytics.recorded, dropped=analytics.dropped, flushed=analytics.flushed)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--keys', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--mongo-latency-ms', type=float, default=5.0)
+    parser.add_argument('--memcache-latency-ms', type=float, default=0.2)
+    parser.add_argument('--flush-interval', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    for analytics_enabled in (False, True):
+        result = asyncio.run(redirects(args, analytics_enabled))
+        print(json.dumps({'analytics': analytics_enabled, **result}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Requests per second of redirects and the index page with and without the redirect fast path.
+
+Drives `main.app` in-process through httpx, once through FastAPI's routing and once with
+`RedirectFastPath` in front of it, inside the metrics middleware as `REDIRECT_FAST_PATH=true`
+configures it. Short URLs are served from the per-worker cache, so the numbers show the
+overhead of the web layer rather than storage latency.
+
+    python -m benchmarks.bench_fast_path --requests 20000 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import random
+
+import httpx
+
+from api import endpoints
+from api.fast_path import RedirectFastPath
+from api.instrumentation import MetricsMiddleware
+from benchmarks.suite import drive, key_sampler
+from db.local_cache import LocalCache
+from main import app
+from processing.shortener import URLShortener
+from tests.fakes import FakeMemcache, FakeMongoDB
+
+
+async def run(args: argparse.Namespace) -> list[dict]:
+    endpoints.shortener = URLShortener(FakeMongoDB(), FakeMemcache(), LocalCache())
+    endpoints.analytics = None
+    fast_app = MetricsMiddleware(RedirectFastPath(app, routes=[*app.routes, *endpoints.router.routes]),
+                                 metrics=endpoints.metrics)
+
+    results = []
+    for name, asgi_app in (('fastapi', app), ('fast_path', fast_app)):
+        rng = random.Random(args.seed)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=asgi_app), base_url='http://bench') as client:
+            if not results:
+                codes = []
+                for n in range(args.keys):
+                    response = await client.post('/shorten/', json={'original_url': f'https://example.com/{n}'})
+                    codes.append(response.json()['short_url'].rsplit('/', 1)[-1])
+                sample = key_sampler(codes, 'zipf', 1.1, rng)
+            for scenario, path in (('redirect', None), ('index', '/')):
+                result = await drive(client, [lambda path=path or f'/{sample()}': client.get(path)
+                                              for _ in range(args.requests)], args.concurrency)
+                results.append({'app': name, 'scenario': scenario, **result})
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--keys', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    for result in asyncio.run(run(args)):
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Overhead of the metrics instrumentation.
+
+Measures the cost of a single stage timer and counter increment, and the latency of
+`URLShortener.get_original_url` served from Memcache and from the local cache with the
+instrumentation in place and with it replaced by no-ops.
+
+    python -m benchmarks.bench_metrics --iterations 200000
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import time
+
+from db.local_cache import LocalCache
+from processing.metrics import MetricsRegistry
+from processing.shortener import URLShortener
+from tests.fakes import FakeMemcache, FakeMongoDB
+
+
+def per_call_ns(func, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return round((time.perf_counter() - started) / iterations * 1e9, 1)
+
+
+def time_stage(series) -> None:
+    with series.time():
+        pass
+
+
+async def lookups(instrumented: bool, local_cache: bool, iterations: int) -> float:
+    shortener = URLShortener(FakeMongoDB(), FakeMemcache(), LocalCache() if local_cache else None)
+    if not instrumented:
+        shortener._stage = lambda operation, stage: contextlib.nullcontext()
+        shortener._count = lambda result, amount=1: None
+    short_url = await shortener.generate_short_url('https://example.com')
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await shortener.get_original_url(short_url)
+    return round((time.perf_counter() - started) / iterations * 1e9, 1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200000)
+    args = parser.parse_args()
+
+    metrics = MetricsRegistry()
+    series = metrics.histogram('stage_seconds', 'Stages.', ('operation', 'stage')).labels('get', 'find')
+    counter = metrics.counter('results_total', 'Results.', ('endpoint', 'result'))
+    print(json.dumps({
+        'stage_timer_ns': per_call_ns(lambda: time_stage(series), args.iterations),
+        'counter_inc_ns': per_call_ns(lambda: counter.inc('GET /{short_url}', 'cache_hit'), args.iterations),
+    }))
+
+    for local_cache in (False, True):
+        result = {'path': 'local_cache' if local_cache else 'memcache'}
+        for instrumented in (False, True):
+            key = 'instrumented_ns' if instrumented else 'bare_ns'
+            result[key] = asyncio.run(lookups(instrumented, local_cache, args.iterations // 10))
+        result['overhead_pct'] = round((result['instrumented_ns'] / result['bare_ns'] - 1) * 100, 1)
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
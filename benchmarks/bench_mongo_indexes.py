@@ -0,0 +1,80 @@
+"""
+Lookup latency of the short URL collection before and after index provisioning.
+
+Seeds `--documents` short URLs (a quarter of them already expired) into a scratch
+database of a local mongod, measures `find_one` by short URL and by original URL,
+creates the indexes from `short_url_indexes` and measures again.
+
+    python -m benchmarks.bench_mongo_indexes --uri mongodb://localhost:27017/ --documents 2000000
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from pymongo import MongoClient
+
+from benchmarks.common import percentile
+from db.mongodb import short_url_indexes
+
+BENCH_DATABASE = 'short_urls_bench'
+
+
+def seed(collection, documents: int, batch_size: int = 10000) -> None:
+    now = datetime.now(timezone.utc)
+    for start in range(0, documents, batch_size):
+        collection.insert_many([
+            {
+                'short_url': f'code{n}',
+                'original_url': f'https://example.com/articles/{n}?utm_source=newsletter&utm_medium=email',
+                'expiration_date': now + timedelta(hours=-1 if n % 4 == 0 else 72),
+            }
+            for n in range(start, min(start + batch_size, documents))
+        ], ordered=False)
+
+
+def measure(collection, documents: int, lookups: int) -> dict:
+    results = {}
+    for field, value in (('short_url', 'code{}'),
+                         ('original_url', 'https://example.com/articles/{}?utm_source=newsletter&utm_medium=email')):
+        latencies = []
+        for _ in range(lookups):
+            criteria = {field: value.format(random.randrange(documents))}
+            started = time.perf_counter()
+            collection.find_one(criteria)
+            latencies.append(time.perf_counter() - started)
+        results[field] = {'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+                          'p99_ms': round(percentile(latencies, 99) * 1000, 3)}
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uri', default='mongodb://localhost:27017/')
+    parser.add_argument('--documents', type=int, default=2000000)
+    parser.add_argument('--lookups', type=int, default=50)
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri, serverSelectionTimeoutMS=2000)
+    client.drop_database(BENCH_DATABASE)
+    collection = client[BENCH_DATABASE]['short_urls']
+    try:
+        started = time.perf_counter()
+        seed(collection, args.documents)
+        print(json.dumps({'seeded': args.documents, 'seconds': round(time.perf_counter() - started, 1)}))
+
+        print(json.dumps({'indexes': 'none', **measure(collection, args.documents, args.lookups)}))
+
+        started = time.perf_counter()
+        collection.create_indexes(short_url_indexes())
+        print(json.dumps({'index_build_seconds': round(time.perf_counter() - started, 1)}))
+
+        print(json.dumps({'indexes': 'provisioned', **measure(collection, args.documents, args.lookups * 20)}))
+    finally:
+        client.drop_database(BENCH_DATABASE)
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Overhead of the per-client rate limiter.
+
+Measures the cost of a single `RateLimiter.check` for one busy client, for requests spread
+over `--clients` clients and for a rejected request, and the time a reconciliation of that
+many clients takes against the in-process Memcache stand-in. It then drives redirects
+through `main.app` in-process with httpx with `--clients` API keys, without and with
+`RateLimitMiddleware` in front of the fast path, as `RATE_LIMIT_ENABLED=true` configures it,
+with budgets high enough that no request is rejected.
+
+    python -m benchmarks.bench_rate_limit --iterations 200000 --clients 10000 --requests 20000
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+
+import httpx
+
+from api import endpoints
+from api.fast_path import RedirectFastPath
+from api.instrumentation import MetricsMiddleware
+from api.rate_limit import RateLimitMiddleware
+from benchmarks.suite import drive
+from db.local_cache import LocalCache
+from main import app
+from processing.rate_limit import RateLimiter
+from processing.shortener import URLShortener
+from tests.fakes import FakeMemcache, FakeMongoDB
+
+# Budgets no benchmarked client exhausts
+UNLIMITED = {'shorten': (1e9, 1e9), 'redirect': (1e9, 1e9)}
+
+
+def per_call_ns(func, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return round((time.perf_counter() - started) / iterations * 1e9, 1)
+
+
+async def checks(args: argparse.Namespace) -> dict:
+    limiter = RateLimiter(FakeMemcache(), UNLIMITED)
+    clients = itertools.cycle([f'ip:10.0.{n // 256}.{n % 256}' for n in range(args.clients)])
+    exhausted = RateLimiter(FakeMemcache(), {'redirect': (1e-9, 1)})
+    exhausted.check('redirect', 'ip:10.0.0.1')
+    result = {
+        'one_client_ns': per_call_ns(lambda: limiter.check('redirect', 'ip:10.0.0.1'), args.iterations),
+        'many_clients_ns': per_call_ns(lambda: limiter.check('redirect', next(clients)), args.iterations),
+        'rejected_ns': per_call_ns(lambda: exhausted.check('redirect', 'ip:10.0.0.1'), args.iterations),
+    }
+    started = time.perf_counter()
+    await limiter.sync()
+    result['sync_ms'] = round((time.perf_counter() - started) * 1e3, 1)
+    result['synced_clients'] = args.clients
+    return result
+
+
+async def redirects(args: argparse.Namespace) -> list[dict]:
+    endpoints.shortener = URLShortener(FakeMongoDB(), FakeMemcache(), LocalCache())
+    endpoints.analytics = None
+    routes = [*app.routes, *endpoints.router.routes]
+    fast_path = RedirectFastPath(app, routes=routes)
+    apps = (('fast_path', MetricsMiddleware(fast_path, metrics=endpoints.metrics)),
+            ('rate_limited', MetricsMiddleware(RateLimitMiddleware(fast_path, routes=routes,
+                                                                   api_keys=map(str, range(args.clients))),
+                                               metrics=endpoints.metrics)))
+
+    results = []
+    codes: list[str] = []
+    for name, asgi_app in apps:
+        endpoints.rate_limiter = RateLimiter(FakeMemcache(), UNLIMITED) if name == 'rate_limited' else None
+        rng = random.Random(args.seed)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=asgi_app), base_url='http://bench') as client:
+            for n in range(args.keys - len(codes)):
+                response = await client.post('/shorten/', json={'original_url': f'https://example.com/{n}'})
+                codes.append(response.json()['short_url'].rsplit('/', 1)[-1])
+            # Each request comes from one of many API keys, as behind a load balancer
+            requests = [lambda code=rng.choice(codes), key=str(rng.randrange(args.clients)):
+                        client.get(f'/{code}', headers={'X-API-Key': key}) for _ in range(args.requests)]
+            results.append({'app': name, 'scenario': 'redirect', **await drive(client, requests, args.concurrency)})
+    endpoints.rate_limiter = None
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200000)
+    parser.add_argument('--clients', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--keys', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(checks(args))))
+    for result in asyncio.run(redirects(args)):
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
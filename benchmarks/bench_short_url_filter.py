@@ -0,0 +1,81 @@
+"""
+Memory, false positive rate and backend lookups saved by the short URL filter.
+
+Issues `--keys` short URLs through the allocator, builds a Bloom filter from them and
+reports its memory per million keys and the measured false positive rate. It then resolves
+a mix of issued short URLs and randomly guessed 7 character codes, the traffic of bots and
+mistyped links, through the shortener without and with the filter, against the in-process
+storage stand-ins, and reports the time per lookup and the Memcache and MongoDB calls made.
+
+    python -m benchmarks.bench_short_url_filter --keys 1000000 --lookups 100000 --unknown 0.3
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from processing.allocator import KeyAllocator
+from processing.encoder import BASE58_ALPHABET
+from processing.short_url_filter import ShortURLFilter
+from processing.shortener import URLShortener
+from tests.fakes import FakeMemcache, FakeMongoDB
+
+
+async def lookups(mongodb: FakeMongoDB, allocator: KeyAllocator, short_urls: list[str],
+                  code_filter: ShortURLFilter | None) -> dict:
+    memcache = FakeMemcache()
+    shortener = URLShortener(mongodb, memcache, negative_cache_ttl=0, code_filter=code_filter, allocator=allocator)
+    calls = mongodb.calls
+    started = time.perf_counter()
+    for short_url in short_urls:
+        try:
+            await shortener.get_original_url(short_url)
+        except ValueError:
+            pass
+    elapsed = time.perf_counter() - started
+    return {'filter': code_filter is not None, 'us_per_lookup': round(elapsed / len(short_urls) * 1e6, 2),
+            'mongodb_calls': mongodb.calls - calls, 'memcache_calls': memcache.calls,
+            'rejected': code_filter.rejected if code_filter else 0}
+
+
+async def run(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    mongodb = FakeMongoDB()
+    allocator = KeyAllocator(mongodb, block_size=10000, max_block_age=600)
+    expiration_date = datetime.now(timezone.utc) + timedelta(hours=1)
+    issued = [await allocator.allocate() for _ in range(args.keys)]
+    await mongodb.insert_short_urls([{'short_url': short_url, 'original_url': f'https://example.com/{i}',
+                                      'expiration_date': expiration_date} for i, short_url in enumerate(issued)])
+
+    code_filter = ShortURLFilter(mongodb, allocator, capacity=args.keys, error_rate=args.error_rate)
+    await code_filter.rebuild()
+    bloom = code_filter.bloom
+    guesses = [''.join(rng.choices(BASE58_ALPHABET, k=7)) for _ in range(args.lookups)]
+    started = time.perf_counter()
+    false_positives = sum(guess in bloom for guess in guesses)
+    probe_seconds = time.perf_counter() - started
+    print(json.dumps({'keys': bloom.count, 'mb_per_million_keys': round(bloom.memory / bloom.count * 1e6 / 2 ** 20, 2),
+                      'expected_error_rate': round(bloom.error_rate, 4),
+                      'measured_error_rate': round(false_positives / len(guesses), 4),
+                      'build_seconds': round(code_filter.build_seconds, 2),
+                      'us_per_probe': round(probe_seconds / len(guesses) * 1e6, 2)}))
+
+    mix = [rng.choice(guesses) if rng.random() < args.unknown else rng.choice(issued) for _ in range(args.lookups)]
+    for result in (await lookups(mongodb, allocator, mix, None), await lookups(mongodb, allocator, mix, code_filter)):
+        print(json.dumps(result))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--keys', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=100000)
+    parser.add_argument('--unknown', type=float, default=0.3, help='share of lookups of codes that were never issued')
+    parser.add_argument('--error-rate', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=42)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
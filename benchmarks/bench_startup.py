@@ -0,0 +1,47 @@
+"""
+Import time and time to first request of the application.
+
+Every run starts a fresh interpreter that imports `main`, runs the application's lifespan
+startup and answers `GET /` and `GET /metrics`, timing each step. The storage is the one
+configured through the environment; with no MongoDB reachable the startup shows how long
+an outage delays serving.
+
+    python -m benchmarks.bench_startup --runs 5
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+PROBE = '''
+import json, time
+from starlette.testclient import TestClient
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+with TestClient(main.app) as client:
+    ready = time.perf_counter()
+    client.get("/")
+    first = time.perf_counter()
+    client.get("/metrics")
+    second = time.perf_counter()
+print(json.dumps({"import_ms": (imported - started) * 1000, "startup_ms": (ready - imported) * 1000,
+                  "first_request_ms": (first - started) * 1000, "metrics_request_ms": (second - first) * 1000}))
+'''
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    runs = []
+    for _ in range(args.runs):
+        output = subprocess.run([sys.executable, '-c', PROBE], capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    print(json.dumps({key: round(statistics.median(run[key] for run in runs), 1) for key in runs[0]}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Throughput and latency of every storage backend on the operations of the shortener.
+
+Each backend is seeded with `--documents` short URLs through `insert_short_urls` in
+batches, then serves `--lookups` lookups by short URL, lookups by original URL and batch
+lookups of 100 short URLs at `--concurrency` in flight. SQLite runs on a file in a temporary
+directory; MongoDB runs in a scratch database when `--mongodb-uri` is given.
+
+    python -m benchmarks.bench_storage --documents 100000 --lookups 20000
+    python -m benchmarks.bench_storage --mongodb-uri mongodb://localhost:27017/
+"""
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from benchmarks.common import summarize, timed
+from db.mongodb import AsyncMongoDB
+from db.sqlite import SQLiteStorage
+
+BENCH_DATABASE = 'short_urls_bench'
+
+
+async def drive(calls: list, concurrency: int) -> dict:
+    latencies = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def send(call) -> None:
+        async with slots:
+            await timed(call, latencies)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(call) for call in calls))
+    return summarize(latencies, time.perf_counter() - started)
+
+
+async def bench(storage, args: argparse.Namespace) -> dict:
+    rng = random.Random(args.seed)
+    await storage.ensure_indexes()
+    expiration_date = datetime.now(timezone.utc) + timedelta(hours=72)
+    codes = [f'code{n}' for n in range(args.documents)]
+
+    started = time.perf_counter()
+    for start in range(0, args.documents, 1000):
+        await storage.insert_short_urls([
+            {'short_url': code, 'original_url': f'https://example.com/articles/{code}?utm_source=bench',
+             'expiration_date': expiration_date} for code in codes[start:start + 1000]])
+    results = {'insert_docs_per_second': round(args.documents / (time.perf_counter() - started), 1)}
+
+    results['lookup_by_short_url'] = await drive(
+        [lambda code=rng.choice(codes): storage.lookup_by_short_url(code) for _ in range(args.lookups)],
+        args.concurrency)
+    results['lookup_by_original_url'] = await drive(
+        [lambda code=rng.choice(codes): storage.lookup_by_original_url(f'https://example.com/articles/{code}'
+                                                                       f'?utm_source=bench')
+         for _ in range(args.lookups)], args.concurrency)
+    results['lookup_by_short_urls_100'] = await drive(
+        [lambda batch=rng.sample(codes, 100): storage.lookup_by_short_urls(batch) for _ in range(args.lookups // 100)],
+        args.concurrency)
+    return results
+
+
+async def run(args: argparse.Namespace) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        backends = {'sqlite': lambda: SQLiteStorage(str(Path(directory) / 'short_urls.db'))}
+        if args.mongodb_uri:
+            backends['mongodb'] = lambda: AsyncMongoDB(args.mongodb_uri)
+        for name, make in backends.items():
+            storage = make()
+            if name == 'mongodb':
+                await storage.client.drop_database(BENCH_DATABASE)
+                storage.collection = storage.lookup_collection = storage.client[BENCH_DATABASE]['short_urls']
+            try:
+                results[name] = await bench(storage, args)
+            finally:
+                if name == 'mongodb':
+                    await storage.client.drop_database(BENCH_DATABASE)
+                await storage.close_connection()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--mongodb-uri', help='also benchmark MongoDB, in a scratch database')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Index size and lookup latency of original URL lookups by raw URL and by digest.
+
+Seeds `--documents` short URLs with long, tracking-parameter laden original URLs into a
+scratch database of a local mongod, then for each way of indexing the original URL builds
+the index alone, reports its size from `collStats` and measures `find_one` lookups:
+
+- `raw`: an ascending index on the original URL itself
+- `hashed`: a hashed index on the original URL, the previous layout
+- `digest`: the index on the 16 byte digest of the canonical URL, the current layout
+
+    python -m benchmarks.bench_url_digest --uri mongodb://localhost:27017/ --documents 1000000
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING, HASHED, MongoClient
+
+from benchmarks.common import percentile
+from db.mongodb import with_url_digest
+from processing.canonical_url import url_digest
+
+BENCH_DATABASE = 'short_urls_bench'
+
+LAYOUTS = {
+    'raw': ([('original_url', ASCENDING)], lambda url: {'original_url': url}),
+    'hashed': ([('original_url', HASHED)], lambda url: {'original_url': url}),
+    'digest': ([('original_url_digest', ASCENDING)], lambda url: {'original_url_digest': url_digest(url)}),
+}
+
+
+def original_url(n: int) -> str:
+    return (f'https://shop.example.com/catalog/category-{n % 97}/product-{n}?utm_source=newsletter'
+            f'&utm_medium=email&utm_campaign=spring-sale-{n % 13}&fbclid=IwAR{n:012d}&ref=homepage-banner')
+
+
+def seed(collection, documents: int, batch_size: int = 10000) -> None:
+    expiration_date = datetime.now(timezone.utc) + timedelta(hours=72)
+    for start in range(0, documents, batch_size):
+        collection.insert_many([
+            with_url_digest({'short_url': f'code{n}', 'original_url': original_url(n),
+                             'expiration_date': expiration_date})
+            for n in range(start, min(start + batch_size, documents))
+        ], ordered=False)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uri', default='mongodb://localhost:27017/')
+    parser.add_argument('--documents', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    client = MongoClient(args.uri, serverSelectionTimeoutMS=2000)
+    client.drop_database(BENCH_DATABASE)
+    database = client[BENCH_DATABASE]
+    collection = database['short_urls']
+    try:
+        seed(collection, args.documents)
+        for layout, (keys, criteria) in LAYOUTS.items():
+            collection.create_index(keys, name=layout)
+            index_size = database.command('collStats', 'short_urls')['indexSizes'][layout]
+            latencies = []
+            for _ in range(args.lookups):
+                url = original_url(rng.randrange(args.documents))
+                started = time.perf_counter()
+                collection.find_one(criteria(url))
+                latencies.append(time.perf_counter() - started)
+            print(json.dumps({'layout': layout, 'index_mb': round(index_size / 2 ** 20, 1),
+                              'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+                              'p99_ms': round(percentile(latencies, 99) * 1000, 3)}))
+            collection.drop_index(layout)
+    finally:
+        client.drop_database(BENCH_DATABASE)
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import math
+import time
+from typing import Awaitable, Callable
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    """
+    Compute a percentile using the nearest-rank method.
+
+    Args:
+        samples (list[float]): The measured values.
+        pct (float): The percentile between 0 and 100.
+
+    Returns:
+        float: The percentile value, or 0.0 for an empty sample.
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies: list[float], elapsed: float) -> dict:
+    """
+    Summarize request latencies into throughput and percentiles in milliseconds.
+
+    Args:
+        latencies (list[float]): Per-request latencies in seconds.
+        elapsed (float): Wall clock duration of the run in seconds.
+
+    Returns:
+        dict: The request count, requests per second and p50/p90/p99/max latency.
+    """
+    return {
+        'requests': len(latencies),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p90_ms': round(percentile(latencies, 90) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(max(latencies, default=0.0) * 1000, 3),
+    }
+
+
+async def timed(call: Callable[[], Awaitable], latencies: list[float]) -> None:
+    """
+    Await a call and append its latency to `latencies`.
+
+    Args:
+        call (Callable): A zero argument coroutine function.
+        latencies (list[float]): The list collecting latencies in seconds.
+    """
+    started = time.perf_counter()
+    await call()
+    latencies.append(time.perf_counter() - started)
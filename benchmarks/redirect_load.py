@@ -0,0 +1,67 @@
+"""
+Redirect load test against a deliberately slow backend stand-in.
+
+Every redirect misses the cache and pays `--latency-ms` in the MongoDB stand-in. In
+`blocking` mode the stand-in sleeps synchronously, the way the pymongo client stalled the
+event loop before; in `async` mode it awaits, like `AsyncMongoDB` does. A small share of
+requests resolve from the cache, and their p99 shows how much they wait behind slow lookups.
+
+    python -m benchmarks.redirect_load --requests 400 --concurrency 50 --latency-ms 20
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from api import endpoints
+from benchmarks.common import summarize, timed
+from main import app
+from processing.shortener import URLShortener
+from tests.fakes import FakeMemcache, FakeMongoDB
+
+
+async def run(mode: str, requests: int, concurrency: int, latency: float) -> dict:
+    mongodb = FakeMongoDB(latency=latency, blocking=mode == 'blocking')
+    memcache = FakeMemcache()
+    endpoints.shortener = URLShortener(mongodb, memcache)
+
+    # Seed without latency, then keep only a few hot codes in the cache
+    mongodb.latency = 0.0
+    codes = [await endpoints.shortener.generate_short_url(f'https://example.com/{i}') for i in range(requests)]
+    hot = set(codes[::10])
+    memcache.values = {key: value for key, value in memcache.values.items() if key in hot}
+    mongodb.latency = latency
+
+    cold_latencies, hot_latencies = [], []
+    slots = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        async def redirect(code: str) -> None:
+            async with slots:
+                latencies = hot_latencies if code in hot else cold_latencies
+                await timed(lambda: client.get(f'/{code}', follow_redirects=False), latencies)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(redirect(code) for code in codes))
+        elapsed = time.perf_counter() - started
+
+    return {'mode': mode, 'all': summarize(cold_latencies + hot_latencies, elapsed),
+            'cache_hits': summarize(hot_latencies, elapsed)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    args = parser.parse_args()
+
+    for mode in ('blocking', 'async'):
+        result = asyncio.run(run(mode, args.requests, args.concurrency, args.latency_ms / 1000))
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
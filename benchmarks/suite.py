@@ -0,0 +1,192 @@
+"""
+Reproducible benchmark suite for the URL shortener.
+
+Drives `main.app` in-process through httpx for the redirect, shorten, fetch and delete
+paths with a configurable concurrency and key popularity distribution. By default the
+storage is replaced by in-process stand-ins of MongoDB and Memcache with injectable
+latency; `--backend real` uses the configured MongoDB and Memcache daemons instead.
+
+Results report throughput and latency percentiles per scenario. `--save` writes them as
+a baseline and `--compare` checks a run against a saved baseline, exiting with status 1
+when a scenario regressed by more than `--tolerance`.
+
+    python -m benchmarks.suite --save benchmarks/baseline.json
+    python -m benchmarks.suite --compare benchmarks/baseline.json --tolerance 0.25
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import sys
+import time
+
+import httpx
+
+from api import endpoints
+from benchmarks.common import summarize, timed
+from db.database import settings
+from db.local_cache import LocalCache
+from main import app
+from processing.allocator import KeyAllocator
+from processing.shortener import URLShortener
+from tests.fakes import FakeMemcache, FakeMongoDB
+
+SCENARIOS = ('generate_code', 'shorten', 'redirect', 'fetch', 'delete')
+
+
+def key_sampler(keys: list[str], skew: str, zipf_exponent: float, rng: random.Random):
+    """
+    Build a function drawing keys with the requested popularity distribution.
+
+    Args:
+        keys (list[str]): The keys to draw from, the first ones being the most popular.
+        skew (str): `uniform`, or `zipf` for a power law where the key of rank r has weight 1 / r^s.
+        zipf_exponent (float): The exponent s of the zipf distribution.
+        rng (random.Random): The seeded random generator.
+
+    Returns:
+        Callable: A zero argument function returning a key.
+    """
+    if skew == 'uniform':
+        return lambda: rng.choice(keys)
+    cum_weights = list(itertools.accumulate(1 / rank ** zipf_exponent for rank in range(1, len(keys) + 1)))
+    return lambda: rng.choices(keys, cum_weights=cum_weights)[0]
+
+
+async def drive(client: httpx.AsyncClient, requests: list, concurrency: int) -> dict:
+    """
+    Send requests with at most `concurrency` in flight and summarize their latencies.
+
+    Args:
+        client (httpx.AsyncClient): The client bound to the application.
+        requests (list): Zero argument coroutine functions each sending one request.
+        concurrency (int): Maximum number of requests in flight.
+
+    Returns:
+        dict: Throughput and latency percentiles.
+    """
+    latencies = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def send(request) -> None:
+        async with slots:
+            await timed(request, latencies)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(request) for request in requests))
+    return summarize(latencies, time.perf_counter() - started)
+
+
+async def run(args: argparse.Namespace) -> dict:
+    rng = random.Random(args.seed)
+    if args.backend == 'fake':
+        endpoints.shortener = URLShortener(FakeMongoDB(latency=args.mongo_latency_ms / 1000),
+                                           FakeMemcache(latency=args.memcache_latency_ms / 1000),
+                                           LocalCache(settings.local_cache_size, settings.local_cache_max_staleness),
+                                           negative_cache_ttl=settings.negative_cache_ttl)
+    shortener = endpoints.get_shortener()
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        if 'generate_code' in args.scenarios:
+            allocator = KeyAllocator(FakeMongoDB())
+            started = time.perf_counter()
+            for _ in range(args.requests):
+                await allocator.allocate()
+            elapsed = time.perf_counter() - started
+            results['generate_code'] = {'requests': args.requests, 'rps': round(args.requests / elapsed, 1)}
+
+        # Shortening creates the keys used by the other scenarios
+        original_urls = [f'https://example.com/{args.seed}/{n}' for n in range(args.keys)]
+        codes = []
+
+        async def shorten(original_url: str) -> None:
+            response = await client.post('/shorten/', json={'original_url': original_url})
+            codes.append(response.json()['short_url'].rsplit('/', 1)[-1])
+
+        results['shorten'] = await drive(client, [lambda url=url: shorten(url) for url in original_urls],
+                                         args.concurrency)
+        if 'shorten' not in args.scenarios:
+            del results['shorten']
+
+        codes.sort()
+        sample = key_sampler(codes, args.skew, args.zipf_exponent, rng)
+        if 'redirect' in args.scenarios:
+            results['redirect'] = await drive(
+                client, [lambda code=sample(): client.get(f'/{code}') for _ in range(args.requests)], args.concurrency)
+        if 'fetch' in args.scenarios:
+            results['fetch'] = await drive(
+                client, [lambda code=sample(): client.get('/shorten/', params={'short_url': code})
+                         for _ in range(args.requests)], args.concurrency)
+        if 'delete' in args.scenarios:
+            results['delete'] = await drive(
+                client, [lambda code=code: client.request('DELETE', '/shorten/', json={'short_url': code})
+                         for code in codes], args.concurrency)
+
+    if args.backend == 'fake':
+        results['backend_calls'] = {'mongodb': shortener.mongodb.calls, 'memcache': shortener.memcache.calls}
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Compare a run against a baseline.
+
+    Args:
+        results (dict): The scenario results of this run.
+        baseline (dict): The scenario results of the baseline run.
+        tolerance (float): Accepted relative degradation, e.g. 0.25 for 25%.
+
+    Returns:
+        list[str]: A description of every regression found.
+    """
+    regressions = []
+    for scenario, current in results.items():
+        previous = baseline.get(scenario)
+        if scenario not in SCENARIOS or not previous:
+            continue
+        if current['rps'] < previous['rps'] * (1 - tolerance):
+            regressions.append(f"{scenario}: throughput {current['rps']} < baseline {previous['rps']}")
+        if 'p99_ms' in current and current['p99_ms'] > previous['p99_ms'] * (1 + tolerance):
+            regressions.append(f"{scenario}: p99 {current['p99_ms']}ms > baseline {previous['p99_ms']}ms")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=('fake', 'real'), default='fake')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=5000, help='requests per read scenario')
+    parser.add_argument('--keys', type=int, default=1000, help='number of short URLs created')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--skew', choices=('uniform', 'zipf'), default='zipf')
+    parser.add_argument('--zipf-exponent', type=float, default=1.1)
+    parser.add_argument('--mongo-latency-ms', type=float, default=1.0)
+    parser.add_argument('--memcache-latency-ms', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', metavar='PATH', help='write the results as a baseline')
+    parser.add_argument('--compare', metavar='PATH', help='compare the results with a baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report = {'config': {key: value for key, value in vars(args).items() if key not in ('save', 'compare')},
+              'results': results}
+    print(json.dumps(report, indent=2))
+
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file)['results'], args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
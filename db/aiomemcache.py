@@ -0,0 +1,315 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterable
+
+# memcached interprets expiration times above 30 days as absolute unix timestamps
+MAX_RELATIVE_EXPIRATION = 60 * 60 * 24 * 30
+
+# memcached limits keys to 250 bytes without whitespace or control characters
+MAX_KEY_LENGTH = 250
+
+
+class MemcacheProtocolError(Exception):
+    """ Raised when memcached replies with something the client does not understand. """
+
+
+def is_valid_key(key: str) -> bool:
+    """
+    Check whether a key can be sent over the memcached text protocol.
+
+    Args:
+        key (str): The key to check.
+
+    Returns:
+        bool: True if the key is non-empty, at most 250 bytes and has no whitespace or control characters.
+    """
+    encoded = key.encode()
+    return 0 < len(encoded) <= MAX_KEY_LENGTH and all(byte > 32 and byte != 127 for byte in encoded)
+
+
+def to_exptime(expiration_time: float) -> int:
+    """
+    Convert a relative expiration time in seconds into the value memcached expects.
+
+    Args:
+        expiration_time (float): Number of seconds until the item expires, 0 means never.
+
+    Returns:
+        int: The relative expiration, or an absolute unix timestamp for expirations longer than 30 days.
+    """
+    if expiration_time <= 0:
+        return 0
+    # Round up so a fraction of a second does not turn into "never expires"
+    seconds = max(1, int(expiration_time + 0.999))
+    if seconds > MAX_RELATIVE_EXPIRATION:
+        return int(time.time()) + seconds
+    return seconds
+
+
+class MemcacheConnection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Wrap a single TCP connection to a memcached server.
+
+        Args:
+            reader (asyncio.StreamReader): The stream to read responses from.
+            writer (asyncio.StreamWriter): The stream to write commands to.
+        """
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, host: str, port: int) -> "MemcacheConnection":
+        """
+        Open a new connection to a memcached server.
+
+        Args:
+            host (str): The server host.
+            port (int): The server port.
+
+        Returns:
+            MemcacheConnection: The connected instance.
+        """
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def _readline(self) -> bytes:
+        line = await self.reader.readuntil(b'\r\n')
+        return line[:-2]
+
+    async def get_multi(self, keys: Iterable[str]) -> dict[str, bytes]:
+        """
+        Fetch several keys with a single `get` command.
+
+        Args:
+            keys (Iterable[str]): The keys to fetch.
+
+        Returns:
+            dict: The values found, keyed by their key. Missing keys are left out.
+        """
+        self.writer.write(b'get ' + ' '.join(keys).encode() + b'\r\n')
+        await self.writer.drain()
+
+        values = {}
+        while True:
+            line = await self._readline()
+            if line == b'END':
+                return values
+            parts = line.split()
+            if len(parts) < 4 or parts[0] != b'VALUE':
+                raise MemcacheProtocolError(f"Unexpected response to get: {line!r}")
+            data = await self.reader.readexactly(int(parts[3]) + 2)
+            values[parts[1].decode()] = data[:-2]
+
+    async def store(self, command: str, items: list[tuple[str, bytes, int]]) -> list[bool]:
+        """
+        Pipeline a batch of storage commands (`set`, `add`) and collect their replies.
+
+        Args:
+            command (str): The storage command to issue for every item.
+            items (list): Tuples of key, value and memcached expiration time.
+
+        Returns:
+            list: Whether each item was stored, in the order of `items`.
+        """
+        buffer = bytearray()
+        for key, value, exptime in items:
+            buffer += f'{command} {key} 0 {exptime} {len(value)}\r\n'.encode()
+            buffer += value + b'\r\n'
+        self.writer.write(bytes(buffer))
+        await self.writer.drain()
+
+        results = []
+        for _ in items:
+            line = await self._readline()
+            if line not in (b'STORED', b'NOT_STORED'):
+                raise MemcacheProtocolError(f"Unexpected response to {command}: {line!r}")
+            results.append(line == b'STORED')
+        return results
+
+    async def delete(self, key: str) -> bool:
+        """
+        Delete a key.
+
+        Args:
+            key (str): The key to delete.
+
+        Returns:
+            bool: True if the key existed.
+        """
+        self.writer.write(f'delete {key}\r\n'.encode())
+        await self.writer.drain()
+        line = await self._readline()
+        if line not in (b'DELETED', b'NOT_FOUND'):
+            raise MemcacheProtocolError(f"Unexpected response to delete: {line!r}")
+        return line == b'DELETED'
+
+    async def incr(self, key: str, delta: int) -> int | None:
+        """
+        Increment a numeric value in place.
+
+        Args:
+            key (str): The key of the value.
+            delta (int): The non-negative amount to add.
+
+        Returns:
+            int: The new value, or None if the key doesn't exist.
+        """
+        self.writer.write(f'incr {key} {delta}\r\n'.encode())
+        await self.writer.drain()
+        line = await self._readline()
+        if line == b'NOT_FOUND':
+            return None
+        if not line.isdigit():
+            raise MemcacheProtocolError(f"Unexpected response to incr: {line!r}")
+        return int(line)
+
+    def close(self) -> None:
+        """ Close the underlying socket. """
+        self.writer.close()
+
+
+class MemcacheProtocolClient:
+    def __init__(self, host: str, port: int, pool_size: int = 10, timeout: float = 1.0) -> None:
+        """
+        Initialize an asyncio memcached client for a single server.
+
+        Connections are opened lazily and reused through a bounded pool, so concurrent
+        coroutines never share a socket.
+
+        Args:
+            host (str): The server host.
+            port (int): The server port.
+            pool_size (int): Maximum number of open connections.
+            timeout (float): Seconds to wait for a command before giving up on the connection.
+        """
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._idle: list[MemcacheConnection] = []
+        self._slots: asyncio.Semaphore | None = None
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[MemcacheConnection]:
+        """
+        Borrow a connection from the pool for the duration of a command.
+
+        A connection that raised is closed instead of being returned, since its stream may
+        be left in the middle of a response.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool_size)
+        async with self._slots:
+            conn = self._idle.pop() if self._idle else await asyncio.wait_for(
+                MemcacheConnection.open(self.host, self.port), self.timeout)
+            try:
+                yield conn
+            except BaseException:
+                conn.close()
+                raise
+            self._idle.append(conn)
+
+    async def get_multi(self, keys: list[str]) -> dict[str, bytes]:
+        """
+        Fetch several keys in one round trip.
+
+        Args:
+            keys (list[str]): The keys to fetch.
+
+        Returns:
+            dict: The values found, keyed by their key.
+        """
+        if not keys:
+            return {}
+        async with self.connection() as conn:
+            return await asyncio.wait_for(conn.get_multi(keys), self.timeout)
+
+    async def get(self, key: str) -> bytes | None:
+        """
+        Fetch a single key.
+
+        Args:
+            key (str): The key to fetch.
+
+        Returns:
+            bytes: The value, or None if the key doesn't exist.
+        """
+        return (await self.get_multi([key])).get(key)
+
+    async def set_multi(self, items: list[tuple[str, bytes, int]]) -> list[bool]:
+        """
+        Store several items in one round trip.
+
+        Args:
+            items (list): Tuples of key, value and memcached expiration time.
+
+        Returns:
+            list: Whether each item was stored.
+        """
+        if not items:
+            return []
+        async with self.connection() as conn:
+            return await asyncio.wait_for(conn.store('set', items), self.timeout)
+
+    async def set(self, key: str, value: bytes, exptime: int) -> bool:
+        """
+        Store a single item.
+
+        Args:
+            key (str): The key to set.
+            value (bytes): The value to set.
+            exptime (int): The memcached expiration time.
+
+        Returns:
+            bool: True if the item was stored.
+        """
+        return (await self.set_multi([(key, value, exptime)]))[0]
+
+    async def add(self, key: str, value: bytes, exptime: int) -> bool:
+        """
+        Store a single item unless the key exists already.
+
+        Args:
+            key (str): The key to add.
+            value (bytes): The value to set.
+            exptime (int): The memcached expiration time.
+
+        Returns:
+            bool: True if the item was stored, False if the key exists.
+        """
+        async with self.connection() as conn:
+            return (await asyncio.wait_for(conn.store('add', [(key, value, exptime)]), self.timeout))[0]
+
+    async def delete(self, key: str) -> bool:
+        """
+        Delete a single key.
+
+        Args:
+            key (str): The key to delete.
+
+        Returns:
+            bool: True if the key existed.
+        """
+        async with self.connection() as conn:
+            return await asyncio.wait_for(conn.delete(key), self.timeout)
+
+    async def incr(self, key: str, delta: int) -> int | None:
+        """
+        Increment a numeric value in place.
+
+        Args:
+            key (str): The key of the value.
+            delta (int): The non-negative amount to add.
+
+        Returns:
+            int: The new value, or None if the key doesn't exist.
+        """
+        async with self.connection() as conn:
+            return await asyncio.wait_for(conn.incr(key, delta), self.timeout)
+
+    def close(self) -> None:
+        """ Close every idle connection in the pool. """
+        while self._idle:
+            self._idle.pop().close()
@@ -1,14 +1,368 @@
 import os
+from dataclasses import dataclass, field
+from functools import cached_property
 
-from db.memcache import Memcache
-from db.mongodb import MongoDB
+from db.local_cache import LocalCache
+from db.memcache import AsyncMemcache
+from db.mongodb import AsyncMongoDB
+from db.sharding import ShardedStorage, parse_shard_layout
+from db.sqlite import SQLiteStorage
+from db.storage import StorageBackend
+from processing.allocator import KeyAllocator
+from processing.analytics import ClickAnalytics
+from processing.circuit_breaker import CircuitBreaker
+from processing.purge import HTTPPurger
+from processing.rate_limit import RateLimiter
+from processing.short_url_filter import ShortURLFilter
+from processing.warmup import CacheWarmer
+from processing.write_behind import ExpiryWriteBehind
 
-# Create an instance of MongoDB using the connection string
+# The MongoDB connection string
 # Check if the endpoint is present in an environment variable MONGODB_URI
 MONGODB_URI = os.environ.get('MONGODB_URI', "mongodb://localhost:27017/")
-mongodb = MongoDB(MONGODB_URI)
+# MONGODB_FILTER_EXPIRED excludes expired short URLs in the query itself, and MONGODB_TTL_GRACE_SECONDS
+# is how long after expiring a document is removed by MongoDB's TTL monitor (an empty value disables removal)
+MONGODB_FILTER_EXPIRED = os.environ.get('MONGODB_FILTER_EXPIRED', 'false').lower() == 'true'
+MONGODB_TTL_GRACE_SECONDS = os.environ.get('MONGODB_TTL_GRACE_SECONDS', '0')
+MONGODB_TTL = int(MONGODB_TTL_GRACE_SECONDS) if MONGODB_TTL_GRACE_SECONDS else None
+# MONGODB_READ_PREFERENCE routes short URL lookups, e.g. to secondaries with `secondaryPreferred`,
+# while writes stay on the primary. The remaining variables size the connection pool, bound how
+# many milliseconds a request waits for a pooled connection, a server and a reply, and list the
+# wire compressors to negotiate (`zlib`, or `snappy` and `zstd` with their packages installed)
+MONGODB_READ_PREFERENCE = os.environ.get('MONGODB_READ_PREFERENCE', 'primary')
+MONGODB_CLIENT_OPTIONS = {
+    'maxPoolSize': int(os.environ.get('MONGODB_MAX_POOL_SIZE', 100)),
+    'minPoolSize': int(os.environ.get('MONGODB_MIN_POOL_SIZE', 0)),
+    'waitQueueTimeoutMS': int(os.environ.get('MONGODB_WAIT_QUEUE_TIMEOUT_MS', 1000)),
+    'serverSelectionTimeoutMS': int(os.environ.get('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 2000)),
+    'connectTimeoutMS': int(os.environ.get('MONGODB_CONNECT_TIMEOUT_MS', 2000)),
+    'socketTimeoutMS': int(os.environ.get('MONGODB_SOCKET_TIMEOUT_MS', 2000)),
+}
+if os.environ.get('MONGODB_COMPRESSORS'):
+    MONGODB_CLIENT_OPTIONS['compressors'] = os.environ['MONGODB_COMPRESSORS']
 
-# Create an instance of Memcache using the connection string
-# Check if the endpoint is present in an environment variable MEMCACHE_URI
+# MONGODB_SHARD_URIS spreads short URLs across several MongoDB deployments, a space separated list of
+# connection strings replacing MONGODB_URI, each named `name=uri` or else after its position, `shard0`
+# and so on. The names place short URLs, so they must not change. The first one also keeps the sequence
+# counters and click counts. While `python -m db.rebalance` moves documents to a new list of shards,
+# MONGODB_PREVIOUS_SHARD_URIS lists the old ones, so lookups of documents that were not moved yet fall back to them
+MONGODB_SHARD_URIS = tuple(os.environ.get('MONGODB_SHARD_URIS', '').split())
+MONGODB_PREVIOUS_SHARD_URIS = tuple(os.environ.get('MONGODB_PREVIOUS_SHARD_URIS', '').split())
+
+# STORAGE_BACKEND selects where short URLs are stored: `mongodb`, or `sqlite` for an embedded database
+# in the file SQLITE_PATH shared by the workers of a node, for edge nodes and CI without a mongod.
+# SQLite deletes short URLs SQLITE_TTL_GRACE_SECONDS after they expire (an empty value keeps them)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongodb')
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'url_shortener.db')
+SQLITE_TTL_GRACE_SECONDS = os.environ.get('SQLITE_TTL_GRACE_SECONDS', '0')
+SQLITE_TTL = int(SQLITE_TTL_GRACE_SECONDS) if SQLITE_TTL_GRACE_SECONDS else None
+
+# MONGODB_BREAKER_THRESHOLD consecutive storage failures make redirects that miss the cache fail
+# fast for MONGODB_BREAKER_RESET seconds, after which a single request probes MongoDB again
+MONGODB_BREAKER_THRESHOLD = int(os.environ.get('MONGODB_BREAKER_THRESHOLD', 5))
+MONGODB_BREAKER_RESET = float(os.environ.get('MONGODB_BREAKER_RESET', 30))
+
+# The Memcache connection string
+# Check if the endpoint is present in an environment variable MEMCACHE_URI, a comma separated
+# list of servers to spread keys over. MEMCACHE_POOL_SIZE bounds the connections per server,
+# MEMCACHE_TIMEOUT is how many seconds a server may take to answer, MEMCACHE_FAILURE_THRESHOLD how
+# many times in a row it may fail before it is skipped and MEMCACHE_RETRY_INTERVAL for how many seconds
 MEMCACHE_URI = os.environ.get('MEMCACHE_URI', "localhost:11211")
-memcache = Memcache(MEMCACHE_URI)
+MEMCACHE_POOL_SIZE = int(os.environ.get('MEMCACHE_POOL_SIZE', 10))
+MEMCACHE_TIMEOUT = float(os.environ.get('MEMCACHE_TIMEOUT', 1))
+MEMCACHE_RETRY_INTERVAL = float(os.environ.get('MEMCACHE_RETRY_INTERVAL', 30))
+MEMCACHE_FAILURE_THRESHOLD = int(os.environ.get('MEMCACHE_FAILURE_THRESHOLD', 3))
+
+# Size of the per-worker cache that sits in front of Memcache for redirects
+# LOCAL_CACHE_SIZE bounds the number of entries (0 disables it) and LOCAL_CACHE_MAX_STALENESS
+# bounds how many seconds a deletion made through another worker can go unnoticed
+LOCAL_CACHE_SIZE = int(os.environ.get('LOCAL_CACHE_SIZE', 10000))
+LOCAL_CACHE_MAX_STALENESS = float(os.environ.get('LOCAL_CACHE_MAX_STALENESS', 30))
+
+# Short URLs are handed out from blocks of sequence numbers leased from MongoDB
+# SHORT_URL_BLOCK_SIZE is the number of short URLs a worker leases per round trip,
+# SHORT_URL_LENGTH the fixed length of generated short URLs and SHORT_URL_MAX_BLOCK_AGE how
+# many seconds a worker uses a leased block at most (empty for no limit)
+SHORT_URL_BLOCK_SIZE = int(os.environ.get('SHORT_URL_BLOCK_SIZE', 1000))
+SHORT_URL_LENGTH = int(os.environ.get('SHORT_URL_LENGTH', 7))
+SHORT_URL_MAX_BLOCK_AGE_SECONDS = os.environ.get('SHORT_URL_MAX_BLOCK_AGE', '600')
+SHORT_URL_MAX_BLOCK_AGE = float(SHORT_URL_MAX_BLOCK_AGE_SECONDS) if SHORT_URL_MAX_BLOCK_AGE_SECONDS else None
+
+# SHORT_URL_FILTER keeps a Bloom filter of the issued short URLs in every worker, sized for at least
+# SHORT_URL_FILTER_CAPACITY short URLs at a false positive rate of SHORT_URL_FILTER_ERROR_RATE and rebuilt
+# from storage every SHORT_URL_FILTER_REBUILD_INTERVAL seconds, so redirects of short URLs that were never
+# issued are answered with 404 without reaching Memcache or MongoDB
+SHORT_URL_FILTER = os.environ.get('SHORT_URL_FILTER', 'false').lower() == 'true'
+SHORT_URL_FILTER_CAPACITY = int(os.environ.get('SHORT_URL_FILTER_CAPACITY', 1000000))
+SHORT_URL_FILTER_ERROR_RATE = float(os.environ.get('SHORT_URL_FILTER_ERROR_RATE', 0.01))
+SHORT_URL_FILTER_REBUILD_INTERVAL = float(os.environ.get('SHORT_URL_FILTER_REBUILD_INTERVAL', 600))
+
+# NEGATIVE_CACHE_TTL is how many seconds a short URL that does not exist or has expired is
+# remembered as missing, so repeated requests for it don't reach MongoDB (0 disables it)
+NEGATIVE_CACHE_TTL = float(os.environ.get('NEGATIVE_CACHE_TTL', 30))
+
+# MEMCACHE_TTL is how many seconds a mapping is served from Memcache before it is read from MongoDB
+# again (0 keeps it until the short URL expires). STALE_CACHE_TTL is how many seconds a separate stale
+# copy of it is kept, to be served while MongoDB is unreachable (0 disables stale serving)
+MEMCACHE_TTL = float(os.environ.get('MEMCACHE_TTL', 3600))
+STALE_CACHE_TTL = float(os.environ.get('STALE_CACHE_TTL', 7 * 24 * 3600))
+
+# EXPIRY_WRITE_BEHIND buffers the expiry extensions of re-shortened URLs and writes them every
+# EXPIRY_FLUSH_INTERVAL seconds, skipping extensions smaller than EXPIRY_MIN_EXTENSION seconds
+EXPIRY_WRITE_BEHIND = os.environ.get('EXPIRY_WRITE_BEHIND', 'false').lower() == 'true'
+EXPIRY_FLUSH_INTERVAL = float(os.environ.get('EXPIRY_FLUSH_INTERVAL', 5))
+EXPIRY_MIN_EXTENSION = float(os.environ.get('EXPIRY_MIN_EXTENSION', 3600))
+
+# ANALYTICS_ENABLED counts the clicks on every short URL per ANALYTICS_BUCKET_SECONDS long time bucket.
+# Each worker aggregates them in memory and adds them to MongoDB every ANALYTICS_FLUSH_INTERVAL seconds;
+# beyond ANALYTICS_MAX_PENDING buffered counters new clicks are dropped rather than delaying redirects
+ANALYTICS_ENABLED = os.environ.get('ANALYTICS_ENABLED', 'false').lower() == 'true'
+ANALYTICS_FLUSH_INTERVAL = float(os.environ.get('ANALYTICS_FLUSH_INTERVAL', 10))
+ANALYTICS_BUCKET_SECONDS = int(os.environ.get('ANALYTICS_BUCKET_SECONDS', 3600))
+ANALYTICS_MAX_PENDING = int(os.environ.get('ANALYTICS_MAX_PENDING', 100000))
+
+# CACHE_WARMUP_ON_STARTUP loads the CACHE_WARMUP_TOP most clicked short URLs of the last CACHE_WARMUP_HOURS
+# and the CACHE_WARMUP_RECENT most recent ones into the caches when a worker starts, unless another worker
+# of the deploy just did; POST /admin/warmup runs it on demand. Documents are read CACHE_WARMUP_BATCH_SIZE
+# at a time and at most CACHE_WARMUP_RATE per second (0 for no limit)
+CACHE_WARMUP_ON_STARTUP = os.environ.get('CACHE_WARMUP_ON_STARTUP', 'true').lower() == 'true'
+CACHE_WARMUP_TOP = int(os.environ.get('CACHE_WARMUP_TOP', 1000))
+CACHE_WARMUP_RECENT = int(os.environ.get('CACHE_WARMUP_RECENT', 10000))
+CACHE_WARMUP_HOURS = float(os.environ.get('CACHE_WARMUP_HOURS', 24))
+CACHE_WARMUP_BATCH_SIZE = int(os.environ.get('CACHE_WARMUP_BATCH_SIZE', 500))
+CACHE_WARMUP_RATE = float(os.environ.get('CACHE_WARMUP_RATE', 5000))
+
+# REDIRECT_FAST_PATH answers redirects and the index page before FastAPI's routing
+REDIRECT_FAST_PATH = os.environ.get('REDIRECT_FAST_PATH', 'false').lower() == 'true'
+
+# REDIRECT_STATUS is the status of redirects, 301, 302, 307 or 308. With REDIRECT_CACHE_MAX_AGE above 0,
+# browsers and CDNs may cache a redirect for the remaining lifetime of its short URL, but at most that many
+# seconds, while links expiring within REDIRECT_CACHE_MIN_LIFETIME seconds are sent with no-store
+REDIRECT_STATUS = int(os.environ.get('REDIRECT_STATUS', 307))
+REDIRECT_CACHE_MAX_AGE = float(os.environ.get('REDIRECT_CACHE_MAX_AGE', 0))
+REDIRECT_CACHE_MIN_LIFETIME = float(os.environ.get('REDIRECT_CACHE_MIN_LIFETIME', 300))
+
+# CDN_PURGE_URL is the address of a CDN or caching proxy in front of the application, which is sent a
+# CDN_PURGE_METHOD request for the redirect of every deleted short URL
+CDN_PURGE_URL = os.environ.get('CDN_PURGE_URL', '')
+CDN_PURGE_METHOD = os.environ.get('CDN_PURGE_METHOD', 'PURGE')
+
+# RATE_LIMIT_ENABLED gives every client, identified by its RATE_LIMIT_API_KEY_HEADER when it carries one
+# of the space separated RATE_LIMIT_API_KEYS or else by its IP address, a budget of RATE_LIMIT_SHORTEN_RATE
+# shortened URLs and RATE_LIMIT_REDIRECT_RATE redirects per second with bursts of the matching _BURST (a
+# rate of 0 leaves that budget unlimited). Each worker enforces them in memory on at most
+# RATE_LIMIT_MAX_CLIENTS clients and adds the requests it admitted to shared Memcache counters every
+# RATE_LIMIT_SYNC_INTERVAL seconds, blocking clients over budget summed over all workers until the end
+# of the RATE_LIMIT_WINDOW seconds window
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'false').lower() == 'true'
+RATE_LIMIT_SHORTEN_RATE = float(os.environ.get('RATE_LIMIT_SHORTEN_RATE', 5))
+RATE_LIMIT_SHORTEN_BURST = float(os.environ.get('RATE_LIMIT_SHORTEN_BURST', 50))
+RATE_LIMIT_REDIRECT_RATE = float(os.environ.get('RATE_LIMIT_REDIRECT_RATE', 100))
+RATE_LIMIT_REDIRECT_BURST = float(os.environ.get('RATE_LIMIT_REDIRECT_BURST', 500))
+RATE_LIMIT_SYNC_INTERVAL = float(os.environ.get('RATE_LIMIT_SYNC_INTERVAL', 1))
+RATE_LIMIT_WINDOW = float(os.environ.get('RATE_LIMIT_WINDOW', 60))
+RATE_LIMIT_API_KEY_HEADER = os.environ.get('RATE_LIMIT_API_KEY_HEADER', 'X-API-Key')
+RATE_LIMIT_API_KEYS = tuple(os.environ.get('RATE_LIMIT_API_KEYS', '').split())
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get('RATE_LIMIT_MAX_CLIENTS', 100000))
+
+# ADMIN_TOKEN is the bearer token required by the /admin endpoints, which are disabled without one
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    The configuration of the application, read from the environment variables above by default.
+
+    Tests and tools can build their own, e.g. `Settings(memcache_uri='127.0.0.1:11311')`.
+    """
+    mongodb_uri: str = MONGODB_URI
+    mongodb_filter_expired: bool = MONGODB_FILTER_EXPIRED
+    mongodb_ttl: int | None = MONGODB_TTL
+    mongodb_read_preference: str = MONGODB_READ_PREFERENCE
+    mongodb_client_options: dict = field(default_factory=lambda: dict(MONGODB_CLIENT_OPTIONS))
+    mongodb_shard_uris: tuple[str, ...] = MONGODB_SHARD_URIS
+    mongodb_previous_shard_uris: tuple[str, ...] = MONGODB_PREVIOUS_SHARD_URIS
+    storage_backend: str = STORAGE_BACKEND
+    sqlite_path: str = SQLITE_PATH
+    sqlite_ttl: int | None = SQLITE_TTL
+    mongodb_breaker_threshold: int = MONGODB_BREAKER_THRESHOLD
+    mongodb_breaker_reset: float = MONGODB_BREAKER_RESET
+    memcache_uri: str = MEMCACHE_URI
+    memcache_pool_size: int = MEMCACHE_POOL_SIZE
+    memcache_timeout: float = MEMCACHE_TIMEOUT
+    memcache_retry_interval: float = MEMCACHE_RETRY_INTERVAL
+    memcache_failure_threshold: int = MEMCACHE_FAILURE_THRESHOLD
+    memcache_ttl: float = MEMCACHE_TTL
+    stale_cache_ttl: float = STALE_CACHE_TTL
+    local_cache_size: int = LOCAL_CACHE_SIZE
+    local_cache_max_staleness: float = LOCAL_CACHE_MAX_STALENESS
+    short_url_block_size: int = SHORT_URL_BLOCK_SIZE
+    short_url_length: int = SHORT_URL_LENGTH
+    short_url_max_block_age: float | None = SHORT_URL_MAX_BLOCK_AGE
+    short_url_filter: bool = SHORT_URL_FILTER
+    short_url_filter_capacity: int = SHORT_URL_FILTER_CAPACITY
+    short_url_filter_error_rate: float = SHORT_URL_FILTER_ERROR_RATE
+    short_url_filter_rebuild_interval: float = SHORT_URL_FILTER_REBUILD_INTERVAL
+    negative_cache_ttl: float = NEGATIVE_CACHE_TTL
+    expiry_write_behind: bool = EXPIRY_WRITE_BEHIND
+    expiry_flush_interval: float = EXPIRY_FLUSH_INTERVAL
+    expiry_min_extension: float = EXPIRY_MIN_EXTENSION
+    analytics_enabled: bool = ANALYTICS_ENABLED
+    analytics_flush_interval: float = ANALYTICS_FLUSH_INTERVAL
+    analytics_bucket_seconds: int = ANALYTICS_BUCKET_SECONDS
+    analytics_max_pending: int = ANALYTICS_MAX_PENDING
+    cache_warmup_on_startup: bool = CACHE_WARMUP_ON_STARTUP
+    cache_warmup_top: int = CACHE_WARMUP_TOP
+    cache_warmup_recent: int = CACHE_WARMUP_RECENT
+    cache_warmup_hours: float = CACHE_WARMUP_HOURS
+    cache_warmup_batch_size: int = CACHE_WARMUP_BATCH_SIZE
+    cache_warmup_rate: float = CACHE_WARMUP_RATE
+    redirect_fast_path: bool = REDIRECT_FAST_PATH
+    redirect_status: int = REDIRECT_STATUS
+    redirect_cache_max_age: float = REDIRECT_CACHE_MAX_AGE
+    redirect_cache_min_lifetime: float = REDIRECT_CACHE_MIN_LIFETIME
+    cdn_purge_url: str = CDN_PURGE_URL
+    cdn_purge_method: str = CDN_PURGE_METHOD
+    rate_limit_enabled: bool = RATE_LIMIT_ENABLED
+    rate_limit_shorten_rate: float = RATE_LIMIT_SHORTEN_RATE
+    rate_limit_shorten_burst: float = RATE_LIMIT_SHORTEN_BURST
+    rate_limit_redirect_rate: float = RATE_LIMIT_REDIRECT_RATE
+    rate_limit_redirect_burst: float = RATE_LIMIT_REDIRECT_BURST
+    rate_limit_sync_interval: float = RATE_LIMIT_SYNC_INTERVAL
+    rate_limit_window: float = RATE_LIMIT_WINDOW
+    rate_limit_api_key_header: str = RATE_LIMIT_API_KEY_HEADER
+    rate_limit_api_keys: tuple[str, ...] = RATE_LIMIT_API_KEYS
+    rate_limit_max_clients: int = RATE_LIMIT_MAX_CLIENTS
+    admin_token: str = ADMIN_TOKEN
+
+
+settings = Settings()
+
+
+class Backends:
+    def __init__(self, settings: Settings = settings) -> None:
+        """
+        Initialize the storage clients of one worker, each created on first use.
+
+        Nothing connects when the application is imported, so a server that forks its
+        workers after importing it gives every worker its own connection pools and
+        monitoring threads instead of sharing the parent's. Only clients that were used
+        are closed again.
+
+        Args:
+            settings (Settings): The configuration of the clients.
+        """
+        self.settings = settings
+        # The process that created the clients, which must not be used from a forked child
+        self.pid = os.getpid()
+
+    @cached_property
+    def async_mongodb(self) -> AsyncMongoDB:
+        s = self.settings
+        return AsyncMongoDB(s.mongodb_uri, s.mongodb_filter_expired, s.mongodb_ttl, s.mongodb_read_preference,
+                            **s.mongodb_client_options)
+
+    @cached_property
+    def sharded_mongodb(self) -> ShardedStorage:
+        s = self.settings
+        shard_uris, previous_shard_uris = parse_shard_layout(s.mongodb_shard_uris, s.mongodb_previous_shard_uris)
+        clients = {name: AsyncMongoDB(uri, s.mongodb_filter_expired, s.mongodb_ttl, s.mongodb_read_preference,
+                                      **s.mongodb_client_options)
+                   for name, uri in {**previous_shard_uris, **shard_uris}.items()}
+        return ShardedStorage({name: clients[name] for name in shard_uris},
+                              {name: clients[name] for name in previous_shard_uris})
+
+    @cached_property
+    def sqlite(self) -> SQLiteStorage:
+        return SQLiteStorage(self.settings.sqlite_path, self.settings.sqlite_ttl)
+
+    @cached_property
+    def storage(self) -> StorageBackend:
+        """ The storage backend selected by `storage_backend`. """
+        if self.settings.storage_backend == 'sqlite':
+            return self.sqlite
+        if self.settings.storage_backend == 'mongodb':
+            return self.sharded_mongodb if self.settings.mongodb_shard_uris else self.async_mongodb
+        raise ValueError(f"Unknown storage backend {self.settings.storage_backend!r}")
+
+    @cached_property
+    def mongodb_breaker(self) -> CircuitBreaker:
+        return CircuitBreaker(self.settings.mongodb_breaker_threshold, self.settings.mongodb_breaker_reset,
+                              self.storage.unavailable_errors)
+
+    @cached_property
+    def async_memcache(self) -> AsyncMemcache:
+        s = self.settings
+        return AsyncMemcache(s.memcache_uri, s.memcache_pool_size, s.memcache_timeout, s.memcache_retry_interval,
+                             s.memcache_failure_threshold)
+
+    @cached_property
+    def local_cache(self) -> LocalCache:
+        return LocalCache(self.settings.local_cache_size, self.settings.local_cache_max_staleness)
+
+    @cached_property
+    def key_allocator(self) -> KeyAllocator:
+        s = self.settings
+        return KeyAllocator(self.storage, s.short_url_block_size, s.short_url_length, s.short_url_max_block_age)
+
+    @cached_property
+    def short_url_filter(self) -> ShortURLFilter | None:
+        s = self.settings
+        if not s.short_url_filter:
+            return None
+        return ShortURLFilter(self.storage, self.key_allocator, s.short_url_filter_capacity,
+                              s.short_url_filter_error_rate, s.short_url_filter_rebuild_interval)
+
+    @cached_property
+    def expiry_write_behind(self) -> ExpiryWriteBehind | None:
+        s = self.settings
+        if not s.expiry_write_behind:
+            return None
+        return ExpiryWriteBehind(self.storage, self.async_memcache, s.expiry_flush_interval,
+                                 s.expiry_min_extension, s.memcache_ttl, s.stale_cache_ttl)
+
+    @cached_property
+    def click_analytics(self) -> ClickAnalytics | None:
+        s = self.settings
+        if not s.analytics_enabled:
+            return None
+        return ClickAnalytics(self.storage, s.analytics_flush_interval, s.analytics_bucket_seconds,
+                              s.analytics_max_pending)
+
+    @cached_property
+    def cache_warmer(self) -> CacheWarmer:
+        s = self.settings
+        return CacheWarmer(self.storage, self.async_memcache, self.local_cache, s.cache_warmup_top,
+                           s.cache_warmup_recent, s.cache_warmup_hours, s.cache_warmup_batch_size,
+                           s.cache_warmup_rate, s.memcache_ttl, s.stale_cache_ttl)
+
+    @cached_property
+    def cdn_purger(self) -> HTTPPurger | None:
+        if not self.settings.cdn_purge_url:
+            return None
+        return HTTPPurger(self.settings.cdn_purge_url, self.settings.cdn_purge_method)
+
+    @cached_property
+    def rate_limiter(self) -> RateLimiter | None:
+        s = self.settings
+        if not s.rate_limit_enabled:
+            return None
+        budgets = {'shorten': (s.rate_limit_shorten_rate, s.rate_limit_shorten_burst),
+                   'redirect': (s.rate_limit_redirect_rate, s.rate_limit_redirect_burst)}
+        return RateLimiter(self.async_memcache, budgets, s.rate_limit_sync_interval, s.rate_limit_window,
+                           s.rate_limit_max_clients)
+
+    async def close(self) -> None:
+        """ Close the connections of the clients that were created. """
+        created = vars(self)
+        if created.get('cdn_purger'):
+            await self.cdn_purger.close()
+        if 'async_mongodb' in created:
+            await self.async_mongodb.close_connection()
+        if 'sharded_mongodb' in created:
+            await self.sharded_mongodb.close_connection()
+        if 'sqlite' in created:
+            await self.sqlite.close_connection()
+        if 'async_memcache' in created:
+            self.async_memcache.close_connection()
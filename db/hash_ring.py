@@ -0,0 +1,65 @@
+import hashlib
+from bisect import bisect
+from typing import Iterator
+
+
+class HashRing:
+    def __init__(self, nodes: list[str], replicas: int = 160) -> None:
+        """
+        Initialize a consistent hash ring distributing keys across nodes.
+
+        Every node is placed on the ring at `replicas` points derived from MD5, the way ketama
+        does it, and a key belongs to the first node clockwise from its own hash. Adding or
+        removing one of N nodes therefore only moves about 1/N of the keys.
+
+        Args:
+            nodes (list[str]): The node names.
+            replicas (int): Number of ring points per node, a multiple of 4.
+        """
+        self.nodes = list(dict.fromkeys(nodes))
+        points = []
+        for node in self.nodes:
+            for replica in range(replicas // 4):
+                digest = hashlib.md5(f'{node}-{replica}'.encode()).digest()
+                # Every 16 byte digest yields four 32 bit points
+                points.extend((int.from_bytes(digest[i:i + 4], 'little'), node) for i in range(0, 16, 4))
+        points.sort()
+        self.hashes = [point for point, _ in points]
+        self.owners = [node for _, node in points]
+
+    @staticmethod
+    def hash_key(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:4], 'little')
+
+    def get_node(self, key: str) -> str:
+        """
+        Find the node owning a key.
+
+        Args:
+            key (str): The key.
+
+        Returns:
+            str: The node name.
+        """
+        index = bisect(self.hashes, self.hash_key(key)) % len(self.hashes)
+        return self.owners[index]
+
+    def iter_nodes(self, key: str) -> Iterator[str]:
+        """
+        Iterate over all nodes in the order they take over a key, starting with its owner.
+
+        Args:
+            key (str): The key.
+
+        Yields:
+            str: Distinct node names.
+        """
+        start = bisect(self.hashes, self.hash_key(key))
+        seen = set()
+        for offset in range(len(self.hashes)):
+            node = self.owners[(start + offset) % len(self.hashes)]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self.nodes):
+                    return
@@ -0,0 +1,94 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+
+class LocalCache:
+    def __init__(self, max_size: int = 10000, max_staleness: float = 30.0,
+                 clock: Callable[[], float] = time.time) -> None:
+        """
+        Initialize a bounded in-process cache with LRU eviction and per-entry expiry.
+
+        Entries live until the earlier of their own expiry and `max_staleness` seconds after
+        they were stored, so a change made by another worker is picked up within that window.
+
+        Args:
+            max_size (int): Maximum number of entries, 0 disables the cache.
+            max_staleness (float): Maximum number of seconds an entry is served without a refresh.
+            clock (Callable): Returns the current unix time, injectable for tests.
+        """
+        self.max_size = max_size
+        self.max_staleness = max_staleness
+        self.clock = clock
+        self.entries: OrderedDict[str, tuple[Any, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Any | None:
+        """
+        Retrieve a value if it is present and still fresh.
+
+        Args:
+            key (str): The key of the value.
+
+        Returns:
+            The cached value, or None on a miss.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, deadline = entry
+        if deadline <= self.clock():
+            del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, expires_at: float | None = None) -> None:
+        """
+        Store a value, evicting the least recently used entries beyond `max_size`.
+
+        Args:
+            key (str): The key to set.
+            value (Any): The value to set.
+            expires_at (float, optional): Unix time after which the value must not be served.
+        """
+        if self.max_size <= 0:
+            return
+        deadline = self.clock() + self.max_staleness
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        self.entries[key] = (value, deadline)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: str) -> None:
+        """
+        Drop a key, e.g. after the underlying mapping was deleted.
+
+        Args:
+            key (str): The key to drop.
+        """
+        self.entries.pop(key, None)
+
+    def stats(self) -> dict:
+        """
+        Report the cache counters and limits.
+
+        Returns:
+            dict: Hits, misses, evictions, the current size and the configured limits.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'max_staleness': self.max_staleness,
+        }
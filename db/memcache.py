@@ -1,28 +1,167 @@
-import memcache as mc
+import asyncio
+import time
+from typing import Iterable
 
+from db.aiomemcache import MemcacheProtocolClient, MemcacheProtocolError, is_valid_key, to_exptime
+from db.hash_ring import HashRing
+from processing.metrics import Sample
 
-class Memcache:
-    def __init__(self, url: str) -> None:
+# Number of keys requested by a single `get` command, keeping command lines reasonably short
+GET_MULTI_CHUNK_SIZE = 100
+
+# Failures after which a memcached node is considered unavailable
+NODE_ERRORS = (OSError, EOFError, asyncio.TimeoutError, MemcacheProtocolError)
+
+
+def parse_servers(urls: str | list[str]) -> list[str]:
+    """
+    Split a Memcache connection string into its servers.
+
+    Args:
+        urls (str | list[str]): A comma separated list of `host:port` servers, or a list of them.
+
+    Returns:
+        list[str]: The servers.
+    """
+    if isinstance(urls, str):
+        urls = urls.split(',')
+    return [url.strip() for url in urls if url.strip()]
+
+
+def split_server(url: str) -> tuple[str, int]:
+    host, _, port = url.rpartition(':')
+    return (host, int(port)) if host else (url, 11211)
+
+
+class AsyncMemcache:
+    def __init__(self, url: str | list[str], pool_size: int = 10, timeout: float = 1.0,
+                 retry_interval: float = 30.0, failure_threshold: int = 3) -> None:
         """
-        Initialize a Memcache client instance.
+        Initialize an asyncio Memcache client instance for one or more servers.
+
+        Keys are distributed over the servers with a consistent hash ring, so adding or
+        removing one of N servers only moves about 1/N of the keys. Every server has its own
+        connection pool. A read a server fails is retried on the next server on the ring, and a
+        server failing `failure_threshold` times in a row is marked dead for `retry_interval`
+        seconds, during which its keys fail over to the next server. A write is retried on its
+        server until it answers or is marked dead, so it only fails over once reads do too and
+        never lands on a server the reads skip. Deletions and values stored with `all_nodes`,
+        such as tombstones, go to every available server, so a read failing over later cannot
+        find an older value there. A server
+        coming back is used as it is: it is shared with other clients, so it is never flushed,
+        and values that changed while it was skipped are only served until their TTL ends.
+        With every server down, reads miss and writes are dropped.
 
         Args:
-            url (str): The Memcache connection URL.
+            url (str | list[str]): Comma separated `host:port` servers, or a list of them.
+            pool_size (int): Maximum number of open connections per server.
+            timeout (float): Seconds to wait for a server before considering it failed.
+            retry_interval (float): Seconds a failed server is skipped.
+            failure_threshold (int): Consecutive failures after which a server is skipped.
         """
-        self.client = mc.Client([url])
+        self.nodes = {server: MemcacheProtocolClient(*split_server(server), pool_size, timeout)
+                      for server in parse_servers(url)}
+        self.ring = HashRing(list(self.nodes))
+        self.retry_interval = retry_interval
+        self.failure_threshold = max(1, failure_threshold)
+        self.failures: dict[str, int] = {}
+        self.dead_until: dict[str, float] = {}
+
+    def _is_available(self, node: str) -> bool:
+        return self.dead_until.get(node, 0.0) <= time.monotonic()
+
+    def _node_for(self, key: str, tried: set[str] = frozenset()) -> str | None:
+        return next((node for node in self.ring.iter_nodes(key)
+                     if node not in tried and self._is_available(node)), None)
+
+    async def _call(self, node: str, operation: str, *args):
+        try:
+            result = await getattr(self.nodes[node], operation)(*args)
+        except NODE_ERRORS as e:
+            failures = self.failures[node] = self.failures.get(node, 0) + 1
+            if failures >= self.failure_threshold:
+                print(f"Memcache node {node} failed {failures} times, retrying in {self.retry_interval}s: {e!r}")
+                self.dead_until[node] = time.monotonic() + self.retry_interval
+            raise
+        if self.failures.pop(node, None) is not None:
+            self.dead_until.pop(node, None)
+        return result
+
+    async def _retry(self, node: str, operation: str, *args):
+        # Retry a write until the node answers or is marked dead, when reads stop using it as well
+        while True:
+            try:
+                return await self._call(node, operation, *args)
+            except NODE_ERRORS:
+                if not self._is_available(node):
+                    raise
+
+    async def _run(self, key: str, operation: str, *args, write: bool = False):
+        # Walk the ring until a node answers, trying every node at most once
+        tried: set[str] = set()
+        while (node := self._node_for(key, tried)) is not None:
+            try:
+                if write:
+                    return await self._retry(node, operation, key, *args)
+                return await self._call(node, operation, key, *args)
+            except NODE_ERRORS:
+                tried.add(node)
+        return None
 
-    def set_cache(self, key: str, value: str, expiration_time: int) -> None:
+    async def _run_on_all(self, key: str, operation: str, *args) -> None:
+        # The owner of the key and every node its reads may fail over to
+        results = await asyncio.gather(*(self._retry(node, operation, key, *args)
+                                         for node in self.ring.iter_nodes(key) if self._is_available(node)),
+                                       return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException) and not isinstance(result, NODE_ERRORS):
+                raise result
+
+    def _group(self, items: list, key=lambda item: item, tried: set[str] = frozenset()) -> dict[str, list]:
+        groups: dict[str, list] = {}
+        for item in items:
+            node = self._node_for(key(item), tried)
+            if node is not None:
+                groups.setdefault(node, []).append(item)
+        return groups
+
+    async def set_cache(self, key: str, value: str, expiration_time: float, all_nodes: bool = False) -> None:
         """
         Set a key-value pair in Memcache with an expiration time.
 
+        Keys that memcached cannot store are ignored, the same as a cache that dropped them.
+
         Args:
             key (str): The key to set.
             value (str): The value to set.
-            expiration_time (int): The key-value pair expiration time.
+            expiration_time (float): The key-value pair expiration time in seconds.
+            all_nodes (bool): Store the pair on every available server, e.g. a tombstone that must
+                hide older values wherever a read fails over to.
+        """
+        if not is_valid_key(key):
+            return
+        if all_nodes:
+            await self._run_on_all(key, 'set', value.encode(), to_exptime(expiration_time))
+        else:
+            await self._run(key, 'set', value.encode(), to_exptime(expiration_time), write=True)
+
+    async def add_cache(self, key: str, value: str, expiration_time: float) -> bool:
+        """
+        Set a key-value pair in Memcache unless the key exists already, e.g. to take a lock.
+
+        Args:
+            key (str): The key to add.
+            value (str): The value to set.
+            expiration_time (float): The key-value pair expiration time in seconds.
+
+        Returns:
+            bool: True if the pair was stored, False if the key exists or no server answered.
         """
-        self.client.set(key, value, time=expiration_time)
+        if not is_valid_key(key):
+            return False
+        return bool(await self._run(key, 'add', value.encode(), to_exptime(expiration_time), write=True))
 
-    def get_cache(self, key: str) -> str:
+    async def get_cache(self, key: str) -> str | None:
         """
         Retrieve a value from Memcache based on its key.
 
@@ -32,13 +171,117 @@ class Memcache:
         Returns:
             The value corresponding to the key, or None if the key doesn't exist.
         """
-        return self.client.get(key)
+        if not is_valid_key(key):
+            return None
+        value = await self._run(key, 'get')
+        return value.decode() if value is not None else None
+
+    async def set_cache_multi(self, items: Iterable[tuple[str, str, float]]) -> None:
+        """
+        Set several key-value pairs in Memcache with one pipelined round trip per server.
+
+        Args:
+            items (Iterable): Tuples of key, value and expiration time in seconds.
+        """
+        pending = [(key, value.encode(), to_exptime(expiration_time))
+                   for key, value, expiration_time in items if is_valid_key(key)]
+        tried: set[str] = set()
+        while groups := self._group(pending, key=lambda item: item[0], tried=tried):
+            results = await asyncio.gather(*(self._retry(node, 'set_multi', node_items)
+                                             for node, node_items in groups.items()), return_exceptions=True)
+            pending = []
+            for node, node_items, result in zip(groups, groups.values(), results):
+                if isinstance(result, NODE_ERRORS):
+                    tried.add(node)
+                    pending.extend(node_items)
+                elif isinstance(result, BaseException):
+                    raise result
 
-    def delete_cache(self, key: str) -> None:
+    async def get_cache_multi(self, keys: Iterable[str]) -> dict[str, str]:
         """
-        Delete a key-value pair in Memcache.
+        Retrieve several values from Memcache, querying the servers concurrently.
+
+        Args:
+            keys (Iterable[str]): The keys of the values.
+
+        Returns:
+            dict: The values found, keyed by their key.
+        """
+        pending = [key for key in keys if is_valid_key(key)]
+        values = {}
+        tried: set[str] = set()
+        while groups := self._group(pending, tried=tried):
+            chunks = [(node, node_keys[start:start + GET_MULTI_CHUNK_SIZE])
+                      for node, node_keys in groups.items()
+                      for start in range(0, len(node_keys), GET_MULTI_CHUNK_SIZE)]
+            results = await asyncio.gather(*(self._call(node, 'get_multi', chunk) for node, chunk in chunks),
+                                           return_exceptions=True)
+            pending = []
+            for (node, chunk), result in zip(chunks, results):
+                if isinstance(result, NODE_ERRORS):
+                    tried.add(node)
+                    pending.extend(chunk)
+                elif isinstance(result, BaseException):
+                    raise result
+                else:
+                    values.update((key, value.decode()) for key, value in result.items())
+        return values
+
+    async def incr_cache(self, key: str, delta: int, expiration_time: float) -> int | None:
+        """
+        Increment a counter in Memcache, creating it with an expiration time if it doesn't exist.
+
+        memcached only increments existing values, so a missing counter is added with `delta`,
+        and incremented after all if another client added it first.
+
+        Args:
+            key (str): The key of the counter.
+            delta (int): The non-negative amount to add.
+            expiration_time (float): The expiration time in seconds of a new counter.
+
+        Returns:
+            int: The new value of the counter, or None if the key is invalid or no server answered.
+        """
+        if not is_valid_key(key):
+            return None
+        value = await self._run(key, 'incr', delta, write=True)
+        if value is None and await self._run(key, 'add', str(delta).encode(), to_exptime(expiration_time), write=True):
+            return delta
+        return value if value is not None else await self._run(key, 'incr', delta, write=True)
+
+    async def delete_cache(self, key: str) -> None:
+        """
+        Delete a key-value pair in Memcache, from every available server.
+
+        The key is also deleted from the servers its reads would fail over to, which may hold
+        a value stored during an earlier failure of its server.
 
         Args:
             key (str): The key of the value to delete.
         """
-        self.client.delete(key)
+        if is_valid_key(key):
+            await self._run_on_all(key, 'delete')
+
+    def stats(self) -> dict:
+        """
+        Report the servers and which of them are currently skipped.
+
+        Returns:
+            dict: The configured servers and the dead ones.
+        """
+        return {'nodes': list(self.nodes), 'dead': [node for node in self.nodes if not self._is_available(node)]}
+
+    def collect(self) -> list[Sample]:
+        """
+        Report which servers are in use as metric samples.
+
+        Returns:
+            list: Samples for the registry exposition.
+        """
+        return [('url_shortener_memcache_node_up', 'Whether a Memcache server is in use, 0 while it is skipped.',
+                 'gauge', {'node': node}, int(self._is_available(node))) for node in self.nodes]
+
+    def close_connection(self) -> None:
+        """ Close the Memcache connections. """
+        for client in self.nodes.values():
+            client.close()
@@ -0,0 +1,82 @@
+"""
+Data migrations of the short URL collection.
+
+`url_digests` stores the digest of the canonical original URL on every document created
+before lookups by original URL went through it, then drops the hashed index on the raw
+original URL that the digest index replaces. It streams the documents without a digest
+through a cursor and updates them in batches, so it runs in constant memory next to the
+live application and can be interrupted and started again at any time.
+
+    python -m db.migrations url_digests --uri mongodb://localhost:27017/ --batch-size 1000
+"""
+import argparse
+import time
+
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import OperationFailure
+
+from db.mongodb import short_url_indexes
+from processing.canonical_url import url_digest
+
+# Index on the raw original URL replaced by the digest index
+RAW_ORIGINAL_URL_INDEX = 'original_url_hashed'
+
+
+def backfill_url_digests(collection, batch_size: int = 1000, pause: float = 0.0) -> int:
+    """
+    Add the original URL digest to every short URL document that has none.
+
+    Args:
+        collection (Collection): The short URL collection.
+        batch_size (int): Number of documents updated per `bulk_write`.
+        pause (float): Seconds to wait between batches, to leave capacity to the application.
+
+    Returns:
+        int: The number of documents updated.
+    """
+    # The digest index comes first, so the backfilled documents are indexed as they are updated
+    collection.create_indexes([index for index in short_url_indexes(None)
+                               if index.document['name'] == 'original_url_digest'])
+
+    updated = 0
+    batch = []
+    cursor = collection.find({'original_url_digest': {'$exists': False}}, {'original_url': 1},
+                             batch_size=batch_size).sort('_id')
+    for url_data in cursor:
+        batch.append(UpdateOne({'_id': url_data['_id']},
+                               {'$set': {'original_url_digest': url_digest(url_data['original_url'])}}))
+        if len(batch) >= batch_size:
+            updated += collection.bulk_write(batch, ordered=False).modified_count
+            batch = []
+            print(f'Added the original URL digest to {updated} documents')
+            if pause:
+                time.sleep(pause)
+    if batch:
+        updated += collection.bulk_write(batch, ordered=False).modified_count
+
+    try:
+        collection.drop_index(RAW_ORIGINAL_URL_INDEX)
+    except OperationFailure:
+        # The index was dropped by an earlier run
+        pass
+    print(f'Added the original URL digest to {updated} documents in total')
+    return updated
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('migration', choices=('url_digests',))
+    parser.add_argument('--uri', default='mongodb://localhost:27017/')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--pause', type=float, default=0.0, help='seconds to wait between batches')
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri)
+    try:
+        backfill_url_digests(client['short_urls']['short_urls'], args.batch_size, args.pause)
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
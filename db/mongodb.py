@@ -1,22 +1,189 @@
-from datetime import datetime
-from typing import Any, Mapping
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Mapping
 
-from pymongo import MongoClient
+from pymongo import ASCENDING, DESCENDING, AsyncMongoClient, IndexModel, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, DuplicateKeyError, ExecutionTimeout
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
 
+from processing.canonical_url import canonicalize_url, url_digest
 
-class MongoDB:
-    def __init__(self, url: str) -> None:
+# Errors meaning MongoDB could not be reached or did not answer in time, as opposed to
+# errors about the request itself such as a duplicate key
+UNAVAILABLE_ERRORS = (ConnectionFailure, ExecutionTimeout)
+
+
+def short_url_indexes(expire_after_seconds: int | None = 0) -> list[IndexModel]:
+    """
+    Describe the indexes of the short URL collection.
+
+    Args:
+        expire_after_seconds (int, optional): Seconds after the expiration date at which MongoDB removes
+            a document, or None to keep expired documents.
+
+    Returns:
+        list[IndexModel]: A unique index on the short URL, an index on the digest of the canonical original
+            URL, whose entries have the same small size however long the URL is, and optionally a TTL index
+            on the expiration date.
+    """
+    indexes = [
+        IndexModel([('short_url', ASCENDING)], name='short_url_unique', unique=True),
+        IndexModel([('original_url_digest', ASCENDING)], name='original_url_digest'),
+    ]
+    if expire_after_seconds is not None:
+        indexes.append(IndexModel([('expiration_date', ASCENDING)], name='expiration_date_ttl',
+                                  expireAfterSeconds=expire_after_seconds))
+    return indexes
+
+
+def click_indexes() -> list[IndexModel]:
+    """
+    Describe the indexes of the click analytics collection.
+
+    Returns:
+        list[IndexModel]: A unique index on the short URL and time bucket, which the counter upserts
+            and the per short URL history use, and an index on the time bucket for the top-N queries.
+    """
+    return [
+        IndexModel([('short_url', ASCENDING), ('bucket', ASCENDING)], name='short_url_bucket_unique', unique=True),
+        IndexModel([('bucket', ASCENDING)], name='bucket'),
+    ]
+
+
+def with_expiry_filter(search_criteria: dict, filter_expired: bool, get_expired_url: bool) -> dict:
+    """
+    Add a condition excluding expired short URLs to the search criteria when requested.
+
+    Args:
+        search_criteria (dict): The search criteria.
+        filter_expired (bool): Whether expired short URLs are excluded by the query itself.
+        get_expired_url (bool): Whether the caller asked for expired short URLs as well.
+
+    Returns:
+        dict: The search criteria to send to MongoDB.
+    """
+    if not filter_expired or get_expired_url:
+        return search_criteria
+    return {**search_criteria, 'expiration_date': {'$gt': datetime.now(timezone.utc)}}
+
+
+def with_read_preference(collection, read_preference: str):
+    """
+    Get a view of a collection reading with the given preference.
+
+    Args:
+        collection (Collection | AsyncCollection): The collection.
+        read_preference (str): The read preference mode name, e.g. `secondaryPreferred`.
+
+    Returns:
+        The collection itself for `primary`, otherwise a copy with the read preference applied.
+    """
+    if read_preference == 'primary':
+        return collection
+    return collection.with_options(
+        read_preference=make_read_preference(read_pref_mode_from_name(read_preference), None))
+
+
+def with_url_digest(url_doc: Mapping[str, Any]) -> dict:
+    """
+    Copy a short URL document, adding the digest its original URL is looked up by.
+
+    Args:
+        url_doc (dict): Document with the short URL, original URL and expiration date.
+
+    Returns:
+        dict: The document with its `original_url_digest`.
+    """
+    return {**url_doc, 'original_url_digest': url_digest(url_doc['original_url'])}
+
+
+def match_original_urls(url_docs, original_urls: list[str]) -> dict[str, Mapping[str, Any]]:
+    """
+    Pick the unexpired documents whose original URL is a spelling of one of the requested URLs.
+
+    Documents are found by the digest of the canonical URL, so the canonical forms are compared
+    as well to rule out a digest collision.
+
+    Args:
+        url_docs (Iterable[dict]): The documents sharing a digest with the requested URLs.
+        original_urls (list[str]): The requested original URLs.
+
+    Returns:
+        dict: A matching document keyed by each requested URL that has one.
+    """
+    requested: dict[str, list[str]] = {}
+    for original_url in original_urls:
+        requested.setdefault(canonicalize_url(original_url), []).append(original_url)
+    found = {}
+    now = datetime.now(timezone.utc)
+    for url_data in url_docs:
+        if url_data['expiration_date'] < now:
+            continue
+        for original_url in requested.get(canonicalize_url(url_data['original_url']), ()):
+            found.setdefault(original_url, url_data)
+    return found
+
+
+def check_expiration(url_data: Mapping[str, Any] | None, get_expired_url: bool = False) -> Mapping[str, Any]:
+    """
+    Validate a short URL document fetched from MongoDB.
+
+    Args:
+        url_data (dict): The fetched document, or None if nothing matched.
+        get_expired_url (bool): Whether to return an expired short URL or not.
+
+    Returns:
+        (dict): The same document.
+
+    Raises:
+        ValueError: If the short URL is not found, or if it has expired.
+    """
+    if url_data is None:
+        raise ValueError("Short URL not found")
+    elif url_data["expiration_date"] < datetime.now(timezone.utc):
+        if get_expired_url:
+            return url_data
+        raise ValueError("Short URL has been expired")
+    else:
+        return url_data
+
+
+class AsyncMongoDB:
+    unavailable_errors = UNAVAILABLE_ERRORS
+    duplicate_errors = (DuplicateKeyError,)
+
+    def __init__(self, url: str, filter_expired: bool = False, expire_after_seconds: int | None = 0,
+                 read_preference: str = 'primary', **client_options) -> None:
         """
-        Initialize a MongoDB client instance.
+        Initialize an asyncio MongoDB client instance.
+
+        Every database round trip is awaited, so the event loop keeps serving other requests
+        while MongoDB answers.
 
         Args:
             url (str): The MongoDB connection URL.
+            filter_expired (bool): Exclude expired short URLs in the query instead of after fetching them.
+                Expired short URLs are then reported as not found.
+            expire_after_seconds (int, optional): Grace period of the TTL index, None disables it.
+            read_preference (str): Read preference of short URL lookups, e.g. `secondaryPreferred`.
+                Writes and lookups by original URL always go to the primary.
+            client_options: Options of the `AsyncMongoClient`, e.g. `maxPoolSize` or `serverSelectionTimeoutMS`.
         """
-        self.client = MongoClient(url)
+        # Expiration dates are read back as UTC datetimes, the time zone MongoDB stores and expires them in
+        self.client = AsyncMongoClient(url, tz_aware=True, **client_options)
         self.db = self.client['short_urls']
         self.collection = self.db['short_urls']
+        self.lookup_collection = with_read_preference(self.collection, read_preference)
+        self.counters = self.db['counters']
+        self.clicks = self.db['clicks']
+        self.filter_expired = filter_expired
+        self.expire_after_seconds = expire_after_seconds
 
-    def insert_short_url(self, short_url: str, original_url: str, expiration_date: datetime) -> None:
+    async def ensure_indexes(self) -> None:
+        """ Create the indexes of the short URL and click collections, if they do not exist yet. """
+        await self.collection.create_indexes(short_url_indexes(self.expire_after_seconds))
+        await self.clicks.create_indexes(click_indexes())
+
+    async def insert_short_url(self, short_url: str, original_url: str, expiration_date: datetime) -> None:
         """
         Insert a short URL into MongoDB.
 
@@ -25,14 +192,29 @@ class MongoDB:
             original_url (str): The original URL.
             expiration_date (datetime): The expiration date for the short URL.
         """
-        url_doc = {
+        url_doc = with_url_digest({
             'short_url': short_url,
             'original_url': original_url,
             'expiration_date': expiration_date
-        }
-        self.collection.insert_one(url_doc)
+        })
+        await self.collection.insert_one(url_doc)
+
+    async def reserve_sequence_block(self, name: str, size: int) -> int:
+        """
+        Atomically reserve a block of consecutive numbers from a named counter.
+
+        Args:
+            name (str): The counter name.
+            size (int): Number of values to reserve.
+
+        Returns:
+            int: The first value of the reserved block.
+        """
+        counter = await self.counters.find_one_and_update({'_id': name}, {'$inc': {'value': size}},
+                                                          upsert=True, return_document=ReturnDocument.AFTER)
+        return counter['value'] - size
 
-    def find_short_url(self, search_criteria: dict, get_expired_url: bool = False) -> Mapping[str, Any]:
+    async def find_short_url(self, search_criteria: dict, get_expired_url: bool = False) -> Mapping[str, Any]:
         """
         Find a short URL in MongoDB.
 
@@ -46,26 +228,73 @@ class MongoDB:
         Raises:
             ValueError: If the short URL is not found, or if it has expired.
         """
-        url_data = self.collection.find_one(search_criteria)
-        if url_data is None:
-            raise ValueError("Short URL not found")
-        elif url_data["expiration_date"] < datetime.now():
-            if get_expired_url:
-                return url_data
-            raise ValueError("Short URL has been expired")
-        else:
-            return url_data
+        search_criteria = with_expiry_filter(search_criteria, self.filter_expired, get_expired_url)
+        return check_expiration(await self.collection.find_one(search_criteria), get_expired_url)
 
-    def delete_short_url(self, short_url: str) -> None:
+    async def delete_short_url(self, short_url: str) -> None:
         """
         Delete a short URL from the MongoDB.
 
         Args:
             short_url (str): The short URL to delete.
         """
-        self.collection.delete_one({'short_url': short_url})
+        await self.collection.delete_one({'short_url': short_url})
+
+    async def delete_short_urls(self, short_urls: list[str]) -> None:
+        """
+        Delete several short URLs with a single `delete_many`.
+
+        Args:
+            short_urls (list[str]): The short URLs to delete.
+        """
+        if short_urls:
+            await self.collection.delete_many({'short_url': {'$in': short_urls}})
 
-    def update_expiration_date(self, short_url: str, new_expiration_date: datetime) -> None:
+    async def scan_short_urls(self, after: str | None = None, batch_size: int = 1000) -> AsyncIterator[dict]:
+        """
+        Stream every short URL document through a cursor on the short URL index.
+
+        Only one batch of documents is held in memory at a time, and a scan that stopped can be
+        resumed from the last short URL it returned.
+
+        Args:
+            after (str, optional): Start after this short URL.
+            batch_size (int): Number of documents fetched per round trip.
+
+        Yields:
+            dict: The documents, expired ones included, ordered by short URL.
+        """
+        criteria = {'short_url': {'$gt': after}} if after is not None else {}
+        cursor = self.collection.find(criteria, {'_id': 0, 'short_url': 1, 'original_url': 1, 'expiration_date': 1},
+                                      batch_size=batch_size).sort('short_url', ASCENDING)
+        async for url_data in cursor:
+            yield url_data
+
+    async def latest_short_urls(self, limit: int, batch_size: int = 1000) -> AsyncIterator[dict]:
+        """
+        Stream the unexpired short URLs that expire last through a projection cursor.
+
+        Short URLs expire a fixed time after they were created or last shortened again, so these
+        are the most recently used ones. The cursor walks the expiration date index backwards and
+        runs with the read preference of lookups, keeping the load off the primary.
+
+        Args:
+            limit (int): Maximum number of documents.
+            batch_size (int): Number of documents fetched per round trip.
+
+        Yields:
+            dict: The short URL, original URL and expiration date, latest expiration first.
+        """
+        if limit <= 0:
+            # A limit of 0 would mean no limit to MongoDB
+            return
+        cursor = self.lookup_collection.find({'expiration_date': {'$gt': datetime.now(timezone.utc)}},
+                                             {'_id': 0, 'short_url': 1, 'original_url': 1, 'expiration_date': 1},
+                                             batch_size=batch_size, limit=limit).sort('expiration_date', DESCENDING)
+        async for url_data in cursor:
+            yield url_data
+
+    async def update_expiration_date(self, short_url: str, new_expiration_date: datetime) -> None:
         """
         Update the expiration date of a URL in the MongoDB.
 
@@ -73,31 +302,32 @@ class MongoDB:
             short_url (str): The short URL to update.
             new_expiration_date (datetime): The new expiration date.
         """
-        self.collection.update_one({'short_url': short_url}, {'$set': {'expiration_date': new_expiration_date}})
+        await self.collection.update_one({'short_url': short_url},
+                                         {'$set': {'expiration_date': new_expiration_date}})
 
-    def close_connection(self) -> None:
+    async def close_connection(self) -> None:
         """ Close the MongoDB connection. """
-        self.client.close()
+        await self.client.close()
 
-    def lookup_by_original_url(self, original_url: str) -> Mapping[str, Any] | None:
+    async def lookup_by_original_url(self, original_url: str) -> Mapping[str, Any] | None:
         """
         Lookup the short URL based on the given original URL.
 
+        Any spelling of the URL with the same canonical form matches, found through the index
+        on the digest of the canonical form.
+
         Args:
             original_url (str): The original URL to lookup.
 
         Returns:
-            The corresponding short URL data or ValueException if the short URL is not found or expired.
+            The corresponding short URL data, or None if the original URL has no unexpired short URL.
         """
-        try:
-            url_data = self.find_short_url({"original_url": original_url})
-        except ValueError as ve:
-            print('Error occurred while searching a short url: ' + str(ve))
-            return None
-        else:
-            return url_data
+        search_criteria = with_expiry_filter({'original_url_digest': url_digest(original_url)},
+                                             self.filter_expired, False)
+        url_docs = [url_data async for url_data in self.collection.find(search_criteria)]
+        return match_original_urls(url_docs, [original_url]).get(original_url)
 
-    def lookup_by_short_url(self, short_url: str) -> Mapping[str, Any]:
+    async def lookup_by_short_url(self, short_url: str) -> Mapping[str, Any]:
         """
         Lookup the short URL based on the given short URL.
 
@@ -107,4 +337,158 @@ class MongoDB:
         Returns:
             The corresponding short URL data or ValueException if the short URL is not found or expired.
         """
-        return self.find_short_url({"short_url": short_url})
+        search_criteria = with_expiry_filter({"short_url": short_url}, self.filter_expired, False)
+        url_data = await self.lookup_collection.find_one(search_criteria)
+        if url_data is None and self.lookup_collection is not self.collection:
+            # A short URL created moments ago may not have reached the secondaries yet
+            url_data = await self.collection.find_one(search_criteria)
+        return check_expiration(url_data)
+
+    async def insert_short_urls(self, url_docs: list[dict]) -> list[str | None]:
+        """
+        Insert several short URLs into MongoDB with a single unordered `insert_many`.
+
+        Args:
+            url_docs (list[dict]): Documents with the short URL, original URL and expiration date.
+
+        Returns:
+            list: For each document, None if it was inserted or the error message explaining why not.
+        """
+        errors: list[str | None] = [None] * len(url_docs)
+        if not url_docs:
+            return errors
+        try:
+            # insert_many adds an _id to the documents, so hand it copies
+            await self.collection.insert_many([with_url_digest(url_doc) for url_doc in url_docs], ordered=False)
+        except BulkWriteError as bwe:
+            for write_error in bwe.details.get('writeErrors', []):
+                errors[write_error['index']] = write_error['errmsg']
+        return errors
+
+    async def upsert_short_urls(self, url_docs: list[dict]) -> None:
+        """
+        Insert or replace several short URLs with a single unordered `bulk_write` of upserts.
+
+        The documents keep their expiration date, and their digest is computed from the original URL.
+
+        Args:
+            url_docs (list[dict]): Documents with the short URL, original URL and expiration date.
+        """
+        if url_docs:
+            await self.collection.bulk_write([
+                ReplaceOne({'short_url': url_doc['short_url']}, with_url_digest(url_doc), upsert=True)
+                for url_doc in url_docs
+            ], ordered=False)
+
+    async def update_expiration_dates(self, short_urls: list[str], new_expiration_date: datetime) -> None:
+        """
+        Update the expiration date of several URLs with a single `update_many`.
+
+        Args:
+            short_urls (list[str]): The short URLs to update.
+            new_expiration_date (datetime): The new expiration date.
+        """
+        if short_urls:
+            await self.collection.update_many({'short_url': {'$in': short_urls}},
+                                              {'$set': {'expiration_date': new_expiration_date}})
+
+    async def extend_expiration_dates(self, expiration_dates: Mapping[str, datetime]) -> None:
+        """
+        Move the expiration dates of several URLs forward with a single unordered `bulk_write`.
+
+        An expiration date is only ever increased, so writing an older extension after a newer
+        one has no effect.
+
+        Args:
+            expiration_dates (dict): The new expiration dates keyed by short URL.
+        """
+        if expiration_dates:
+            await self.collection.bulk_write([
+                UpdateOne({'short_url': short_url}, {'$max': {'expiration_date': expiration_date}})
+                for short_url, expiration_date in expiration_dates.items()
+            ], ordered=False)
+
+    async def lookup_by_original_urls(self, original_urls: list[str]) -> dict[str, Mapping[str, Any]]:
+        """
+        Lookup the unexpired short URLs of several original URLs with a single `$in` query on their digests.
+
+        Args:
+            original_urls (list[str]): The original URLs to lookup.
+
+        Returns:
+            dict: The short URL data keyed by original URL. Original URLs without an unexpired
+                short URL are left out, matching `lookup_by_original_url`.
+        """
+        digests = list({url_digest(original_url) for original_url in original_urls})
+        url_docs = [url_data async for url_data in self.collection.find({'original_url_digest': {'$in': digests}})]
+        return match_original_urls(url_docs, original_urls)
+
+    async def lookup_by_short_urls(self, short_urls: list[str]) -> dict[str, Mapping[str, Any]]:
+        """
+        Lookup several short URLs with a single `$in` query.
+
+        Expired short URLs are included, so callers can tell them apart from unknown ones
+        with `check_expiration`.
+
+        Args:
+            short_urls (list[str]): The short URLs to lookup.
+
+        Returns:
+            dict: The short URL data keyed by short URL.
+        """
+        found = {url_data['short_url']: url_data
+                 async for url_data in self.lookup_collection.find({'short_url': {'$in': short_urls}})}
+        missing = [short_url for short_url in short_urls if short_url not in found]
+        if missing and self.lookup_collection is not self.collection:
+            # Short URLs created moments ago may not have reached the secondaries yet
+            found.update({url_data['short_url']: url_data
+                          async for url_data in self.collection.find({'short_url': {'$in': missing}})})
+        return found
+
+    async def increment_clicks(self, counts: Mapping[tuple[str, int], int]) -> None:
+        """
+        Add click counts to their time buckets with a single unordered `bulk_write` of upserts.
+
+        Args:
+            counts (dict): Number of clicks keyed by short URL and bucket start as unix time.
+        """
+        if counts:
+            await self.clicks.bulk_write([
+                UpdateOne({'short_url': short_url, 'bucket': bucket}, {'$inc': {'count': count}}, upsert=True)
+                for (short_url, bucket), count in counts.items()
+            ], ordered=False)
+
+    async def top_clicked(self, limit: int, since: int = 0) -> list[dict]:
+        """
+        Find the most clicked short URLs.
+
+        Args:
+            limit (int): Maximum number of short URLs to return.
+            since (int): Only count the buckets starting at this unix time or later.
+
+        Returns:
+            list[dict]: The short URLs and their click counts, most clicked first.
+        """
+        pipeline = [
+            {'$match': {'bucket': {'$gte': since}}},
+            {'$group': {'_id': '$short_url', 'count': {'$sum': '$count'}}},
+            {'$sort': {'count': -1, '_id': 1}},
+            {'$limit': limit},
+        ]
+        cursor = await self.clicks.aggregate(pipeline)
+        return [{'short_url': doc['_id'], 'count': doc['count']} async for doc in cursor]
+
+    async def click_history(self, short_url: str, since: int = 0) -> list[dict]:
+        """
+        Get the click counts of a short URL per time bucket.
+
+        Args:
+            short_url (str): The short URL.
+            since (int): Only return the buckets starting at this unix time or later.
+
+        Returns:
+            list[dict]: The bucket start as unix time and the click count, oldest first.
+        """
+        cursor = self.clicks.find({'short_url': short_url, 'bucket': {'$gte': since}},
+                                  {'_id': 0, 'bucket': 1, 'count': 1}).sort('bucket', ASCENDING)
+        return [doc async for doc in cursor]
@@ -0,0 +1,99 @@
+"""
+Move short URL documents between MongoDB shards after shards are added or removed.
+
+Every shard of the old and the new list is streamed through a cursor in short URL order.
+A document is copied in batches to the shards that hold it in the new layout, the shard of
+its short URL and the shard of its original URL, and is then deleted from a shard that no
+longer holds it. Copies are inserted as they are, so running the move again after it was
+interrupted only skips what was copied already. The first shard keeps the sequence counters
+and the click counts and has to stay first.
+
+Run it while the application is configured with the new shards in MONGODB_SHARD_URIS and
+the old ones in MONGODB_PREVIOUS_SHARD_URIS, then remove MONGODB_PREVIOUS_SHARD_URIS:
+
+    python -m db.rebalance --from "a=mongodb://a/ b=mongodb://b/" --to "a=mongodb://a/ b=mongodb://b/ c=mongodb://c/"
+"""
+import argparse
+import asyncio
+from collections import defaultdict
+from typing import Mapping
+
+from db.mongodb import AsyncMongoDB
+from db.sharding import ShardedStorage, parse_shard_layout
+from db.storage import StorageBackend
+
+
+async def rebalance(shards: Mapping[str, StorageBackend], previous_shards: Mapping[str, StorageBackend],
+                    batch_size: int = 1000, pause: float = 0.0) -> dict[str, int]:
+    """
+    Move every short URL document to the shards holding it in a new layout.
+
+    Args:
+        shards (Mapping[str, StorageBackend]): The new shards keyed by name.
+        previous_shards (Mapping[str, StorageBackend]): The shards the documents are moved from.
+        batch_size (int): Number of documents read per round trip and written per batch.
+        pause (float): Seconds to wait between batches, to leave capacity to the application.
+
+    Returns:
+        dict[str, int]: The number of documents scanned, copied and deleted.
+    """
+    layout = ShardedStorage(shards, previous_shards)
+    stats = {'scanned': 0, 'copied': 0, 'deleted': 0}
+
+    for name, storage in layout.all_shards.items():
+        copies, stale = defaultdict(list), []
+
+        async def flush() -> None:
+            # Copies are written before the documents they were made from are deleted
+            for holder, url_docs in copies.items():
+                errors = await layout.shards[holder].insert_short_urls(url_docs)
+                stats['copied'] += errors.count(None)
+            await storage.delete_short_urls(stale)
+            stats['deleted'] += len(stale)
+            copies.clear()
+            stale.clear()
+            print(f"Rebalanced {stats['scanned']} documents: {stats['copied']} copied, {stats['deleted']} deleted")
+            if pause:
+                await asyncio.sleep(pause)
+
+        pending = 0
+        async for url_doc in storage.scan_short_urls(batch_size=batch_size):
+            stats['scanned'] += 1
+            holders = layout.holders(url_doc)
+            for holder in holders - {name}:
+                copies[holder].append(url_doc)
+                pending += 1
+            if name not in holders:
+                stale.append(url_doc['short_url'])
+                pending += 1
+            if pending >= batch_size:
+                await flush()
+                pending = 0
+        await flush()
+    return stats
+
+
+async def run(previous_entries: list[str], entries: list[str], batch_size: int, pause: float) -> None:
+    uris, previous_uris = parse_shard_layout(entries, previous_entries)
+    clients = {name: AsyncMongoDB(uri) for name, uri in {**previous_uris, **uris}.items()}
+    try:
+        stats = await rebalance({name: clients[name] for name in uris},
+                                {name: clients[name] for name in previous_uris}, batch_size, pause)
+        print(f"Rebalance done: {stats}")
+    finally:
+        await asyncio.gather(*(client.close_connection() for client in clients.values()))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--from', dest='previous_uris', required=True,
+                        help='space separated name=uri entries of the old shards')
+    parser.add_argument('--to', dest='uris', required=True, help='space separated name=uri entries of the new shards')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--pause', type=float, default=0.0, help='seconds to wait between batches')
+    args = parser.parse_args()
+    asyncio.run(run(args.previous_uris.split(), args.uris.split(), args.batch_size, args.pause))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,434 @@
+import asyncio
+import math
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Callable, Mapping
+
+from db.mongodb import check_expiration, match_original_urls, with_url_digest
+from processing.canonical_url import url_digest
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS short_urls (
+    short_url TEXT PRIMARY KEY,
+    original_url TEXT NOT NULL,
+    original_url_digest BLOB NOT NULL,
+    expiration_date REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS short_urls_original_url_digest ON short_urls (original_url_digest);
+CREATE INDEX IF NOT EXISTS short_urls_expiration_date ON short_urls (expiration_date);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS clicks (
+    short_url TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (short_url, bucket)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS clicks_bucket ON clicks (bucket);
+"""
+
+# Number of values bound per `IN (...)` query, well below SQLite's limit on host parameters
+MAX_IN_PARAMETERS = 500
+
+# Seconds a lookup on the event loop waits for a lock before it is retried on the dedicated thread,
+# where waiting the full busy timeout does not stall other requests
+INLINE_BUSY_TIMEOUT = 0.005
+
+
+def to_url_doc(row: tuple) -> dict:
+    # Expiration dates are stored as unix time and handed out as UTC datetimes, like MongoDB's
+    short_url, original_url, expiration_date = row
+    return {'short_url': short_url, 'original_url': original_url,
+            'expiration_date': datetime.fromtimestamp(expiration_date, timezone.utc)}
+
+
+def chunks(values: list, size: int = MAX_IN_PARAMETERS):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class SQLiteStorage:
+    # A locked database or a failing disk, as opposed to errors about the request itself
+    unavailable_errors = (sqlite3.OperationalError,)
+    duplicate_errors = (sqlite3.IntegrityError,)
+
+    def __init__(self, path: str, expire_after_seconds: int | None = 0, purge_interval: float = 60.0,
+                 mmap_size: int = 256 * 2 ** 20, busy_timeout: float = 5.0, read_inline: bool = True) -> None:
+        """
+        Initialize an embedded storage backend in a single SQLite file.
+
+        The database runs in WAL mode, so lookups are never blocked by a write and several
+        worker processes on a node can share the file. Writes run on a dedicated thread, as
+        they may wait for another process holding the write lock. Lookups use a connection
+        of their own and run on the event loop, where an indexed read of cached, memory-mapped
+        pages takes microseconds, a fraction of the cost of handing it to a thread; with
+        `read_inline` off they run on the dedicated thread too, for databases much larger
+        than memory, like scans and aggregations, through another connection only used there.
+        A lookup on the event loop that finds the database locked, as during a checkpoint of
+        another process, gives up after a few milliseconds and is retried on the thread.
+        Expired short URLs are deleted `expire_after_seconds` after they expire, checked at
+        most every `purge_interval` seconds when writing, like MongoDB's TTL monitor. The
+        tables and indexes are created before the instance is returned, so it is usable at once.
+
+        Args:
+            path (str): Path of the database file.
+            expire_after_seconds (int, optional): Grace period before expired short URLs are deleted,
+                None keeps them.
+            purge_interval (float): Minimum number of seconds between two deletions of expired short URLs.
+            mmap_size (int): Bytes of the database file memory-mapped for reading.
+            busy_timeout (float): Seconds a write waits for another process holding the write lock.
+            read_inline (bool): Run lookups on the event loop instead of the dedicated thread.
+        """
+        self.path = path
+        self.expire_after_seconds = expire_after_seconds
+        self.purge_interval = purge_interval
+        self.read_inline = read_inline
+        self.purged_at = 0.0
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        self.connection = self._connect(busy_timeout, mmap_size)
+        self.connection.executescript(SCHEMA)
+        # A connection is only ever used by one thread: `reader` on the event loop, the others on the executor
+        self.reader = self._connect(INLINE_BUSY_TIMEOUT, mmap_size)
+        self.background_reader = self._connect(busy_timeout, mmap_size)
+
+    def _connect(self, busy_timeout: float, mmap_size: int) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute(f'PRAGMA mmap_size={int(mmap_size)}')
+        return connection
+
+    async def _run(self, func: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def _read(self, sql: str, parameters) -> list[tuple]:
+        if self.read_inline:
+            try:
+                return self.reader.execute(sql, parameters).fetchall()
+            except sqlite3.OperationalError as e:
+                if e.sqlite_errorcode & 0xff not in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED):
+                    raise
+        return await self._run(lambda: self.background_reader.execute(sql, parameters).fetchall())
+
+    def _write(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        # Runs on the executor thread, in a transaction taking the write lock up front
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            result = func(self.connection)
+            if isinstance(result, sqlite3.Cursor):
+                # Finalizing a cursor on the event loop thread would race the next write on this one
+                result.close()
+                result = None
+            self._purge_expired()
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+        return result
+
+    def _purge_expired(self) -> None:
+        now = time.time()
+        if self.expire_after_seconds is None or now - self.purged_at < self.purge_interval:
+            return
+        self.purged_at = now
+        self.connection.execute('DELETE FROM short_urls WHERE expiration_date < ?',
+                                (now - self.expire_after_seconds,))
+
+    async def ensure_indexes(self) -> None:
+        """ Create the tables and indexes, if they do not exist yet, as the constructor does already. """
+        await self._run(self.connection.executescript, SCHEMA)
+
+    async def insert_short_url(self, short_url: str, original_url: str, expiration_date: datetime) -> None:
+        """
+        Insert a short URL.
+
+        Args:
+            short_url (str): The short URL.
+            original_url (str): The original URL.
+            expiration_date (datetime): The expiration date for the short URL.
+
+        Raises:
+            sqlite3.IntegrityError: If the short URL exists already.
+        """
+        url_doc = with_url_digest({'short_url': short_url, 'original_url': original_url,
+                                   'expiration_date': expiration_date})
+        await self._run(self._write, lambda connection: self._insert(connection, url_doc))
+
+    @staticmethod
+    def _insert(connection: sqlite3.Connection, url_doc: dict) -> None:
+        connection.execute('INSERT INTO short_urls VALUES (?, ?, ?, ?)',
+                           (url_doc['short_url'], url_doc['original_url'], url_doc['original_url_digest'],
+                            url_doc['expiration_date'].timestamp()))
+
+    async def insert_short_urls(self, url_docs: list[dict]) -> list[str | None]:
+        """
+        Insert several short URLs in a single transaction.
+
+        Args:
+            url_docs (list[dict]): Documents with the short URL, original URL and expiration date.
+
+        Returns:
+            list: For each document, None if it was inserted or the error message explaining why not.
+        """
+        def insert(connection: sqlite3.Connection) -> list[str | None]:
+            errors = []
+            for url_doc in url_docs:
+                try:
+                    self._insert(connection, with_url_digest(url_doc))
+                except sqlite3.IntegrityError as e:
+                    errors.append(f"{e}: {url_doc['short_url']}")
+                else:
+                    errors.append(None)
+            return errors
+
+        if not url_docs:
+            return []
+        return await self._run(self._write, insert)
+
+    async def upsert_short_urls(self, url_docs: list[dict]) -> None:
+        """
+        Insert or replace several short URLs in a single transaction.
+
+        Args:
+            url_docs (list[dict]): Documents with the short URL, original URL and expiration date.
+        """
+        rows = [(url_doc['short_url'], url_doc['original_url'], url_digest(url_doc['original_url']),
+                 url_doc['expiration_date'].timestamp()) for url_doc in url_docs]
+        if rows:
+            await self._run(self._write, lambda connection: connection.executemany(
+                'INSERT OR REPLACE INTO short_urls VALUES (?, ?, ?, ?)', rows))
+
+    async def lookup_by_short_url(self, short_url: str) -> Mapping[str, Any]:
+        """
+        Lookup the short URL based on the given short URL.
+
+        Args:
+            short_url (str): The short URL to lookup.
+
+        Returns:
+            The corresponding short URL data or ValueException if the short URL is not found or expired.
+        """
+        rows = await self._read('SELECT short_url, original_url, expiration_date FROM short_urls WHERE short_url = ?',
+                                (short_url,))
+        return check_expiration(to_url_doc(rows[0]) if rows else None)
+
+    async def lookup_by_short_urls(self, short_urls: list[str]) -> dict[str, Mapping[str, Any]]:
+        """
+        Lookup several short URLs, including expired ones.
+
+        Args:
+            short_urls (list[str]): The short URLs to lookup.
+
+        Returns:
+            dict: The short URL data keyed by short URL.
+        """
+        found = {}
+        for chunk in chunks(list(dict.fromkeys(short_urls))):
+            rows = await self._read('SELECT short_url, original_url, expiration_date FROM short_urls '
+                                    f'WHERE short_url IN ({",".join("?" * len(chunk))})', chunk)
+            found.update((row[0], to_url_doc(row)) for row in rows)
+        return found
+
+    async def lookup_by_original_url(self, original_url: str) -> Mapping[str, Any] | None:
+        """
+        Lookup the short URL of any spelling of the given original URL.
+
+        Args:
+            original_url (str): The original URL to lookup.
+
+        Returns:
+            The corresponding short URL data, or None if the original URL has no unexpired short URL.
+        """
+        return (await self.lookup_by_original_urls([original_url])).get(original_url)
+
+    async def lookup_by_original_urls(self, original_urls: list[str]) -> dict[str, Mapping[str, Any]]:
+        """
+        Lookup the unexpired short URLs of several original URLs through their digests.
+
+        Args:
+            original_urls (list[str]): The original URLs to lookup.
+
+        Returns:
+            dict: The short URL data keyed by original URL.
+        """
+        rows = []
+        for chunk in chunks(list({url_digest(original_url) for original_url in original_urls})):
+            rows.extend(await self._read('SELECT short_url, original_url, expiration_date FROM short_urls '
+                                         f'WHERE original_url_digest IN ({",".join("?" * len(chunk))})', chunk))
+        return match_original_urls(map(to_url_doc, rows), original_urls)
+
+    async def update_expiration_date(self, short_url: str, new_expiration_date: datetime) -> None:
+        """
+        Update the expiration date of a URL.
+
+        Args:
+            short_url (str): The short URL to update.
+            new_expiration_date (datetime): The new expiration date.
+        """
+        await self.update_expiration_dates([short_url], new_expiration_date)
+
+    async def update_expiration_dates(self, short_urls: list[str], new_expiration_date: datetime) -> None:
+        """
+        Update the expiration date of several URLs in a single transaction.
+
+        Args:
+            short_urls (list[str]): The short URLs to update.
+            new_expiration_date (datetime): The new expiration date.
+        """
+        if short_urls:
+            expiration_date = new_expiration_date.timestamp()
+            await self._run(self._write, lambda connection: connection.executemany(
+                'UPDATE short_urls SET expiration_date = ? WHERE short_url = ?',
+                [(expiration_date, short_url) for short_url in short_urls]))
+
+    async def extend_expiration_dates(self, expiration_dates: Mapping[str, datetime]) -> None:
+        """
+        Move the expiration dates of several URLs forward in a single transaction.
+
+        Args:
+            expiration_dates (dict): The new expiration dates keyed by short URL.
+        """
+        if expiration_dates:
+            await self._run(self._write, lambda connection: connection.executemany(
+                'UPDATE short_urls SET expiration_date = MAX(expiration_date, ?) WHERE short_url = ?',
+                [(expiration_date.timestamp(), short_url) for short_url, expiration_date in expiration_dates.items()]))
+
+    async def delete_short_url(self, short_url: str) -> None:
+        """
+        Delete a short URL.
+
+        Args:
+            short_url (str): The short URL to delete.
+        """
+        await self._run(self._write, lambda connection: connection.execute(
+            'DELETE FROM short_urls WHERE short_url = ?', (short_url,)))
+
+    async def delete_short_urls(self, short_urls: list[str]) -> None:
+        """
+        Delete several short URLs in a single transaction.
+
+        Args:
+            short_urls (list[str]): The short URLs to delete.
+        """
+        if short_urls:
+            await self._run(self._write, lambda connection: connection.executemany(
+                'DELETE FROM short_urls WHERE short_url = ?', [(short_url,) for short_url in short_urls]))
+
+    async def scan_short_urls(self, after: str | None = None, batch_size: int = 1000) -> AsyncIterator[dict]:
+        """
+        Stream every short URL document, one page of the primary key at a time.
+
+        Args:
+            after (str, optional): Start after this short URL.
+            batch_size (int): Number of documents read per query.
+
+        Yields:
+            dict: The documents, expired ones included, ordered by short URL.
+        """
+        while True:
+            # Pages are read on the dedicated thread, a scan may touch pages that are not cached
+            rows = await self._run(lambda: self.background_reader.execute(
+                'SELECT short_url, original_url, expiration_date FROM short_urls WHERE short_url > ? '
+                'ORDER BY short_url LIMIT ?', (after if after is not None else '', batch_size)).fetchall())
+            for row in rows:
+                yield to_url_doc(row)
+            if len(rows) < batch_size:
+                return
+            after = rows[-1][0]
+
+    async def latest_short_urls(self, limit: int, batch_size: int = 1000) -> AsyncIterator[dict]:
+        """
+        Stream the unexpired short URLs that expire last, one page of the expiration date index at a time.
+
+        Args:
+            limit (int): Maximum number of documents.
+            batch_size (int): Number of documents read per query.
+
+        Yields:
+            dict: The documents, latest expiration first.
+        """
+        now, last = time.time(), (math.inf, '')
+        while limit > 0:
+            rows = await self._run(lambda: self.background_reader.execute(
+                'SELECT short_url, original_url, expiration_date FROM short_urls WHERE expiration_date > ? '
+                'AND (expiration_date < ? OR expiration_date = ? AND short_url < ?) '
+                'ORDER BY expiration_date DESC, short_url DESC LIMIT ?',
+                (now, last[0], last[0], last[1], min(batch_size, limit))).fetchall())
+            for row in rows:
+                yield to_url_doc(row)
+            if len(rows) < min(batch_size, limit):
+                return
+            limit -= len(rows)
+            last = rows[-1][2], rows[-1][0]
+
+    async def reserve_sequence_block(self, name: str, size: int) -> int:
+        """
+        Atomically reserve a block of consecutive numbers from a named counter.
+
+        Args:
+            name (str): The counter name.
+            size (int): Number of values to reserve.
+
+        Returns:
+            int: The first value of the reserved block.
+        """
+        value, = await self._run(self._write, lambda connection: connection.execute(
+            'INSERT INTO counters VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = value + excluded.value '
+            'RETURNING value', (name, size)).fetchone())
+        return value - size
+
+    async def increment_clicks(self, counts: Mapping[tuple[str, int], int]) -> None:
+        """
+        Add click counts to their time buckets in a single transaction.
+
+        Args:
+            counts (dict): Number of clicks keyed by short URL and bucket start as unix time.
+        """
+        if counts:
+            await self._run(self._write, lambda connection: connection.executemany(
+                'INSERT INTO clicks VALUES (?, ?, ?) '
+                'ON CONFLICT (short_url, bucket) DO UPDATE SET count = count + excluded.count',
+                [(short_url, bucket, count) for (short_url, bucket), count in counts.items()]))
+
+    async def top_clicked(self, limit: int, since: int = 0) -> list[dict]:
+        """
+        Find the most clicked short URLs.
+
+        Args:
+            limit (int): Maximum number of short URLs to return.
+            since (int): Only count the buckets starting at this unix time or later.
+
+        Returns:
+            list[dict]: The short URLs and their click counts, most clicked first.
+        """
+        # Aggregations scan many rows, so they stay off the event loop
+        rows = await self._run(lambda: self.background_reader.execute(
+            'SELECT short_url, SUM(count) AS total FROM clicks WHERE bucket >= ? GROUP BY short_url '
+            'ORDER BY total DESC, short_url LIMIT ?', (since, limit)).fetchall())
+        return [{'short_url': short_url, 'count': count} for short_url, count in rows]
+
+    async def click_history(self, short_url: str, since: int = 0) -> list[dict]:
+        """
+        Get the click counts of a short URL per time bucket.
+
+        Args:
+            short_url (str): The short URL.
+            since (int): Only return the buckets starting at this unix time or later.
+
+        Returns:
+            list[dict]: The bucket start as unix time and the click count, oldest first.
+        """
+        rows = await self._read('SELECT bucket, count FROM clicks WHERE short_url = ? AND bucket >= ? ORDER BY bucket',
+                                (short_url, since))
+        return [{'bucket': bucket, 'count': count} for bucket, count in rows]
+
+    async def close_connection(self) -> None:
+        """ Close the database file. """
+        await self._run(self.connection.close)
+        await self._run(self.background_reader.close)
+        self.executor.shutdown()
+        self.reader.close()
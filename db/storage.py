@@ -0,0 +1,80 @@
+from datetime import datetime
+from typing import Any, AsyncIterator, Mapping, Protocol
+
+
+class StorageBackend(Protocol):
+    """
+    The storage of short URLs, sequence counters and click counts used by the shortener.
+
+    `AsyncMongoDB` is the reference implementation and `SQLiteStorage` an embedded one for
+    nodes without a MongoDB deployment. Documents are dictionaries with the `short_url`, the
+    `original_url` and the `expiration_date` as a timezone-aware UTC datetime. Every backend passes
+    the conformance tests in `tests/test_storage_conformance.py`.
+    """
+
+    # Errors meaning the storage could not be reached, which trip the circuit breaker and
+    # make the shortener serve stale copies instead of failing
+    unavailable_errors: tuple[type[Exception], ...]
+
+    # Errors raised by `insert_short_url` when the short URL exists already
+    duplicate_errors: tuple[type[Exception], ...]
+
+    async def ensure_indexes(self) -> None:
+        """ Create the tables or indexes the lookups rely on, if they do not exist yet. """
+
+    async def insert_short_url(self, short_url: str, original_url: str, expiration_date: datetime) -> None:
+        """ Insert a short URL, failing if the short URL exists already. """
+
+    async def insert_short_urls(self, url_docs: list[dict]) -> list[str | None]:
+        """ Insert several short URLs, returning None or an error message for each of them. """
+
+    async def upsert_short_urls(self, url_docs: list[dict]) -> None:
+        """ Insert several short URLs, replacing the documents of the short URLs that exist already. """
+
+    async def lookup_by_short_url(self, short_url: str) -> Mapping[str, Any]:
+        """ Get the document of a short URL, raising ValueError if it is not found or has expired. """
+
+    async def lookup_by_short_urls(self, short_urls: list[str]) -> dict[str, Mapping[str, Any]]:
+        """ Get the documents of several short URLs keyed by short URL, including expired ones. """
+
+    async def lookup_by_original_url(self, original_url: str) -> Mapping[str, Any] | None:
+        """ Get the unexpired document of any spelling of an original URL, or None. """
+
+    async def lookup_by_original_urls(self, original_urls: list[str]) -> dict[str, Mapping[str, Any]]:
+        """ Get the unexpired documents of several original URLs keyed by the requested URL. """
+
+    async def update_expiration_date(self, short_url: str, new_expiration_date: datetime) -> None:
+        """ Set the expiration date of a short URL. """
+
+    async def update_expiration_dates(self, short_urls: list[str], new_expiration_date: datetime) -> None:
+        """ Set the expiration date of several short URLs. """
+
+    async def extend_expiration_dates(self, expiration_dates: Mapping[str, datetime]) -> None:
+        """ Move the expiration dates of several short URLs forward, never backward. """
+
+    async def delete_short_url(self, short_url: str) -> None:
+        """ Delete a short URL. """
+
+    async def delete_short_urls(self, short_urls: list[str]) -> None:
+        """ Delete several short URLs. """
+
+    def scan_short_urls(self, after: str | None = None, batch_size: int = 1000) -> AsyncIterator[dict]:
+        """ Stream every document, expired ones included, ordered by short URL and starting after `after`. """
+
+    def latest_short_urls(self, limit: int, batch_size: int = 1000) -> AsyncIterator[dict]:
+        """ Stream up to `limit` unexpired documents, the latest to expire, i.e. most recently created, first. """
+
+    async def reserve_sequence_block(self, name: str, size: int) -> int:
+        """ Atomically reserve `size` consecutive numbers of a named counter, returning the first. """
+
+    async def increment_clicks(self, counts: Mapping[tuple[str, int], int]) -> None:
+        """ Add click counts keyed by short URL and time bucket. """
+
+    async def top_clicked(self, limit: int, since: int = 0) -> list[dict]:
+        """ Get the most clicked short URLs and their counts since a bucket, most clicked first. """
+
+    async def click_history(self, short_url: str, since: int = 0) -> list[dict]:
+        """ Get the buckets and counts of a short URL since a bucket, oldest first. """
+
+    async def close_connection(self) -> None:
+        """ Release the connections or files of the backend. """
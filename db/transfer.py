@@ -0,0 +1,554 @@
+"""
+Export the short URL documents of the storage to a file and import them back.
+
+An export streams the documents through a cursor in short URL order and writes them as
+NDJSON, one JSON object per line, or in a compact binary format, optionally compressed
+with gzip or, with the `zstandard` package installed, zstd. Only one batch of documents is
+held in memory at a time, so the size of the store does not matter. An import decodes its
+input incrementally and upserts the documents in unordered batches with their expiration
+dates, with a bounded number of batches in flight, so the input is only read as fast as the
+storage takes the writes. Imported short URLs replace existing ones of the same code, and
+the sequence counter is moved past the codes of every batch before it is written, so they
+are not issued again while the import runs. The import holds a lease in the counters while it
+writes, so the short URL filters of the workers do not reject its short URLs and rebuild after.
+
+Both record a checkpoint next to the file and continue from it with `--resume`: an export
+ends a compressed member at every checkpoint and continues after the last short URL written
+there, an import skips the records that were written in full.
+
+    python -m db.transfer export short_urls.ndjson.gz
+    python -m db.transfer import short_urls.ndjson.gz --resume
+"""
+import argparse
+import asyncio
+import json
+import os
+import struct
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable
+
+from db.storage import StorageBackend
+from processing.allocator import SHORT_URL_SEQUENCE, KeyAllocator
+from processing.short_url_filter import IMPORT_LEASE_SECONDS, take_import_lease
+
+FORMATS = ('ndjson', 'binary')
+COMPRESSIONS = ('none', 'gzip', 'zstd')
+
+# The binary format starts with this header, followed by a record per document: the byte
+# lengths of the short URL and the original URL, the expiration date in unix milliseconds,
+# then the UTF-8 encoded short URL and original URL
+BINARY_HEADER = b'URLS\x01'
+RECORD = struct.Struct('>HIq')
+
+# Bytes read from an import file at a time
+CHUNK_SIZE = 1 << 20
+
+
+def zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("zstd compression requires the zstandard package") from None
+    return zstandard
+
+
+def guess_format(path: str) -> tuple[str, str]:
+    """
+    Tell the format and compression of a file from its extensions.
+
+    Args:
+        path (str): The file name, e.g. `short_urls.ndjson.gz`.
+
+    Returns:
+        tuple[str, str]: The format, `binary` for `.bin` files and `ndjson` otherwise, and the
+            compression, `gzip` for `.gz`, `zstd` for `.zst` and `none` otherwise.
+    """
+    stem, extension = os.path.splitext(path)
+    compression = {'.gz': 'gzip', '.zst': 'zstd'}.get(extension, 'none')
+    if compression != 'none':
+        extension = os.path.splitext(stem)[1]
+    return 'binary' if extension == '.bin' else 'ndjson', compression
+
+
+def encode_records(url_docs: list[dict], fmt: str) -> bytes:
+    """
+    Encode documents as records of an export.
+
+    Args:
+        url_docs (list[dict]): Documents with the short URL, original URL and expiration date.
+        fmt (str): `ndjson` or `binary`.
+
+    Returns:
+        bytes: The records.
+    """
+    if fmt == 'binary':
+        records = []
+        for url_doc in url_docs:
+            short_url, original_url = url_doc['short_url'].encode(), url_doc['original_url'].encode()
+            expires_at = round(url_doc['expiration_date'].timestamp() * 1000)
+            records.append(RECORD.pack(len(short_url), len(original_url), expires_at) + short_url + original_url)
+        return b''.join(records)
+    # Expiration dates are written in UTC with their offset, so any importer reads the same instant
+    return ''.join(json.dumps({'short_url': url_doc['short_url'], 'original_url': url_doc['original_url'],
+                               'expiration_date': url_doc['expiration_date'].astimezone(timezone.utc).isoformat()}
+                              ) + '\n' for url_doc in url_docs).encode()
+
+
+class RecordDecoder:
+    def __init__(self, fmt: str) -> None:
+        """
+        Initialize a decoder turning the chunks of an export back into documents.
+
+        Args:
+            fmt (str): `ndjson` or `binary`.
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format {fmt!r}")
+        self.format = fmt
+        self.buffer = bytearray()
+        self.header = fmt != 'binary'
+
+    def feed(self, data: bytes) -> list[dict]:
+        """
+        Decode the records completed by a chunk, keeping a partial record for the next one.
+
+        Args:
+            data (bytes): The next chunk of the export.
+
+        Returns:
+            list[dict]: The documents, with the expiration date as a UTC datetime.
+
+        Raises:
+            ValueError: If the input is not an export of the format.
+        """
+        self.buffer += data
+        if self.format == 'ndjson':
+            end = self.buffer.rfind(b'\n') + 1
+            lines = self.buffer[:end].splitlines()
+            del self.buffer[:end]
+            return [self._json_record(line) for line in lines if line.strip()]
+
+        offset = 0
+        if not self.header:
+            if len(self.buffer) < len(BINARY_HEADER):
+                return []
+            if self.buffer[:len(BINARY_HEADER)] != BINARY_HEADER:
+                raise ValueError("The input is not a binary export")
+            self.header, offset = True, len(BINARY_HEADER)
+        url_docs = []
+        while len(self.buffer) - offset >= RECORD.size:
+            short_url_length, original_url_length, expires_at = RECORD.unpack_from(self.buffer, offset)
+            end = offset + RECORD.size + short_url_length + original_url_length
+            if len(self.buffer) < end:
+                break
+            start = offset + RECORD.size
+            url_docs.append({'short_url': self.buffer[start:start + short_url_length].decode(),
+                             'original_url': self.buffer[start + short_url_length:end].decode(),
+                             'expiration_date': datetime.fromtimestamp(expires_at / 1000, timezone.utc)})
+            offset = end
+        del self.buffer[:offset]
+        return url_docs
+
+    @staticmethod
+    def _json_record(line: bytes) -> dict:
+        try:
+            record = json.loads(line)
+            expiration_date = datetime.fromisoformat(record['expiration_date'])
+            # Dates without an offset are UTC, as MongoDB stores them
+            if expiration_date.tzinfo is None:
+                expiration_date = expiration_date.replace(tzinfo=timezone.utc)
+            else:
+                expiration_date = expiration_date.astimezone(timezone.utc)
+            return {'short_url': record['short_url'], 'original_url': record['original_url'],
+                    'expiration_date': expiration_date}
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Invalid record {line[:200]!r}: {e}") from None
+
+    def close(self) -> None:
+        """
+        Check that the input did not end in the middle of a record.
+
+        Raises:
+            ValueError: If it did.
+        """
+        if self.buffer.strip() or not self.header:
+            raise ValueError("The input ends in the middle of a record")
+
+
+class Passthrough:
+    """ Stands in for a compressor or decompressor of uncompressed files. """
+
+    eof = False
+    unused_data = b''
+
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def decompress(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b''
+
+
+def compressor(compression: str):
+    """
+    Create a compressor whose `flush` ends a gzip member or a zstd frame.
+
+    Args:
+        compression (str): `none`, `gzip` or `zstd`.
+
+    Returns:
+        A compressor with the `compress` and `flush` methods of `zlib`'s.
+    """
+    if compression == 'gzip':
+        return zlib.compressobj(wbits=31)
+    if compression == 'zstd':
+        return zstandard().ZstdCompressor().compressobj()
+    if compression == 'none':
+        return Passthrough()
+    raise ValueError(f"Unknown compression {compression!r}")
+
+
+class Decompressor:
+    def __init__(self, compression: str) -> None:
+        """
+        Initialize a decompressor of concatenated gzip members or zstd frames, as written by an
+        export that was resumed.
+
+        Args:
+            compression (str): `none`, `gzip` or `zstd`.
+        """
+        self.compression = compression
+        self.current = self._new()
+        self.started = False
+
+    def _new(self):
+        if self.compression == 'gzip':
+            return zlib.decompressobj(wbits=31)
+        if self.compression == 'zstd':
+            return zstandard().ZstdDecompressor().decompressobj()
+        if self.compression == 'none':
+            return Passthrough()
+        raise ValueError(f"Unknown compression {self.compression!r}")
+
+    def decompress(self, data: bytes) -> bytes:
+        """
+        Decompress the next chunk of the input.
+
+        Args:
+            data (bytes): The compressed chunk.
+
+        Returns:
+            bytes: The data decompressed so far.
+
+        Raises:
+            ValueError: If the input is not compressed with the compression.
+        """
+        output = []
+        while data:
+            self.started = True
+            try:
+                output.append(self.current.decompress(data))
+            except Exception as e:
+                raise ValueError(f"The input is not valid {self.compression} data: {e}") from None
+            if not self.current.eof:
+                break
+            data = self.current.unused_data
+            self.current, self.started = self._new(), False
+        return b''.join(output)
+
+    def close(self) -> None:
+        """
+        Check that the input did not end in the middle of a compressed member.
+
+        Raises:
+            ValueError: If it did.
+        """
+        if self.started and self.compression != 'none':
+            raise ValueError("The input ends in the middle of a compressed member")
+
+
+async def export_short_urls(storage: StorageBackend, fmt: str = 'ndjson', compression: str = 'none',
+                            after: str | None = None, include_expired: bool = False, batch_size: int = 1000,
+                            checkpoint_every: int = 100000) -> AsyncIterator[tuple[bytes, str | None]]:
+    """
+    Stream the short URL documents of a storage as an export.
+
+    Args:
+        storage (StorageBackend): The storage to export.
+        fmt (str): `ndjson` or `binary`.
+        compression (str): `none`, `gzip` or `zstd`.
+        after (str, optional): Continue an export after this short URL, the header of the format is then left out.
+        include_expired (bool): Export expired short URLs as well.
+        batch_size (int): Number of documents read per round trip and encoded at a time.
+        checkpoint_every (int): Number of documents after which a compressed member is ended.
+
+    Yields:
+        tuple: The next bytes of the export, and the last short URL read if the export can be
+            resumed after it from the end of these bytes, None otherwise.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}")
+    compress = compressor(compression)
+    pending = [compress.compress(BINARY_HEADER)] if fmt == 'binary' and after is None else []
+    now, batch, last, since_checkpoint = datetime.now(timezone.utc), [], after, 0
+    async for url_doc in storage.scan_short_urls(after, batch_size):
+        last = url_doc['short_url']
+        if include_expired or url_doc['expiration_date'] > now:
+            batch.append(url_doc)
+        if len(batch) >= batch_size:
+            pending.append(compress.compress(encode_records(batch, fmt)))
+            since_checkpoint += len(batch)
+            batch = []
+            if since_checkpoint >= checkpoint_every:
+                pending.append(compress.flush())
+                compress, since_checkpoint = compressor(compression), 0
+                yield b''.join(pending), last
+            else:
+                yield b''.join(pending), None
+            pending = []
+    pending.extend([compress.compress(encode_records(batch, fmt)), compress.flush()])
+    yield b''.join(pending), last
+
+
+async def advance_counter(storage: StorageBackend, sequence: int) -> None:
+    """
+    Move the sequence counter past a sequence number, if it is not past it already.
+
+    Args:
+        storage (StorageBackend): The storage holding the counter.
+        sequence (int): The sequence number that must never be leased.
+    """
+    current = await storage.reserve_sequence_block(SHORT_URL_SEQUENCE, 0)
+    if sequence >= current:
+        await storage.reserve_sequence_block(SHORT_URL_SEQUENCE, sequence + 1 - current)
+
+
+async def import_short_urls(storage: StorageBackend, chunks: AsyncIterable[bytes], fmt: str = 'ndjson',
+                            compression: str = 'none', skip: int = 0, include_expired: bool = False,
+                            batch_size: int = 1000, concurrency: int = 4, allocator: KeyAllocator | None = None,
+                            progress: dict | None = None,
+                            on_checkpoint: Callable[[int], None] | None = None,
+                            on_batch: Callable[[list[dict]], Awaitable[None]] | None = None,
+                            import_delay: float = 0.0) -> dict:
+    """
+    Upsert the short URL documents of an export into a storage.
+
+    Args:
+        storage (StorageBackend): The storage to import into.
+        chunks (AsyncIterable[bytes]): The export, chunk by chunk.
+        fmt (str): `ndjson` or `binary`.
+        compression (str): `none`, `gzip` or `zstd`.
+        skip (int): Number of records written by an earlier, interrupted import.
+        include_expired (bool): Import expired short URLs as well.
+        batch_size (int): Number of documents written per `bulk_write`.
+        concurrency (int): Maximum number of batches written at the same time.
+        allocator (KeyAllocator, optional): The allocator of the storage, to move its counter past the imported
+            codes, including the skipped ones, before each batch is written.
+        progress (dict, optional): Updated in place with the numbers of records read, written and
+            expired and the `checkpoint`, the number of leading records written in full.
+        on_checkpoint (Callable, optional): Called with the checkpoint whenever it moves.
+        on_batch (Callable, optional): Awaited with every batch of documents once it is written, e.g. to
+            refresh the caches of the short URLs it replaced.
+        import_delay (float): Seconds to wait between taking the import lease and writing the first batch, so
+            the short URL filters of all workers have read the lease before they could reject its short URLs.
+
+    Returns:
+        dict: The progress.
+
+    Raises:
+        ValueError: If the input is not a valid export.
+    """
+    progress = progress if progress is not None else {}
+    progress.update(read=0, written=0, expired=0, checkpoint=skip)
+    decompressor, decoder = Decompressor(compression), RecordDecoder(fmt)
+    slots = asyncio.Semaphore(concurrency)
+    # Batches in input order as [end position, written], to tell the prefix written in full
+    batches: list[list] = []
+    tasks: set[asyncio.Task] = set()
+    failures: list[Exception] = []
+    # The highest sequence number read, and the one the counter was moved past
+    highest = advanced = -1
+    # Time at which the import lease is renewed, None before the first batch
+    renew_at: float | None = None
+
+    def note_sequence(url_doc: dict) -> None:
+        nonlocal highest
+        if allocator:
+            sequence = allocator.decode(url_doc['short_url'])
+            if sequence is not None and sequence > highest:
+                highest = sequence
+
+    async def advance() -> None:
+        nonlocal advanced
+        if highest > advanced:
+            await advance_counter(storage, highest)
+            advanced = highest
+
+    async def hold_lease() -> None:
+        nonlocal renew_at
+        if renew_at is None:
+            await take_import_lease(storage)
+            await asyncio.sleep(import_delay)
+        if renew_at is None or time.time() >= renew_at:
+            await take_import_lease(storage)
+            renew_at = time.time() + IMPORT_LEASE_SECONDS / 2
+
+    async def write(batch: list[dict], entry: list) -> None:
+        try:
+            await storage.upsert_short_urls(batch)
+            if on_batch:
+                await on_batch(batch)
+        except Exception as e:
+            failures.append(e)
+            return
+        finally:
+            slots.release()
+        entry[1] = True
+        progress['written'] += len(batch)
+        while batches and batches[0][1]:
+            progress['checkpoint'] = batches.pop(0)[0]
+        if on_checkpoint:
+            on_checkpoint(progress['checkpoint'])
+
+    async def submit(batch: list[dict]) -> None:
+        # Wait for a free slot, so reading the input waits for the storage
+        await slots.acquire()
+        if failures:
+            slots.release()
+            return
+        # Live allocators must not lease the codes of the batch while it is written, nor filters reject them
+        try:
+            await hold_lease()
+            await advance()
+        except Exception:
+            slots.release()
+            raise
+        entry = [progress['read'], False]
+        batches.append(entry)
+        task = asyncio.create_task(write(batch, entry))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    now, batch = datetime.now(timezone.utc), []
+    try:
+        async for chunk in chunks:
+            for url_doc in decoder.feed(decompressor.decompress(chunk)):
+                progress['read'] += 1
+                note_sequence(url_doc)
+                if progress['read'] <= skip:
+                    continue
+                if not include_expired and url_doc['expiration_date'] <= now:
+                    progress['expired'] += 1
+                    continue
+                batch.append(url_doc)
+                if len(batch) >= batch_size:
+                    await submit(batch)
+                    batch = []
+                if failures:
+                    break
+            if failures:
+                break
+        else:
+            decompressor.close()
+            decoder.close()
+            if batch:
+                await submit(batch)
+    finally:
+        await asyncio.gather(*tasks)
+        # Codes of skipped or expired records after the last batch
+        await advance()
+        if renew_at is not None:
+            # The lease ends well after the last write, whatever happened to the batches
+            await take_import_lease(storage)
+    if failures:
+        raise failures[0]
+    if not batches:
+        progress['checkpoint'] = max(progress['checkpoint'], progress['read'])
+    return progress
+
+
+def load_checkpoint(path: str) -> dict:
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_checkpoint(path: str, checkpoint: dict) -> None:
+    # Replace the file at once, so an interruption never leaves half a checkpoint
+    with open(path + '.tmp', 'w') as file:
+        json.dump(checkpoint, file)
+    os.replace(path + '.tmp', path)
+
+
+async def read_chunks(path: str) -> AsyncIterator[bytes]:
+    with open(path, 'rb') as file:
+        while chunk := file.read(CHUNK_SIZE):
+            yield chunk
+
+
+async def run(args: argparse.Namespace) -> None:
+    from db.database import Backends, settings
+    from processing.short_url_filter import IMPORT_DELAY
+    from processing.shortener import URLShortener
+
+    fmt, compression = guess_format(args.path)
+    fmt, compression = args.format or fmt, args.compression or compression
+    checkpoint_path = args.path + '.checkpoint'
+    checkpoint = load_checkpoint(checkpoint_path) if args.resume else {}
+    backends = Backends(settings)
+    try:
+        if args.command == 'export':
+            offset = checkpoint.get('offset', 0)
+            with open(args.path, 'r+b' if offset else 'wb') as file:
+                # Drop what was written after the last checkpoint, it is exported again
+                file.truncate(offset)
+                file.seek(offset)
+                async for data, last in export_short_urls(backends.storage, fmt, compression, checkpoint.get('after'),
+                                                          args.include_expired, args.batch_size):
+                    file.write(data)
+                    if last is not None:
+                        file.flush()
+                        save_checkpoint(checkpoint_path, {'after': last, 'offset': file.tell()})
+                        print(f"Exported up to {last}, {file.tell()} bytes")
+        else:
+            def report(position: int) -> None:
+                save_checkpoint(checkpoint_path, {'records': position})
+
+            # An import may be the first use of the storage
+            await backends.storage.ensure_indexes()
+            # Replaced mappings must not keep being served from Memcache
+            shortener = URLShortener(backends.storage, backends.async_memcache, allocator=backends.key_allocator,
+                                     cache_ttl=settings.memcache_ttl, stale_ttl=settings.stale_cache_ttl)
+            progress = await import_short_urls(backends.storage, read_chunks(args.path), fmt, compression,
+                                               checkpoint.get('records', 0), args.include_expired, args.batch_size,
+                                               args.concurrency, backends.key_allocator, on_checkpoint=report,
+                                               on_batch=shortener.refresh_short_urls,
+                                               import_delay=IMPORT_DELAY if settings.short_url_filter else 0.0)
+            print(f"Import done: {progress}")
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+    finally:
+        await backends.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('export', 'import'))
+    parser.add_argument('path', help='the export file, its extensions tell the format and compression')
+    parser.add_argument('--format', choices=FORMATS)
+    parser.add_argument('--compression', choices=COMPRESSIONS)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=4, help='batches written at the same time by an import')
+    parser.add_argument('--include-expired', action='store_true', help='transfer expired short URLs as well')
+    parser.add_argument('--resume', action='store_true', help='continue from the checkpoint of an interrupted run')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,90 @@
+import asyncio
+import sqlite3
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.responses import FileResponse
+from pymongo.errors import PyMongoError
 
 from api import endpoints
+from api.fast_path import RedirectFastPath
+from api.instrumentation import MetricsMiddleware
+from api.rate_limit import RateLimitMiddleware
+from db.database import settings
+
+
+async def ensure_indexes(storage) -> None:
+    """
+    Create the indexes of the short URL collection if they are missing.
+
+    Args:
+        storage (StorageBackend): The storage backend of this worker.
+    """
+    try:
+        await storage.ensure_indexes()
+    except (PyMongoError, sqlite3.Error) as e:
+        print('Error occurred while creating the storage indexes: ', e)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Create the storage clients of this worker on startup and flush buffered writes and close them on shutdown.
+
+    The clients are created here, in the worker process, rather than when the application
+    is imported. The indexes of the short URL collection are created and the caches warmed in
+    the background, so a MongoDB outage at startup is reported but does not delay serving
+    redirects from the cache.
+    """
+    shortener = endpoints.get_shortener()
+    analytics = endpoints.analytics
+    warmer = endpoints.warmer
+    rate_limiter = endpoints.rate_limiter
+    indexing = asyncio.create_task(ensure_indexes(shortener.mongodb))
+    if warmer and settings.cache_warmup_on_startup:
+        warmer.start(once=True)
+
+    if shortener.write_behind:
+        shortener.write_behind.start()
+    if shortener.code_filter:
+        shortener.code_filter.start()
+    if analytics:
+        analytics.start()
+    if rate_limiter:
+        rate_limiter.start()
+    yield
+    indexing.cancel()
+    if warmer:
+        await warmer.stop()
+    if shortener.code_filter:
+        await shortener.code_filter.stop()
+    if analytics:
+        await analytics.stop()
+    if rate_limiter:
+        await rate_limiter.stop()
+    if shortener.write_behind:
+        await shortener.write_behind.stop()
+    await endpoints.close_backends()
+
 
 # Initialize FastAPI app
-app = FastAPI(title="URL Shortener", swagger_ui_parameters={"defaultModelsExpandDepth": -1})
+app = FastAPI(title="URL Shortener", swagger_ui_parameters={"defaultModelsExpandDepth": -1}, lifespan=lifespan)
 
 # Include the endpoints from 'api' package
 app.include_router(endpoints.router)
 
+# Answer redirects and the index page before FastAPI's routing, inside the metrics middleware
+if settings.redirect_fast_path:
+    app.add_middleware(RedirectFastPath, routes=[*app.routes, *endpoints.router.routes])
+
+# Reject clients over their request budgets before the fast path, inside the metrics middleware
+if settings.rate_limit_enabled:
+    app.add_middleware(RateLimitMiddleware, routes=[*app.routes, *endpoints.router.routes],
+                       api_key_header=settings.rate_limit_api_key_header, api_keys=settings.rate_limit_api_keys)
+
+# Record the latency and status of every request
+app.add_middleware(MetricsMiddleware, metrics=endpoints.metrics)
+
 
 @app.get("/", include_in_schema=False,
          description="The method responds with the `index.html` which is located in the `static` directory.")
@@ -21,4 +97,3 @@ async def root():
             and sends that directly as the response.
     """
     return FileResponse('static/index.html')
-
@@ -0,0 +1,138 @@
+import asyncio
+import time
+
+from processing.encoder import BASE58_ALPHABET, base58_decode, base58_encode
+
+# Name of the MongoDB counter that hands out short URL sequence numbers
+SHORT_URL_SEQUENCE = 'short_url'
+
+# Codes that would be shadowed by other routes of the application
+RESERVED_SHORT_URLS = frozenset({'docs', 'redoc', 'metrics'})
+
+# Fixed offset added before encoding so the first sequence numbers don't map to '1111111'.
+# Changing it would let new codes collide with already issued ones.
+CODE_OFFSET = 0x5DEECE66D
+
+
+class KeyAllocator:
+    def __init__(self, mongodb, block_size: int = 1000, code_length: int = 7,
+                 max_block_age: float | None = None) -> None:
+        """
+        Initialize an allocator that hands out unique short URLs from leased sequence blocks.
+
+        A worker leases `block_size` consecutive sequence numbers at a time from a counter
+        in MongoDB, so numbers are unique across processes and nodes. Inside the worker a
+        number is taken from the current block without any I/O or locking, and mapped to a
+        fixed length base58 code by a bijective permutation, so consecutive numbers produce
+        unrelated looking codes. A block leased more than `max_block_age` seconds ago is given
+        up for a new one, so every code issued from now on is above the counter value of that
+        long ago, which lets a `ShortURLFilter` tell codes that cannot exist.
+
+        Args:
+            mongodb (StorageBackend): MongoDB instance, or another storage backend, holding the counter.
+            block_size (int): Number of sequence numbers leased per round trip.
+            code_length (int): Length of the generated codes.
+            max_block_age (float, optional): Seconds a leased block is used at most, None for no limit.
+        """
+        self.mongodb = mongodb
+        self.block_size = block_size
+        self.code_length = code_length
+        self.space = len(BASE58_ALPHABET) ** code_length
+        self.multiplier = self._coprime_multiplier(self.space)
+        self.inverse = pow(self.multiplier, -1, self.space)
+        self.max_block_age = max_block_age
+        self._next = 0
+        self._end = 0
+        self._leased_at = 0.0
+        self._pending: asyncio.Future | None = None
+
+    @staticmethod
+    def _coprime_multiplier(space: int) -> int:
+        # 58 = 2 * 29, so any odd multiplier that is not a multiple of 29 is invertible modulo 58^n.
+        # Starting near the golden ratio spreads consecutive inputs across the whole code space.
+        multiplier = int(space * 0.6180339887) | 1
+        while multiplier % 29 == 0:
+            multiplier += 2
+        return multiplier
+
+    def encode(self, sequence: int) -> str:
+        """
+        Map a sequence number to its short URL.
+
+        Args:
+            sequence (int): The sequence number.
+
+        Returns:
+            str: The fixed length base58 code.
+
+        Raises:
+            ValueError: If the sequence number does not fit into the code space.
+        """
+        if not 0 <= sequence < self.space:
+            raise ValueError(f"Sequence number {sequence} exceeds the {self.code_length} character code space")
+        return base58_encode((sequence * self.multiplier + CODE_OFFSET) % self.space, self.code_length)
+
+    def decode(self, short_url: str) -> int | None:
+        """
+        Map a short URL back to its sequence number.
+
+        Args:
+            short_url (str): The short URL.
+
+        Returns:
+            int: The sequence number, or None if the string is not a code of this allocator.
+        """
+        if len(short_url) != self.code_length:
+            return None
+        try:
+            permuted = base58_decode(short_url)
+        except ValueError:
+            return None
+        return (permuted - CODE_OFFSET) * self.inverse % self.space
+
+    async def _lease(self) -> tuple[int, int, float]:
+        # The time before the request, when the counter was at most at the start of the block
+        leased_at = time.time()
+        start = await self.mongodb.reserve_sequence_block(SHORT_URL_SEQUENCE, self.block_size)
+        return start, start + self.block_size, leased_at
+
+    def _block_expired(self) -> bool:
+        return self.max_block_age is not None and time.time() - self._leased_at > self.max_block_age
+
+    async def allocate(self) -> str:
+        """
+        Allocate a new short URL.
+
+        The next block is leased in the background once the current block runs low, so
+        allocation normally completes without waiting on MongoDB.
+
+        Returns:
+            str: A short URL that has never been handed out before.
+        """
+        if self._block_expired():
+            self._next = self._end
+        while self._next >= self._end:
+            # Coroutines that run out of numbers at the same time share a single lease
+            if self._pending is None:
+                self._pending = asyncio.ensure_future(self._lease())
+            pending = self._pending
+            try:
+                start, end, leased_at = await pending
+            finally:
+                installed = self._pending is not pending
+                if not installed:
+                    self._pending = None
+            if not installed:
+                self._next, self._end, self._leased_at = start, end, leased_at
+                if self._block_expired():
+                    # A block prefetched long ago
+                    self._next = self._end
+
+        sequence = self._next
+        self._next += 1
+        if self._pending is None and self._end - self._next <= self.block_size // 10:
+            self._pending = asyncio.ensure_future(self._lease())
+        short_url = self.encode(sequence)
+        if short_url in RESERVED_SHORT_URLS:
+            return await self.allocate()
+        return short_url
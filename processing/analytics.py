@@ -0,0 +1,153 @@
+import asyncio
+import time
+from typing import Callable
+
+from db.storage import StorageBackend
+from processing.metrics import Sample
+
+
+class ClickAnalytics:
+    def __init__(self, mongodb: StorageBackend, interval: float = 10.0, bucket_seconds: int = 3600,
+                 max_pending: int = 100000, clock: Callable[[], float] = time.time) -> None:
+        """
+        Initialize a per-worker buffer aggregating redirect clicks and writing them in batches.
+
+        Recording a click only increments an in-memory counter for the short URL and the current
+        time bucket. Every `interval` seconds the counters are added to the `clicks` collection
+        with a single `bulk_write` of `$inc` upserts. Once `max_pending` counters are buffered,
+        for instance while MongoDB is unreachable, clicks on short URLs without a counter yet are
+        dropped and counted instead of growing the buffer or delaying the redirect.
+
+        Args:
+            mongodb (StorageBackend): MongoDB instance, or another storage backend, holding the click counts.
+            interval (float): Seconds between flushes.
+            bucket_seconds (int): Length of the time buckets clicks are counted in.
+            max_pending (int): Maximum number of buffered counters.
+            clock (Callable): Returns the current unix time, injectable for tests.
+        """
+        self.mongodb = mongodb
+        self.interval = interval
+        self.bucket_seconds = bucket_seconds
+        self.max_pending = max_pending
+        self.clock = clock
+        self.pending: dict[tuple[str, int], int] = {}
+        self.task: asyncio.Task | None = None
+        self.recorded = 0
+        self.dropped = 0
+        self.flushed = 0
+
+    def bucket(self, timestamp: float) -> int:
+        """ Get the start of the time bucket containing a unix time. """
+        return int(timestamp // self.bucket_seconds * self.bucket_seconds)
+
+    def record(self, short_url: str) -> None:
+        """
+        Count a click on a short URL, without any I/O.
+
+        Args:
+            short_url (str): The short URL that was resolved.
+        """
+        key = (short_url, self.bucket(self.clock()))
+        count = self.pending.get(key)
+        if count is not None:
+            self.pending[key] = count + 1
+        elif len(self.pending) < self.max_pending:
+            self.pending[key] = 1
+        else:
+            self.dropped += 1
+            return
+        self.recorded += 1
+
+    async def flush(self) -> None:
+        """
+        Add all buffered click counts to MongoDB.
+
+        Counts that could not be written are put back into the buffer for the next flush, as far
+        as it has room for them.
+        """
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        try:
+            await self.mongodb.increment_clicks(batch)
+        except BaseException:
+            # Keep the counts, also when stop() cancelled the write, merging them with clicks recorded
+            # while the write was running. A write cancelled after reaching MongoDB is counted twice.
+            for key, count in batch.items():
+                if key in self.pending or len(self.pending) < self.max_pending:
+                    self.pending[key] = self.pending.get(key, 0) + count
+                else:
+                    self.dropped += count
+            raise
+        self.flushed += sum(batch.values())
+
+    async def run(self) -> None:
+        """ Flush the buffer every `interval` seconds until cancelled. """
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print('Error occurred while flushing click counts: ', e)
+
+    def start(self) -> None:
+        """ Start flushing in the background. """
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """ Stop the background flushes and write everything still buffered. """
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print('Error occurred while flushing click counts: ', e)
+
+    async def top_links(self, limit: int = 10, hours: float | None = None) -> list[dict]:
+        """
+        Find the most clicked short URLs, counting the clicks flushed so far.
+
+        Args:
+            limit (int): Maximum number of short URLs to return.
+            hours (float, optional): Only count the clicks of the last hours, all clicks if omitted.
+
+        Returns:
+            list[dict]: The short URLs and their click counts, most clicked first.
+        """
+        since = self.bucket(self.clock() - hours * 3600) if hours is not None else 0
+        return await self.mongodb.top_clicked(limit, since)
+
+    async def history(self, short_url: str, hours: float | None = None) -> list[dict]:
+        """
+        Get the click counts of a short URL per time bucket, counting the clicks flushed so far.
+
+        Args:
+            short_url (str): The short URL.
+            hours (float, optional): Only return the buckets of the last hours, all buckets if omitted.
+
+        Returns:
+            list[dict]: The bucket start as unix time and the click count, oldest first.
+        """
+        since = self.bucket(self.clock() - hours * 3600) if hours is not None else 0
+        return await self.mongodb.click_history(short_url, since)
+
+    def collect(self) -> list[Sample]:
+        """
+        Report the buffer counters as metric samples.
+
+        Returns:
+            list: Samples for the registry exposition.
+        """
+        return [
+            ('url_shortener_clicks_recorded_total', 'Clicks counted by this worker.', 'counter', {}, self.recorded),
+            ('url_shortener_clicks_dropped_total', 'Clicks dropped because the buffer was full.', 'counter', {},
+             self.dropped),
+            ('url_shortener_clicks_flushed_total', 'Clicks written to MongoDB.', 'counter', {}, self.flushed),
+            ('url_shortener_click_counters_pending', 'Buffered click counters.', 'gauge', {}, len(self.pending)),
+        ]
@@ -0,0 +1,52 @@
+import hashlib
+import math
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.01) -> None:
+        """
+        Initialize a Bloom filter, a bit array answering whether a key may have been added.
+
+        A key that was added is always reported, a key that was not is reported with a
+        probability of about `error_rate` once `capacity` keys were added. The array takes
+        -ln(error_rate) / ln(2)^2 bits per key, 9.6 bits or 1.2 MB per million keys at 1%.
+        The bit positions of a key are derived from a single BLAKE2b digest by double hashing.
+
+        Args:
+            capacity (int): Number of keys the filter is sized for.
+            error_rate (float): False positive rate at `capacity` keys.
+        """
+        capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str) -> list[int]:
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, key: str) -> None:
+        """
+        Add a key.
+
+        Args:
+            key (str): The key.
+        """
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    @property
+    def memory(self) -> int:
+        """ Bytes taken by the bit array. """
+        return len(self.bits)
+
+    @property
+    def error_rate(self) -> float:
+        """ Expected false positive rate with the keys added so far. """
+        return (1 - math.exp(-self.hash_count * self.count / self.size)) ** self.hash_count
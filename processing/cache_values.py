@@ -0,0 +1,71 @@
+import time
+
+# Prefix of the Memcache value remembering that a short URL does not exist or has expired
+NEGATIVE_CACHE_PREFIX = '!'
+
+# Prefix of the Memcache key holding the stale copy of a mapping, served while MongoDB is unreachable
+STALE_KEY_PREFIX = '~'
+
+# Memcache value replacing the stale copy of a deleted short URL
+TOMBSTONE = NEGATIVE_CACHE_PREFIX + 'Short URL not found'
+
+
+def pack_cache_value(original_url: str, expires_at: float) -> str:
+    """
+    Encode an original URL together with its expiry for storage in Memcache.
+
+    Args:
+        original_url (str): The original URL.
+        expires_at (float): Unix time at which the short URL expires.
+
+    Returns:
+        str: The value in the `<expires_at>|<original_url>` form.
+    """
+    return f'{int(expires_at)}|{original_url}'
+
+
+def unpack_cache_value(value: str | None) -> tuple[str | None, float | None]:
+    """
+    Decode a value written by `pack_cache_value`.
+
+    Values cached before the expiry was stored alongside the URL are returned with an unknown expiry.
+
+    Args:
+        value (str): The cached value, or None on a cache miss.
+
+    Returns:
+        tuple: The original URL and its expiry as unix time, either of which may be None.
+    """
+    if not value:
+        return None, None
+    expires_at, separator, original_url = value.partition('|')
+    if not separator or not expires_at.isdigit():
+        return value, None
+    return original_url, float(expires_at)
+
+
+def memcache_entries(short_url: str, original_url: str, expires_at: float, cache_ttl: float = 0,
+                     stale_ttl: float = 0) -> list[tuple[str, str, float]]:
+    """
+    Describe the Memcache entries of a mapping: the authoritative one and its stale copy.
+
+    Both entries end when the short URL expires. The authoritative entry is further limited
+    to `cache_ttl` seconds, after which the mapping is read from MongoDB again, while the
+    stale copy under its own key lives for up to `stale_ttl` seconds.
+
+    Args:
+        short_url (str): The short URL.
+        original_url (str): The original URL.
+        expires_at (float): Unix time at which the short URL expires.
+        cache_ttl (float): Lifetime of the authoritative entry in seconds, 0 for no limit.
+        stale_ttl (float): Lifetime of the stale copy in seconds, 0 disables it.
+
+    Returns:
+        list: Tuples of key, value and expiration time in seconds for `set_cache_multi`.
+    """
+    value = pack_cache_value(original_url, expires_at)
+    lifetime = expires_at - time.time()
+    items = [(short_url, value, min(lifetime, cache_ttl) if cache_ttl > 0 else lifetime)]
+    if stale_ttl > 0:
+        items.append((STALE_KEY_PREFIX + short_url, value, min(lifetime, stale_ttl)))
+    return items
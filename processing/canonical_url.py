@@ -0,0 +1,60 @@
+import hashlib
+from urllib.parse import urlsplit, urlunsplit
+
+# Ports implied by the scheme, dropped from the canonical form
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Size in bytes of the digest stored with every short URL, small enough for a compact index
+# while a collision stays negligible for billions of URLs
+URL_DIGEST_SIZE = 16
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    Reduce a URL to a canonical form, so trivially different spellings of it compare equal.
+
+    The scheme and host are lowercased, a default port is dropped, an empty path becomes `/`
+    and a trailing slash is removed from any other path, and the query parameters are sorted.
+    Percent-encoding is left as it is. The canonical form is only used to find duplicates,
+    the URL itself is stored and redirected to as it was given.
+
+    Args:
+        url (str): The URL.
+
+    Returns:
+        str: The canonical form of the URL.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    try:
+        port = parts.port
+    except ValueError:
+        # An invalid port, keep the network location as it is apart from its case
+        netloc = parts.netloc.lower()
+    else:
+        host = parts.hostname or ''
+        netloc = f'[{host}]' if ':' in host else host
+        if port is not None and port != DEFAULT_PORTS.get(scheme):
+            netloc = f'{netloc}:{port}'
+        if parts.username is not None:
+            userinfo = parts.netloc.rpartition('@')[0]
+            netloc = f'{userinfo}@{netloc}'
+
+    path = parts.path or '/'
+    if len(path) > 1:
+        path = path.rstrip('/') or '/'
+    query = '&'.join(sorted(param for param in parts.query.split('&') if param))
+    return urlunsplit((scheme, netloc, path, query, parts.fragment))
+
+
+def url_digest(url: str) -> bytes:
+    """
+    Compute the fixed size digest of the canonical form of a URL.
+
+    Args:
+        url (str): The URL.
+
+    Returns:
+        bytes: The BLAKE2b digest of `URL_DIGEST_SIZE` bytes.
+    """
+    return hashlib.blake2b(canonicalize_url(url).encode(), digest_size=URL_DIGEST_SIZE).digest()
@@ -0,0 +1,110 @@
+import time
+from typing import Awaitable, Callable, TypeVar
+
+T = TypeVar('T')
+
+
+class CircuitOpenError(Exception):
+    """ Raised instead of calling a backend that is considered unhealthy. """
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__("The database is temporarily unavailable")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 failure_types: tuple[type[BaseException], ...] = (OSError,),
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        Initialize a circuit breaker guarding calls to a backend.
+
+        After `failure_threshold` consecutive failures the circuit opens and calls fail fast
+        with `CircuitOpenError` instead of waiting on the backend. Once `reset_timeout`
+        seconds have passed a single trial call is let through: its success closes the
+        circuit, its failure keeps it open for another `reset_timeout`.
+
+        Args:
+            failure_threshold (int): Consecutive failures opening the circuit.
+            reset_timeout (float): Seconds the circuit stays open before a trial call.
+            failure_types (tuple): Exceptions meaning the backend is unhealthy. Other exceptions,
+                e.g. a ValueError for a missing document, count as a successful call.
+            clock (Callable): Returns the current monotonic time, injectable for tests.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failure_types = failure_types
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.trial = False
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        return 'half_open' if self.clock() - self.opened_at >= self.reset_timeout else 'open'
+
+    def retry_after(self) -> float:
+        """ Seconds until the next trial call, 0 if the circuit is closed. """
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - self.clock())
+
+    def allow(self) -> bool:
+        """
+        Decide whether a call may reach the backend.
+
+        Returns:
+            bool: True if the circuit is closed, or if this call is the trial of a half open circuit.
+        """
+        if self.opened_at is None:
+            return True
+        if self.state == 'half_open' and not self.trial:
+            self.trial = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.trial = False
+        if self.failures >= self.failure_threshold or self.opened_at is not None:
+            self.opened_at = self.clock()
+
+    async def call(self, func: Callable[..., Awaitable[T]], *args) -> T:
+        """
+        Call the backend through the breaker.
+
+        Args:
+            func (Callable): The coroutine function to call.
+            args: Its arguments.
+
+        Returns:
+            The result of the call.
+
+        Raises:
+            CircuitOpenError: If the circuit is open.
+        """
+        if not self.allow():
+            raise CircuitOpenError(self.retry_after())
+        try:
+            result = await func(*args)
+        except self.failure_types:
+            self.record_failure()
+            raise
+        except Exception:
+            self.record_success()
+            raise
+        except BaseException:
+            # A cancelled trial proves nothing, let the next call try instead
+            self.trial = False
+            raise
+        self.record_success()
+        return result
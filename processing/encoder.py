@@ -2,6 +2,7 @@ import time
 import uuid
 
 BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+BASE58_INDEX = {char: index for index, char in enumerate(BASE58_ALPHABET)}
 
 
 def custom_hash(string: str) -> int:
@@ -61,22 +62,46 @@ def generate_encoded_string() -> str:
     return short_url
 
 
-def base58_encode(num: int) -> str:
+def base58_encode(num: int, length: int = 0) -> str:
     """
     Encode a base10 integer into base58.
 
     Args:
         num (int): The number in base10 format.
+        length (int, optional): Minimum length of the result, padded with the zero digit.
 
     Returns:
         str: The number in base58 format.
     """
-    encoded = ''
+    digits = []
     # Use a while loop to repeatedly divide the number by 58
     while num > 0:
         # Use the divmod function that divides the number and returns the quotient and remainder
         num, remainder = divmod(num, 58)
-        # Add the base58 character corresponding to the remainder at the beginning of the encoded string
-        encoded = BASE58_ALPHABET[remainder] + encoded
+        # Collect the base58 characters from the least significant one and reverse them once at the end
+        digits.append(BASE58_ALPHABET[remainder])
+    digits.extend(BASE58_ALPHABET[0] * (length - len(digits)))
     # Return the base58 encoded string
-    return encoded
+    return ''.join(reversed(digits))
+
+
+def base58_decode(encoded: str) -> int:
+    """
+    Decode a base58 string into a base10 integer.
+
+    Args:
+        encoded (str): The number in base58 format.
+
+    Returns:
+        int: The number in base10 format.
+
+    Raises:
+        ValueError: If the string contains a character outside of the base58 alphabet.
+    """
+    num = 0
+    for char in encoded:
+        index = BASE58_INDEX.get(char)
+        if index is None:
+            raise ValueError(f"Invalid base58 character: {char!r}")
+        num = num * 58 + index
+    return num
@@ -0,0 +1,236 @@
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Iterable
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# The endpoint serving the current request, used as a label by metrics recorded deeper in the stack
+current_endpoint: ContextVar[str] = ContextVar('current_endpoint', default='none')
+
+# A sample reported by a collector: metric name, help text, type, labels and value
+Sample = tuple[str, str, str, dict, float]
+
+
+def _format_labels(labelnames: tuple[str, ...], values: tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> None:
+        """
+        Initialize a monotonically increasing counter.
+
+        Args:
+            name (str): The metric name.
+            help_text (str): The description shown in the exposition.
+            labelnames (tuple): Names of the labels distinguishing the series.
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        """
+        Increment the series identified by the label values.
+
+        Args:
+            labels (str): The label values, in the order of `labelnames`.
+            amount (float): The increment.
+        """
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in self.values.items():
+            yield f'{self.name}{_format_labels(self.labelnames, labels)} {value}'
+
+
+class HistogramSeries:
+    __slots__ = ('histogram', 'counts', 'sum')
+
+    def __init__(self, histogram: "Histogram") -> None:
+        self.histogram = histogram
+        self.counts = [0] * (len(histogram.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """
+        Record a single observation.
+
+        Args:
+            value (float): The observed value.
+        """
+        self.counts[bisect_left(self.histogram.buckets, value)] += 1
+        self.sum += value
+
+    def time(self) -> "Timer":
+        """
+        Measure the duration of a `with` block with the registry clock.
+
+        Returns:
+            Timer: The context manager recording the duration.
+        """
+        return Timer(self, self.histogram.clock)
+
+
+class Timer:
+    __slots__ = ('series', 'clock', 'started')
+
+    def __init__(self, series: HistogramSeries, clock: Callable[[], float]) -> None:
+        self.series = series
+        self.clock = clock
+
+    def __enter__(self) -> "Timer":
+        self.started = self.clock()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.series.observe(self.clock() - self.started)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS, clock: Callable[[], float] = time.perf_counter) -> None:
+        """
+        Initialize a histogram of observations grouped into cumulative buckets.
+
+        Args:
+            name (str): The metric name.
+            help_text (str): The description shown in the exposition.
+            labelnames (tuple): Names of the labels distinguishing the series.
+            buckets (tuple): Sorted upper bounds of the buckets.
+            clock (Callable): The clock used by timers.
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.clock = clock
+        self.series: dict[tuple[str, ...], HistogramSeries] = {}
+
+    def labels(self, *labels: str) -> HistogramSeries:
+        """
+        Get the series identified by the label values.
+
+        Callers on hot paths can keep the returned series to skip the lookup.
+
+        Args:
+            labels (str): The label values, in the order of `labelnames`.
+
+        Returns:
+            HistogramSeries: The series, created on first use.
+        """
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = HistogramSeries(self)
+        return series
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series.counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, labels)} {series.sum}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}'
+
+
+class MetricsRegistry:
+    def __init__(self, clock: Callable[[], float] = time.perf_counter) -> None:
+        """
+        Initialize a registry of metrics rendered in the Prometheus text exposition format.
+
+        Args:
+            clock (Callable): The clock used by histogram timers, replaceable to plug in another timer.
+        """
+        self.clock = clock
+        self.metrics: dict[str, Counter | Histogram] = {}
+        self.collectors: list[Callable[[], Iterable[Sample]]] = []
+
+    def counter(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        """
+        Get or create a counter.
+
+        Args:
+            name (str): The metric name.
+            help_text (str): The description shown in the exposition.
+            labelnames (tuple): Names of the labels distinguishing the series.
+
+        Returns:
+            Counter: The registered counter.
+        """
+        if name not in self.metrics:
+            self.metrics[name] = Counter(name, help_text, labelnames)
+        return self.metrics[name]
+
+    def histogram(self, name: str, help_text: str, labelnames: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        """
+        Get or create a histogram.
+
+        Args:
+            name (str): The metric name.
+            help_text (str): The description shown in the exposition.
+            labelnames (tuple): Names of the labels distinguishing the series.
+            buckets (tuple): Sorted upper bounds of the buckets.
+
+        Returns:
+            Histogram: The registered histogram.
+        """
+        if name not in self.metrics:
+            self.metrics[name] = Histogram(name, help_text, labelnames, buckets, self.clock)
+        return self.metrics[name]
+
+    def register_collector(self, collector: Callable[[], Iterable[Sample]]) -> None:
+        """
+        Register a callable reporting samples computed at scrape time, e.g. from a `stats()` method.
+
+        Args:
+            collector (Callable): Returns samples of metric name, help text, type, labels and value.
+        """
+        self.collectors.append(collector)
+
+    def unregister_collector(self, collector: Callable[[], Iterable[Sample]]) -> None:
+        """
+        Stop reporting the samples of a collector, e.g. once the component it describes was closed.
+
+        Args:
+            collector (Callable): A collector passed to `register_collector` before.
+        """
+        if collector in self.collectors:
+            self.collectors.remove(collector)
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The exposition.
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+
+        described = set()
+        for collector in self.collectors:
+            for name, help_text, metric_type, labels, value in collector():
+                if name not in described:
+                    described.add(name)
+                    lines.append(f'# HELP {name} {help_text}')
+                    lines.append(f'# TYPE {name} {metric_type}')
+                lines.append(f'{name}{_format_labels(tuple(labels), tuple(labels.values()))} {value}')
+        return '\n'.join(lines) + '\n'
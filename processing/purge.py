@@ -0,0 +1,54 @@
+import asyncio
+
+import httpx
+
+
+class HTTPPurger:
+    def __init__(self, base_url: str, method: str = 'PURGE', timeout: float = 2.0) -> None:
+        """
+        Initialize a client removing the cached redirects of deleted short URLs from a CDN or caching proxy.
+
+        Redirects may be cached for up to `REDIRECT_CACHE_MAX_AGE` seconds. When a short URL is
+        deleted, a request with the `method` understood by the cache, like Varnish's or Fastly's
+        `PURGE`, is sent for the path of its redirect, so the cache drops it at once.
+
+        Args:
+            base_url (str): Address of the cache, e.g. `http://varnish:6081`.
+            method (str): HTTP method of purge requests.
+            timeout (float): Seconds a purge request may take.
+        """
+        self.base_url = base_url.rstrip('/')
+        self.method = method
+        self.timeout = timeout
+        self.client: httpx.AsyncClient | None = None
+        self.purged = 0
+        self.failed = 0
+
+    async def _purge(self, short_url: str) -> None:
+        try:
+            response = await self.client.request(self.method, f'{self.base_url}/{short_url}')
+            # A cache that held no copy answers 404, which is as good as a purge
+            if response.status_code >= 400 and response.status_code != 404:
+                raise httpx.HTTPStatusError(f'{response.status_code} {response.reason_phrase}',
+                                            request=response.request, response=response)
+            self.purged += 1
+        except httpx.HTTPError as e:
+            self.failed += 1
+            print(f'Error occurred while purging the redirect of {short_url}: ', e)
+
+    async def purge(self, short_urls: list[str]) -> None:
+        """
+        Remove the cached redirects of short URLs, logging failures rather than raising them.
+
+        Args:
+            short_urls (list[str]): The deleted short URLs.
+        """
+        if self.client is None:
+            self.client = httpx.AsyncClient(timeout=self.timeout)
+        await asyncio.gather(*(self._purge(short_url) for short_url in short_urls))
+
+    async def close(self) -> None:
+        """ Close the connections to the cache. """
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
@@ -0,0 +1,159 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from processing.metrics import Sample
+
+# Number of counters incremented concurrently in Memcache by one reconciliation
+SYNC_BATCH_SIZE = 100
+
+
+class RateLimiter:
+    def __init__(self, memcache, budgets: dict[str, tuple[float, float]], sync_interval: float = 1.0,
+                 window: float = 60.0, max_clients: int = 100000, clock: Callable[[], float] = time.time) -> None:
+        """
+        Initialize per-client request budgets enforced in memory and reconciled across workers through Memcache.
+
+        Every client, an API key or an IP address, gets a token bucket per budget, refilled with
+        `rate` tokens per second up to `burst`. Checking a request only touches the buckets of
+        this worker, so it never waits for the network. The requests admitted are counted per
+        fixed window of `window` seconds and added to a shared counter with memcached `incr`
+        every `sync_interval` seconds. A client whose requests, summed over all workers,
+        reach `rate * window + burst` within a window is rejected by this worker until the
+        window ends, so spreading requests over many workers only gains `sync_interval`
+        seconds of requests. When Memcache is unreachable the buckets keep limiting every
+        worker on its own.
+
+        Args:
+            memcache (AsyncMemcache): Memcache instance holding the shared counters.
+            budgets (dict): Rate in requests per second and burst of each budget, a rate of 0 disables it.
+            sync_interval (float): Seconds between two reconciliations with Memcache.
+            window (float): Seconds of the windows counted in Memcache.
+            max_clients (int): Maximum number of clients with a bucket, the least recently seen are dropped.
+            clock (Callable): Returns the current unix time, injectable for tests.
+        """
+        self.memcache = memcache
+        self.budgets = {budget: (rate, burst) for budget, (rate, burst) in budgets.items() if rate > 0}
+        self.sync_interval = sync_interval
+        self.window = window
+        self.max_clients = max_clients
+        self.clock = clock
+        # Tokens left and time of the last refill, per budget and client
+        self.buckets: OrderedDict[tuple[str, str], list[float]] = OrderedDict()
+        # Requests admitted since the last reconciliation, per budget, client and window
+        self.pending: dict[tuple[str, str, int], int] = {}
+        # End of the window until which a client over its shared budget is rejected
+        self.blocked: dict[tuple[str, str], float] = {}
+        self.allowed = dict.fromkeys(self.budgets, 0)
+        self.rejected = dict.fromkeys(self.budgets, 0)
+        self.task: asyncio.Task | None = None
+
+    def check(self, budget: str, client: str, cost: int = 1) -> float | None:
+        """
+        Take `cost` requests from the budget of a client, without any I/O.
+
+        A cost above the burst of the budget is charged as the burst, so a large batch can still go through.
+
+        Args:
+            budget (str): The budget of the request, e.g. `shorten` or `redirect`.
+            client (str): The identity of the client.
+            cost (int): Number of requests to take.
+
+        Returns:
+            float: Seconds after which the client may retry if the request is rejected, else None.
+        """
+        limit = self.budgets.get(budget)
+        if limit is None:
+            return None
+        rate, burst = limit
+        cost = min(cost, burst)
+        now = self.clock()
+        key = (budget, client)
+
+        blocked_until = self.blocked.get(key)
+        if blocked_until is not None:
+            if blocked_until > now:
+                self.rejected[budget] += 1
+                return blocked_until - now
+            del self.blocked[key]
+
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [burst, now]
+            if len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] < cost:
+            self.rejected[budget] += 1
+            return (cost - bucket[0]) / rate
+
+        bucket[0] -= cost
+        self.allowed[budget] += 1
+        pending_key = (budget, client, int(now // self.window))
+        self.pending[pending_key] = self.pending.get(pending_key, 0) + cost
+        return None
+
+    async def _sync(self, budget: str, client: str, window: int, count: int) -> None:
+        total = await self.memcache.incr_cache(f'rate_limit:{budget}:{client}:{window}', count, 2 * self.window)
+        rate, burst = self.budgets[budget]
+        if total is not None and total >= rate * self.window + burst:
+            key = (budget, client)
+            self.blocked[key] = max(self.blocked.get(key, 0.0), (window + 1) * self.window)
+
+    async def sync(self) -> None:
+        """ Add the requests admitted since the last call to the shared counters and block clients over budget. """
+        pending, self.pending = list(self.pending.items()), {}
+        now = self.clock()
+        self.blocked = {key: blocked_until for key, blocked_until in self.blocked.items() if blocked_until > now}
+        for start in range(0, len(pending), SYNC_BATCH_SIZE):
+            await asyncio.gather(*(self._sync(budget, client, window, count)
+                                   for (budget, client, window), count in pending[start:start + SYNC_BATCH_SIZE]))
+
+    async def run(self) -> None:
+        """ Reconcile the counters periodically until cancelled. """
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                print('Error occurred while reconciling the rate limits: ', e)
+
+    def start(self) -> None:
+        """ Reconcile the counters in the background. """
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """ Stop reconciling the counters. """
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def collect(self) -> list[Sample]:
+        """
+        Report the rate limits as metric samples.
+
+        Returns:
+            list: Samples for the registry exposition.
+        """
+        help_text = 'Requests checked against the rate limits, by budget and outcome.'
+        samples: list[Sample] = []
+        for budget in self.budgets:
+            samples.append(('url_shortener_rate_limit_requests_total', help_text, 'counter',
+                            {'budget': budget, 'outcome': 'allowed'}, self.allowed[budget]))
+            samples.append(('url_shortener_rate_limit_requests_total', help_text, 'counter',
+                            {'budget': budget, 'outcome': 'rejected'}, self.rejected[budget]))
+        samples.append(('url_shortener_rate_limit_clients', 'Clients with a rate limit bucket.', 'gauge', {},
+                        len(self.buckets)))
+        samples.append(('url_shortener_rate_limit_blocked_clients',
+                        'Clients rejected until the end of the window for exceeding their shared budget.', 'gauge',
+                        {}, len(self.blocked)))
+        return samples
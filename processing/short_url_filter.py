@@ -0,0 +1,230 @@
+import asyncio
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable
+
+from db.storage import StorageBackend
+from processing.allocator import SHORT_URL_SEQUENCE, KeyAllocator
+from processing.bloom import BloomFilter
+from processing.metrics import Sample
+
+# Seconds added to the maximum block age before a counter reading bounds the codes that can still be
+# issued, covering the time between allocating a short URL and inserting it
+INSERT_MARGIN = 60.0
+
+# Counter holding the unix time until which an import may write short URLs, which filters do not know
+IMPORT_LEASE = 'short_url_import_lease'
+# Seconds an import holds its lease for, renewed once half of it has passed, so its last write ends
+# well before the lease, whatever the clock skew between hosts up to that margin
+IMPORT_LEASE_SECONDS = 60.0
+# Default seconds between two readings of the counters by a filter, a reading three times as old
+# no longer rejects anything, so imports wait that long after taking their lease
+COUNTER_INTERVAL = 10.0
+IMPORT_DELAY = 3 * COUNTER_INTERVAL
+
+
+async def take_import_lease(storage: StorageBackend, seconds: float = IMPORT_LEASE_SECONDS) -> None:
+    """
+    Tell the short URL filters of every worker that short URLs are imported for the next seconds.
+
+    Args:
+        storage (StorageBackend): The storage holding the counters.
+        seconds (float): Seconds from now until which the import may write short URLs.
+    """
+    until = int(time.time() + seconds) + 1
+    current = await storage.reserve_sequence_block(IMPORT_LEASE, 0)
+    if until > current:
+        await storage.reserve_sequence_block(IMPORT_LEASE, until - current)
+
+
+class ShortURLFilter:
+    def __init__(self, mongodb: StorageBackend, allocator: KeyAllocator, capacity: int = 1000000,
+                 error_rate: float = 0.01, rebuild_interval: float = 600.0,
+                 counter_interval: float = COUNTER_INTERVAL,
+                 sequence_headroom: int = 1000000, batch_size: int = 1000,
+                 clock: Callable[[], float] = time.time) -> None:
+        """
+        Initialize a per-worker filter telling short URLs that were never issued without any I/O.
+
+        A Bloom filter holds the unexpired short URLs streamed from the storage when it is built
+        and every `rebuild_interval` seconds after, which ages out deleted and expired ones, plus
+        the ones this worker issues. A short URL missing from it was still issued if another
+        worker allocated it after the build, so it is only rejected if the allocator could not
+        have handed it out since:
+
+        - it is not a code of the allocator at all, such as a path probed by a bot, or
+        - its sequence number is `sequence_headroom` or more beyond the counter, which is read
+          every `counter_interval` seconds, like almost every randomly guessed code, or
+        - its sequence number is below the counter value read `max_block_age` of the allocator
+          before the build started, as every block in use was leased after that.
+
+        Short URLs written by an import are neither issued by an allocator nor in the Bloom filter,
+        so nothing is rejected while the import lease read with the counter reaches past the start
+        of the build, and the filter is rebuilt once the lease has ended.
+
+        Args:
+            mongodb (StorageBackend): MongoDB instance, or another storage backend.
+            allocator (KeyAllocator): The allocator issuing short URLs, with a `max_block_age`.
+            capacity (int): Minimum number of short URLs the Bloom filter is sized for.
+            error_rate (float): False positive rate of the Bloom filter at its capacity.
+            rebuild_interval (float): Seconds between two builds of the Bloom filter.
+            counter_interval (float): Seconds between two readings of the sequence counter.
+            sequence_headroom (int): Sequence numbers that may be leased between two counter readings.
+            batch_size (int): Number of short URLs read per round trip when building.
+            clock (Callable): Returns the current unix time, injectable for tests.
+        """
+        self.mongodb = mongodb
+        self.allocator = allocator
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.rebuild_interval = rebuild_interval
+        self.counter_interval = counter_interval
+        self.sequence_headroom = sequence_headroom
+        self.batch_size = batch_size
+        self.clock = clock
+        self.bloom: BloomFilter | None = None
+        # Short URLs issued by this worker while the next Bloom filter is built
+        self.recent: set[str] = set()
+        self.building = False
+        # Times and values of the sequence counter
+        self.readings: deque[tuple[float, int]] = deque()
+        self.lower_bound = 0
+        # End of the last import lease read, and start of the build of the Bloom filter
+        self.import_until = 0
+        self.built_at = 0.0
+        self.rejected = 0
+        self.builds = 0
+        self.build_seconds = 0.0
+        self.task: asyncio.Task | None = None
+
+    def add(self, short_url: str) -> None:
+        """
+        Record a short URL issued by this worker.
+
+        Args:
+            short_url (str): The new short URL.
+        """
+        if self.bloom is not None:
+            self.bloom.add(short_url)
+        if self.building or self.bloom is None:
+            self.recent.add(short_url)
+
+    def may_exist(self, short_url: str) -> bool:
+        """
+        Tell whether a short URL may have been issued.
+
+        Args:
+            short_url (str): The short URL.
+
+        Returns:
+            bool: False if the short URL certainly does not exist, True if it has to be looked up.
+        """
+        if short_url in self.recent or (self.bloom is not None and short_url in self.bloom):
+            return True
+        if not self.readings:
+            return True
+        read_at, value = self.readings[-1]
+        # A counter that could not be read for a while no longer bounds the codes issued since, and an
+        # import may have written any short URL since its lease started
+        if self.clock() - read_at > 3 * self.counter_interval or self.import_until > self.built_at:
+            return True
+        sequence = self.allocator.decode(short_url)
+        if sequence is not None and sequence >= value + self.sequence_headroom:
+            self.rejected += 1
+            return False
+        if self.bloom is not None and (sequence is None or sequence < self.lower_bound):
+            self.rejected += 1
+            return False
+        return True
+
+    async def read_counter(self) -> None:
+        """ Read the sequence counter and the import lease, forgetting readings too old to bound a future build. """
+        read_at = self.clock()
+        value = await self.mongodb.reserve_sequence_block(SHORT_URL_SEQUENCE, 0)
+        self.import_until = await self.mongodb.reserve_sequence_block(IMPORT_LEASE, 0)
+        self.readings.append((read_at, value))
+        horizon = read_at - (self.allocator.max_block_age or 0) - INSERT_MARGIN - 2 * self.rebuild_interval
+        while len(self.readings) > 1 and self.readings[1][0] <= horizon:
+            self.readings.popleft()
+
+    async def rebuild(self) -> None:
+        """
+        Build a new Bloom filter from the unexpired short URLs in the storage, then swap it in.
+        """
+        started, timer = self.clock(), time.perf_counter()
+        await self.read_counter()
+        previous = self.bloom.count if self.bloom is not None else 0
+        bloom = BloomFilter(max(self.capacity, previous + previous // 4), self.error_rate)
+        self.building = True
+        try:
+            now = datetime.now(timezone.utc)
+            async for url_data in self.mongodb.scan_short_urls(batch_size=self.batch_size):
+                if url_data['expiration_date'] > now:
+                    bloom.add(url_data['short_url'])
+        finally:
+            self.building = False
+        for short_url in self.recent:
+            bloom.add(short_url)
+        self.bloom, self.recent, self.built_at = bloom, set(), started
+
+        if self.allocator.max_block_age is not None:
+            # Every block issuing codes now was leased after this reading
+            bound = started - self.allocator.max_block_age - INSERT_MARGIN
+            self.lower_bound = max((value for read_at, value in self.readings if read_at <= bound), default=0)
+        self.builds += 1
+        self.build_seconds = time.perf_counter() - timer
+        print(f"Built the short URL filter with {bloom.count} short URLs in {self.build_seconds:.1f}s")
+
+    async def run(self) -> None:
+        """ Build the filter, then read the counter and rebuild the filter periodically until cancelled. """
+        next_build = 0.0
+        while True:
+            try:
+                # Short URLs imported since the build started are only known to a build after the lease
+                imported = self.import_until > self.built_at and self.clock() > self.import_until
+                if self.clock() >= next_build or imported:
+                    await self.rebuild()
+                    next_build = self.clock() + self.rebuild_interval
+                else:
+                    await self.read_counter()
+            except Exception as e:
+                print('Error occurred while updating the short URL filter: ', e)
+            await asyncio.sleep(self.counter_interval)
+
+    def start(self) -> None:
+        """ Build and update the filter in the background. """
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """ Stop updating the filter. """
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def collect(self) -> list[Sample]:
+        """
+        Report the filter as metric samples.
+
+        Returns:
+            list: Samples for the registry exposition.
+        """
+        bloom = self.bloom
+        return [
+            ('url_shortener_short_url_filter_rejections_total',
+             'Lookups of short URLs that were never issued answered without Memcache or MongoDB.', 'counter', {},
+             self.rejected),
+            ('url_shortener_short_url_filter_keys', 'Short URLs in the filter.', 'gauge', {},
+             bloom.count if bloom else 0),
+            ('url_shortener_short_url_filter_bytes', 'Memory of the filter.', 'gauge', {},
+             bloom.memory if bloom else 0),
+            ('url_shortener_short_url_filter_error_rate', 'Expected false positive rate of the filter.', 'gauge', {},
+             bloom.error_rate if bloom else 0),
+            ('url_shortener_short_url_filter_build_seconds', 'Duration of the last build of the filter.', 'gauge', {},
+             self.build_seconds),
+        ]
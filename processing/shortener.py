@@ -1,24 +1,254 @@
-from datetime import datetime, timedelta
-from typing import Union
+import asyncio
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Union
 
-from db.memcache import Memcache
-from db.mongodb import MongoDB
-from processing.encoder import generate_encoded_string
+from db.local_cache import LocalCache
+from db.memcache import AsyncMemcache
+from db.mongodb import check_expiration
+from db.storage import StorageBackend
+from processing.allocator import KeyAllocator
+from processing.cache_values import (NEGATIVE_CACHE_PREFIX, STALE_KEY_PREFIX, TOMBSTONE, memcache_entries,
+                                     unpack_cache_value)
+from processing.canonical_url import canonicalize_url
+from processing.circuit_breaker import CircuitBreaker, CircuitOpenError
+from processing.metrics import MetricsRegistry, Sample, Timer, current_endpoint
+from processing.short_url_filter import ShortURLFilter
+from processing.singleflight import SingleFlight
+from processing.write_behind import ExpiryWriteBehind
+
+# Short URLs served stale that are remembered for revalidation once MongoDB recovers
+MAX_PENDING_REVALIDATIONS = 10000
+
+# Number of short URLs revalidated per MongoDB query
+REVALIDATION_BATCH_SIZE = 100
+
+# Codes allocated for a new short URL at most, when the ones before were taken by an import running meanwhile
+ALLOCATION_ATTEMPTS = 3
+
+
+class OriginalURL(str):
+    """ An original URL that knows the unix time its short URL expires at, None if unknown. """
+
+    expires_at: float | None = None
+
+    def __new__(cls, url: str, expires_at: float | None = None) -> 'OriginalURL':
+        original_url = super().__new__(cls, url)
+        original_url.expires_at = expires_at
+        return original_url
+
+
+class StaleOriginalURL(OriginalURL):
+    """ An original URL served from the stale copy because MongoDB could not be reached. """
 
 
 class URLShortener:
-    def __init__(self, mongodb: MongoDB, memcache: Memcache) -> None:
+    def __init__(self, mongodb: StorageBackend, memcache: AsyncMemcache, local_cache: LocalCache | None = None,
+                 allocator: KeyAllocator | None = None, negative_cache_ttl: float = 30,
+                 write_behind: ExpiryWriteBehind | None = None, metrics: MetricsRegistry | None = None,
+                 breaker: CircuitBreaker | None = None, cache_ttl: float = 0, stale_ttl: float = 0,
+                 code_filter: ShortURLFilter | None = None,
+                 purge: Callable[[list[str]], Awaitable[None]] | None = None) -> None:
         """
         Initialize URLShortener with MongoDB and Memcache instances.
 
+        The storage clients are asyncio based and every method of the shortener is a coroutine,
+        so a slow database round trip never blocks the event loop serving other requests.
+
         Args:
-            mongodb (MongoDB): MongoDB instance.
-            memcache (Memcache): Memcache instance.
+            mongodb (StorageBackend): MongoDB instance, or another storage backend.
+            memcache (AsyncMemcache): Memcache instance.
+            local_cache (LocalCache, optional): Per-worker cache consulted before Memcache on lookups.
+            allocator (KeyAllocator, optional): Source of new short URLs, by default leasing from `mongodb`.
+            negative_cache_ttl (float, optional): Seconds a short URL that does not exist or has expired is
+                remembered as such, 0 disables negative caching.
+            write_behind (ExpiryWriteBehind, optional): Buffer for expiry extensions of re-shortened URLs,
+                which are otherwise written to MongoDB right away.
+            metrics (MetricsRegistry, optional): Registry receiving stage latencies and lookup outcomes.
+            breaker (CircuitBreaker, optional): Circuit breaker guarding the MongoDB lookups of redirects,
+                which fail fast with CircuitOpenError while MongoDB is unhealthy.
+            cache_ttl (float, optional): Seconds a mapping is served from Memcache before it is read from
+                MongoDB again, 0 to keep it until the short URL expires.
+            stale_ttl (float, optional): Seconds a stale copy of a mapping is kept in Memcache, to be served
+                while MongoDB is unreachable. 0 disables stale serving.
+            code_filter (ShortURLFilter, optional): Filter of issued short URLs, rejecting lookups of
+                short URLs that were never issued before they reach Memcache or MongoDB.
+            purge (Callable, optional): Coroutine function removing the redirects of deleted short
+                URLs from a CDN or caching proxy.
         """
         self.mongodb = mongodb
         self.memcache = memcache
+        self.local_cache = local_cache
+        self.allocator = allocator or KeyAllocator(mongodb)
+        self.negative_cache_ttl = negative_cache_ttl
+        self.write_behind = write_behind
+        self.breaker = breaker
+        # Errors falling back to the stale copies rather than failing a lookup
+        self.unavailable_errors = (CircuitOpenError, *mongodb.unavailable_errors)
+        self.cache_ttl = cache_ttl
+        self.stale_ttl = stale_ttl
+        self.code_filter = code_filter
+        self.purge = purge
+        self.stale_served: set[str] = set()
+        self.revalidation: asyncio.Task | None = None
+        # Concurrent cache misses for the same short URL share a single lookup
+        self.lookups = SingleFlight()
+        self.counters = Counter()
+
+        self.metrics = metrics or MetricsRegistry()
+        self.stage_seconds = self.metrics.histogram(
+            'url_shortener_stage_seconds', 'Duration of the storage and code generation stages of the shortener.',
+            ('operation', 'stage'))
+        self.lookup_results = self.metrics.counter(
+            'url_shortener_lookup_results_total', 'Outcome of short URL lookups by the endpoint serving them.',
+            ('endpoint', 'result'))
+        self.metrics.register_collector(self.collect)
+
+    def stats(self) -> dict:
+        """
+        Report the lookup counters.
+
+        Returns:
+            dict: Negative cache hits and stores, the number of lookups that joined one in flight, and the
+                number of lookups answered with a stale mapping while MongoDB was unavailable.
+        """
+        return {
+            'negative_cache_hits': self.counters['negative_cache_hits'],
+            'negative_cache_stores': self.counters['negative_cache_stores'],
+            'coalesced_lookups': self.lookups.coalesced,
+            'stale_responses': self.counters['stale_responses'],
+        }
 
-    def generate_short_url(self, original_url: str, expiration_days_in_hrs: int = 72) -> str:
+    def collect(self) -> list[Sample]:
+        """
+        Report the counters of the shortener and its caches as metric samples.
+
+        Returns:
+            list: Samples for the registry exposition.
+        """
+        samples = [(f'url_shortener_{name}_total', f'Number of {name.replace("_", " ")}.', 'counter', {}, value)
+                   for name, value in self.stats().items()]
+        if self.local_cache:
+            for name, value in self.local_cache.stats().items():
+                metric_type = 'counter' if name in ('hits', 'misses', 'evictions') else 'gauge'
+                samples.append((f'url_shortener_local_cache_{name}' + ('_total' if metric_type == 'counter' else ''),
+                                f'Per-worker cache {name.replace("_", " ")}.', metric_type, {}, value))
+        if self.write_behind:
+            samples.append(('url_shortener_expiry_extensions_pending', 'Buffered expiry extensions.', 'gauge', {},
+                            len(self.write_behind.pending)))
+            samples.append(('url_shortener_expiry_extensions_flushed_total', 'Expiry extensions written.',
+                            'counter', {}, self.write_behind.flushed))
+            samples.append(('url_shortener_expiry_extensions_skipped_total',
+                            'Expiry extensions dropped as immaterial.', 'counter', {}, self.write_behind.skipped))
+        return samples
+
+    def _stage(self, operation: str, stage: str) -> Timer:
+        return self.stage_seconds.labels(operation, stage).time()
+
+    def _count(self, result: str, amount: int = 1) -> None:
+        self.lookup_results.inc(current_endpoint.get(), result, amount=amount)
+
+    @staticmethod
+    def _error_result(error: ValueError) -> str:
+        return 'expired' if 'expired' in str(error) else 'not_found'
+
+    async def _guarded(self, func, *args):
+        """ Call MongoDB through the circuit breaker, if there is one. """
+        if self.breaker:
+            return await self.breaker.call(func, *args)
+        return await func(*args)
+
+    def _memcache_entries(self, short_url: str, original_url: str, expires_at: float) -> list[tuple[str, str, float]]:
+        return memcache_entries(short_url, original_url, expires_at, self.cache_ttl, self.stale_ttl)
+
+    async def _stale_original_urls(self, short_urls: list[str]) -> dict[str, Union[StaleOriginalURL, ValueError]]:
+        """
+        Read the stale copies of mappings while MongoDB is unreachable.
+
+        Args:
+            short_urls (list[str]): Short URLs.
+
+        Returns:
+            dict: For the short URLs with a usable stale copy their original URL, and a ValueError
+                for those that were deleted.
+        """
+        if self.stale_ttl <= 0 or not short_urls:
+            return {}
+        try:
+            values = await self.memcache.get_cache_multi([STALE_KEY_PREFIX + short_url for short_url in short_urls])
+        except Exception as e:
+            print('Error occurred while getting stale original URLs: ', e)
+            return {}
+        now = time.time()
+        stale = {}
+        for short_url in short_urls:
+            value = values.get(STALE_KEY_PREFIX + short_url)
+            if value and value.startswith(NEGATIVE_CACHE_PREFIX):
+                stale[short_url] = ValueError(value[len(NEGATIVE_CACHE_PREFIX):])
+                continue
+            original_url, expires_at = unpack_cache_value(value)
+            if original_url and expires_at is not None and expires_at > now:
+                stale[short_url] = StaleOriginalURL(original_url)
+        return stale
+
+    def _serve_stale(self, short_url: str, stale_url: Union[StaleOriginalURL, ValueError]) -> None:
+        """ Account for a lookup answered from the stale copy, remembering to revalidate it. """
+        if isinstance(stale_url, ValueError):
+            self._count('deleted')
+            return
+        self._count('stale')
+        self.counters['stale_responses'] += 1
+        if len(self.stale_served) < MAX_PENDING_REVALIDATIONS:
+            self.stale_served.add(short_url)
+
+    def _schedule_revalidation(self) -> None:
+        """ Refresh the short URLs served stale in the background, once MongoDB answers again. """
+        if self.stale_served and (self.revalidation is None or self.revalidation.done()):
+            self.revalidation = asyncio.ensure_future(self._revalidate())
+
+    async def _revalidate(self) -> None:
+        current_endpoint.set('revalidation')
+        short_urls = list(self.stale_served)
+        self.stale_served.clear()
+        for start in range(0, len(short_urls), REVALIDATION_BATCH_SIZE):
+            try:
+                # Resolving them caches the current mapping, or remembers that it is gone
+                await self.get_original_urls(short_urls[start:start + REVALIDATION_BATCH_SIZE])
+            except Exception as e:
+                print('Error occurred while revalidating short URLs: ', e)
+                self.stale_served.update(short_urls[start:])
+                return
+
+    def _remember(self, short_url: str, original_url: str | ValueError, expires_at: float | None) -> None:
+        if self.local_cache:
+            if type(original_url) is str:
+                # Local hits then tell the redirect how long it may be cached
+                original_url = OriginalURL(original_url, expires_at)
+            self.local_cache.set(short_url, original_url, expires_at)
+
+    def _forget(self, short_url: str) -> None:
+        if self.local_cache:
+            self.local_cache.invalidate(short_url)
+
+    def _cached_error(self, short_url: str, value: str | None) -> ValueError | None:
+        """ Turn a negative Memcache entry into the error it stands for. """
+        if not value or not value.startswith(NEGATIVE_CACHE_PREFIX):
+            return None
+        self.counters['negative_cache_hits'] += 1
+        error = ValueError(value[len(NEGATIVE_CACHE_PREFIX):])
+        self._remember(short_url, error, time.time() + self.negative_cache_ttl)
+        return error
+
+    def _negative_cache_item(self, short_url: str, error: ValueError) -> tuple[str, str, float] | None:
+        """ Remember locally that a short URL is missing and describe the matching Memcache entry. """
+        if self.negative_cache_ttl <= 0:
+            return None
+        self.counters['negative_cache_stores'] += 1
+        self._remember(short_url, error, time.time() + self.negative_cache_ttl)
+        return short_url, NEGATIVE_CACHE_PREFIX + str(error), self.negative_cache_ttl
+
+    async def generate_short_url(self, original_url: str, expiration_days_in_hrs: int = 72) -> str:
         """
         Generate a short URL and return it.
 
@@ -32,26 +262,46 @@ class URLShortener:
         Returns:
             str: A short URL string.
         """
-        expiration_date = datetime.now() + timedelta(
+        expiration_date = datetime.now(timezone.utc) + timedelta(
             hours=expiration_days_in_hrs)  # Set the expiration date
 
-        expiration_in_secs = expiration_days_in_hrs * 60 * 60  # Convert hours to seconds
-
-        existing_url_data = self.mongodb.lookup_by_original_url(original_url)
+        with self._stage('generate_short_url', 'mongo_find'):
+            existing_url_data = await self.mongodb.lookup_by_original_url(original_url)
         if existing_url_data:
-            self.mongodb.update_expiration_date(existing_url_data['short_url'], expiration_date)
+            if self.write_behind and not self.write_behind.is_urgent(existing_url_data['expiration_date']):
+                # The existing mapping may store another spelling of the URL
+                self.write_behind.extend(existing_url_data['short_url'], existing_url_data['original_url'],
+                                         existing_url_data['expiration_date'], expiration_date)
+            else:
+                with self._stage('generate_short_url', 'mongo_update'):
+                    await self.mongodb.update_expiration_date(existing_url_data['short_url'], expiration_date)
             # Return existing short URL if found
             return existing_url_data['short_url']
 
-        short_url = generate_encoded_string()  # Generate a new short URL
+        for attempt in range(ALLOCATION_ATTEMPTS):
+            with self._stage('generate_short_url', 'generate_code'):
+                short_url = await self.allocator.allocate()  # Allocate a new short URL
+            if self.code_filter:
+                self.code_filter.add(short_url)
 
-        # Insert new short URL into MongoDB and Memcache
-        self.mongodb.insert_short_url(short_url, original_url, expiration_date)
-        self.memcache.set_cache(short_url, original_url, expiration_in_secs)
+            # Insert new short URL into MongoDB and Memcache
+            try:
+                with self._stage('generate_short_url', 'mongo_insert'):
+                    await self.mongodb.insert_short_url(short_url, original_url, expiration_date)
+                break
+            except self.mongodb.duplicate_errors:
+                # An import wrote the code after it was leased, before the counter moved past it
+                if attempt == ALLOCATION_ATTEMPTS - 1:
+                    raise
+        with self._stage('generate_short_url', 'memcache_set'):
+            await self.memcache.set_cache_multi(
+                self._memcache_entries(short_url, original_url, expiration_date.timestamp()))
+        # The short URL may have been probed before it was issued
+        self._forget(short_url)
 
         return short_url
 
-    def delete_short_url(self, short_url: str) -> Union[str, Exception]:
+    async def delete_short_url(self, short_url: str) -> Union[str, Exception]:
         """
         Delete a short URL from the database.
 
@@ -64,43 +314,333 @@ class URLShortener:
         """
         try:
             # Check if the short URL is in MongoDB
-            _ = self.mongodb.lookup_by_short_url(short_url)
+            with self._stage('delete_short_url', 'mongo_find'):
+                _ = await self.mongodb.lookup_by_short_url(short_url)
+            # A buffered extension must not bring the deleted short URL back into Memcache
+            if self.write_behind:
+                self.write_behind.discard([short_url])
             # Delete the short URL from MongoDB and Memcache
-            self.mongodb.delete_short_url(short_url)
-            self.memcache.delete_cache(short_url)
+            with self._stage('delete_short_url', 'mongo_delete'):
+                await self.mongodb.delete_short_url(short_url)
+            with self._stage('delete_short_url', 'memcache_delete'):
+                await self.memcache.delete_cache(short_url)
+                if self.stale_ttl > 0:
+                    # Outlives every stale copy on every server, so a deleted link is never served while
+                    # MongoDB is down, whichever server a read fails over to
+                    await self.memcache.set_cache(STALE_KEY_PREFIX + short_url, TOMBSTONE, self.stale_ttl,
+                                                  all_nodes=True)
+            self._forget(short_url)
         except Exception as e:
             print('Error occurred while deleting a short URL: ', e)
             raise
+        if self.purge:
+            try:
+                await self.purge([short_url])
+            except Exception as e:
+                # The cached redirect expires on its own, within the maximum age of redirects
+                print('Error occurred while purging a short URL: ', e)
 
         return "Short URL deleted successfully"
 
-    def get_original_url(self, short_url: str) -> Union[str, Exception]:
+    async def refresh_short_urls(self, url_docs: list[dict]) -> None:
+        """
+        Bring the caches and the filter of this worker in line with documents written around the shortener.
+
+        Imports replace mappings directly in the storage. Unexpired mappings replace their Memcache
+        entries and stale copies, expired ones are removed from Memcache and their stale copies
+        replaced by tombstones. Every short URL is dropped from the local cache and added to the
+        short URL filter. The local caches of other workers keep serving a replaced mapping for
+        up to their maximum staleness.
+
+        Args:
+            url_docs (list[dict]): The documents written, with `short_url`, `original_url` and `expiration_date`.
+        """
+        now = time.time()
+        items, expired = [], []
+        for url_doc in url_docs:
+            short_url = url_doc['short_url']
+            if self.code_filter:
+                self.code_filter.add(short_url)
+            self._forget(short_url)
+            expires_at = url_doc['expiration_date'].timestamp()
+            if expires_at > now:
+                items.extend(self._memcache_entries(short_url, url_doc['original_url'], expires_at))
+            else:
+                expired.append(short_url)
+                if self.stale_ttl > 0:
+                    items.append((STALE_KEY_PREFIX + short_url, TOMBSTONE, self.stale_ttl))
+        if items:
+            await self.memcache.set_cache_multi(items)
+        await asyncio.gather(*(self.memcache.delete_cache(short_url) for short_url in expired))
+
+    async def get_original_url(self, short_url: str) -> Union[str, Exception]:
         """
         Retrieve the original URL from a short URL.
 
-        It first attempts to fetch the original URL from Memcache. If not found,
-        it looks up MongoDB. If the short URL exists and has not expired,
+        It first attempts to fetch the original URL from the in-process cache and then
+        from Memcache. If not found, it looks up MongoDB. If the short URL exists and has not expired,
         the original URL is cached in Memcache and returned.
 
+        If MongoDB cannot be reached, or the circuit breaker considers it unhealthy, the stale copy
+        kept in Memcache is returned as a StaleOriginalURL instead. Without a stale copy the error
+        is raised, CircuitOpenError when the breaker rejected the lookup.
+
+        Args:
+            short_url (str): Short URL.
+        Returns:
+            str: Original URL string.
+        """
+        # Try the in-process cache first, it remembers missing short URLs as well
+        original_url = self.local_cache.get(short_url) if self.local_cache else None
+        if isinstance(original_url, ValueError):
+            self.counters['negative_cache_hits'] += 1
+            self._count('negative_hit')
+            raise original_url
+        if original_url:
+            self._count('local_hit')
+            return original_url
+        if self.code_filter and not self.code_filter.may_exist(short_url):
+            self._count('filtered')
+            raise ValueError("Short URL not found")
+
+        return await self.lookups.do(short_url, lambda: self._load_original_url(short_url))
+
+    async def _load_original_url(self, short_url: str) -> str:
+        """
+        Resolve a short URL that missed the in-process cache from Memcache, then MongoDB.
+
         Args:
             short_url (str): Short URL.
         Returns:
             str: Original URL string.
         """
-        # Try to get the original URL from Memcache
-        original_url = self.memcache.get_cache(short_url)
-        if not original_url:
+        with self._stage('get_original_url', 'memcache_get'):
+            value = await self.memcache.get_cache(short_url)
+        error = self._cached_error(short_url, value)
+        if error:
+            self._count('negative_hit')
+            raise error
+
+        original_url, expires_at = unpack_cache_value(value)
+        if not original_url or (expires_at is not None and expires_at <= time.time()):
             # If not in Memcache, try to get it from MongoDB
             try:
-                url_data = self.mongodb.lookup_by_short_url(short_url)
+                with self._stage('get_original_url', 'mongo_find'):
+                    url_data = await self._guarded(self.mongodb.lookup_by_short_url, short_url)
+            except ValueError as ve:
+                self._count(self._error_result(ve))
+                # Remember that the short URL is missing, so repeated requests don't reach MongoDB
+                negative_item = self._negative_cache_item(short_url, ve)
+                if negative_item:
+                    with self._stage('get_original_url', 'memcache_set'):
+                        await self.memcache.set_cache(*negative_item)
+                raise
+            except self.unavailable_errors as e:
+                if not isinstance(e, CircuitOpenError):
+                    print('Error occurred while getting an original URL: ', e)
+                stale_url = (await self._stale_original_urls([short_url])).get(short_url)
+                if stale_url is None:
+                    self._count('unavailable')
+                    raise
+                self._serve_stale(short_url, stale_url)
+                if isinstance(stale_url, ValueError):
+                    raise stale_url
+                return stale_url
             except Exception as e:
+                self._count('backend_error')
                 print('Error occurred while getting an original URL: ', e)
                 raise
 
             # Get the original URL and cache it in Memcache
+            self._count('cache_miss')
             original_url = url_data["original_url"]
-            self.memcache.set_cache(short_url, original_url,
-                                    expiration_time=(url_data["expiration_date"] - datetime.now()).
-                                    total_seconds())
+            expires_at = url_data["expiration_date"].timestamp()
+            with self._stage('get_original_url', 'memcache_set'):
+                await self.memcache.set_cache_multi(self._memcache_entries(short_url, original_url, expires_at))
+            self._schedule_revalidation()
+        else:
+            self._count('cache_hit')
 
+        original_url = OriginalURL(original_url, expires_at)
+        self._remember(short_url, original_url, expires_at)
         return original_url
+
+    async def generate_short_urls(self, original_urls: list[str],
+                                  expiration_days_in_hrs: int = 72) -> list[Union[str, ValueError]]:
+        """
+        Generate short URLs for a batch of original URLs.
+
+        Works like `generate_short_url` for every original URL, so an original URL that already
+        has a short URL gets its expiry extended, but uses a single query to find existing short
+        URLs, a single update to extend them, a single `insert_many` for the new ones and one
+        Memcache round trip. An original URL appearing several times, in any spelling with the
+        same canonical form, gets the same short URL.
+
+        Args:
+            original_urls (list[str]): Original URLs to shorten.
+            expiration_days_in_hrs (int, optional): Number of hours until the short URLs expire.
+
+        Returns:
+            list: For each original URL, its short URL or a ValueError describing why it failed.
+        """
+        expiration_date = datetime.now(timezone.utc) + timedelta(hours=expiration_days_in_hrs)
+        # The first spelling of every canonical URL stands in for the others
+        spellings = {original_url: canonicalize_url(original_url) for original_url in original_urls}
+        first_spellings = {}
+        for original_url, canonical_url in spellings.items():
+            first_spellings.setdefault(canonical_url, original_url)
+        unique_urls = list(first_spellings.values())
+
+        with self._stage('generate_short_urls', 'mongo_find'):
+            existing = await self.mongodb.lookup_by_original_urls(unique_urls)
+        if self.write_behind:
+            # Short URLs expiring before the next flush are extended right away
+            write_through = []
+            for original_url, url_data in existing.items():
+                if self.write_behind.is_urgent(url_data['expiration_date']):
+                    write_through.append(url_data['short_url'])
+                else:
+                    self.write_behind.extend(url_data['short_url'], url_data['original_url'],
+                                             url_data['expiration_date'], expiration_date)
+        else:
+            write_through = [url_data['short_url'] for url_data in existing.values()]
+        if write_through:
+            with self._stage('generate_short_urls', 'mongo_update'):
+                await self.mongodb.update_expiration_dates(write_through, expiration_date)
+        short_urls: dict[str, Union[str, ValueError]] = {
+            original_url: url_data['short_url'] for original_url, url_data in existing.items()}
+
+        with self._stage('generate_short_urls', 'generate_code'):
+            new_docs = [{'short_url': await self.allocator.allocate(), 'original_url': original_url,
+                         'expiration_date': expiration_date}
+                        for original_url in unique_urls if original_url not in existing]
+        if self.code_filter:
+            for url_doc in new_docs:
+                self.code_filter.add(url_doc['short_url'])
+        with self._stage('generate_short_urls', 'mongo_insert'):
+            errors = await self._insert_new(new_docs)
+
+        cache_items = []
+        for url_doc, error in zip(new_docs, errors):
+            if error:
+                short_urls[url_doc['original_url']] = ValueError(error)
+            else:
+                short_urls[url_doc['original_url']] = url_doc['short_url']
+                self._forget(url_doc['short_url'])
+                cache_items.extend(self._memcache_entries(url_doc['short_url'], url_doc['original_url'],
+                                                          expiration_date.timestamp()))
+        try:
+            with self._stage('generate_short_urls', 'memcache_set'):
+                await self.memcache.set_cache_multi(cache_items)
+        except Exception as e:
+            # The short URLs are stored, they will be cached on their first lookup instead
+            print('Error occurred while caching short URLs: ', e)
+
+        return [short_urls[first_spellings[spellings[original_url]]] for original_url in original_urls]
+
+    async def _insert_new(self, new_docs: list[dict]) -> list[str | None]:
+        """
+        Insert new short URLs, allocating other codes for those an import took in the meantime.
+
+        Args:
+            new_docs (list[dict]): The documents, whose short URL is replaced when it was taken.
+
+        Returns:
+            list: For each document, None if it was inserted or the error message explaining why not.
+        """
+        errors = await self.mongodb.insert_short_urls(new_docs)
+        for _ in range(ALLOCATION_ATTEMPTS - 1):
+            failed = [position for position, error in enumerate(errors) if error]
+            if not failed:
+                break
+            taken = await self.mongodb.lookup_by_short_urls([new_docs[position]['short_url'] for position in failed])
+            retried = [position for position in failed if new_docs[position]['short_url'] in taken]
+            if not retried:
+                break
+            for position in retried:
+                new_docs[position] = {**new_docs[position], 'short_url': await self.allocator.allocate()}
+                if self.code_filter:
+                    self.code_filter.add(new_docs[position]['short_url'])
+            retried_errors = await self.mongodb.insert_short_urls([new_docs[position] for position in retried])
+            for position, error in zip(retried, retried_errors):
+                errors[position] = error
+        return errors
+
+    async def get_original_urls(self, short_urls: list[str]) -> list[Union[str, ValueError]]:
+        """
+        Retrieve the original URLs of a batch of short URLs.
+
+        Works like `get_original_url` for every short URL, but resolves all cache misses with one
+        Memcache round trip and a single MongoDB query.
+
+        Args:
+            short_urls (list[str]): Short URLs.
+
+        Returns:
+            list: For each short URL, its original URL or a ValueError if it does not exist or has expired.
+        """
+        resolved: dict[str, Union[str, ValueError]] = {}
+        for short_url in dict.fromkeys(short_urls):
+            original_url = self.local_cache.get(short_url) if self.local_cache else None
+            if isinstance(original_url, ValueError):
+                self.counters['negative_cache_hits'] += 1
+                self._count('negative_hit')
+            elif original_url:
+                self._count('local_hit')
+            if original_url:
+                resolved[short_url] = original_url
+            elif self.code_filter and not self.code_filter.may_exist(short_url):
+                resolved[short_url] = ValueError("Short URL not found")
+                self._count('filtered')
+
+        now = time.time()
+        missing = [short_url for short_url in dict.fromkeys(short_urls) if short_url not in resolved]
+        with self._stage('get_original_urls', 'memcache_get'):
+            cached = await self.memcache.get_cache_multi(missing) if missing else {}
+        for short_url, value in cached.items():
+            error = self._cached_error(short_url, value)
+            original_url, expires_at = unpack_cache_value(value)
+            if error:
+                resolved[short_url] = error
+                self._count('negative_hit')
+            elif original_url and (expires_at is None or expires_at > now):
+                resolved[short_url] = original_url
+                self._count('cache_hit')
+                self._remember(short_url, original_url, expires_at)
+
+        missing = [short_url for short_url in missing if short_url not in resolved]
+        try:
+            with self._stage('get_original_urls', 'mongo_find'):
+                found = await self._guarded(self.mongodb.lookup_by_short_urls, missing) if missing else {}
+        except self.unavailable_errors:
+            # Serve the whole batch from the stale copies, or fail it if any of them is missing
+            stale = await self._stale_original_urls(missing)
+            if len(stale) < len(missing):
+                self._count('unavailable', len(missing))
+                raise
+            for short_url, stale_url in stale.items():
+                self._serve_stale(short_url, stale_url)
+            resolved.update(stale)
+            return [resolved[short_url] for short_url in short_urls]
+        cache_items = []
+        for short_url in missing:
+            try:
+                url_data = check_expiration(found.get(short_url))
+            except ValueError as ve:
+                resolved[short_url] = ve
+                self._count(self._error_result(ve))
+                negative_item = self._negative_cache_item(short_url, ve)
+                if negative_item:
+                    cache_items.append(negative_item)
+                continue
+            original_url = url_data['original_url']
+            expires_at = url_data['expiration_date'].timestamp()
+            resolved[short_url] = original_url
+            self._count('cache_miss')
+            cache_items.extend(self._memcache_entries(short_url, original_url, expires_at))
+            self._remember(short_url, original_url, expires_at)
+        if cache_items:
+            with self._stage('get_original_urls', 'memcache_set'):
+                await self.memcache.set_cache_multi(cache_items)
+
+        return [resolved[short_url] for short_url in short_urls]
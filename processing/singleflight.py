@@ -0,0 +1,39 @@
+import asyncio
+from typing import Awaitable, Callable, TypeVar
+
+T = TypeVar('T')
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        """
+        Initialize a coalescer that runs at most one call per key at a time.
+
+        Callers asking for a key that is already being loaded wait for that call's result
+        instead of starting their own, so a burst of misses for one hot key costs one lookup.
+        """
+        self.calls: dict[str, asyncio.Future] = {}
+        self.coalesced = 0
+
+    async def do(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run `func` for `key`, or join the call for `key` that is already in flight.
+
+        The call runs as its own task, so a caller that gets cancelled does not cancel the
+        lookup other callers are waiting for.
+
+        Args:
+            key (str): The key identifying the call.
+            func (Callable): A zero argument coroutine function performing the call.
+
+        Returns:
+            The result of the call, or raises its exception.
+        """
+        future = self.calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self.calls[key] = future
+            future.add_done_callback(lambda _: self.calls.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(future)
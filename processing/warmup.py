@@ -0,0 +1,184 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+
+from db.local_cache import LocalCache
+from db.memcache import AsyncMemcache
+from db.storage import StorageBackend
+from processing.cache_values import memcache_entries
+from processing.metrics import Sample
+from processing.shortener import OriginalURL
+
+# Memcache key taken by the worker warming the shared cache at startup, so the other workers of a
+# deploy don't repeat the same reads, and how many seconds it is held
+WARMUP_LOCK_KEY = 'cache_warmup_lock'
+WARMUP_LOCK_SECONDS = 300
+
+
+class CacheWarmer:
+    def __init__(self, mongodb: StorageBackend, memcache: AsyncMemcache, local_cache: LocalCache | None = None,
+                 top: int = 1000, recent: int = 10000, hours: float = 24, batch_size: int = 500,
+                 rate: float = 5000, cache_ttl: float = 0, stale_ttl: float = 0) -> None:
+        """
+        Initialize a loader filling the caches with the mappings most likely to be requested.
+
+        After a deploy or a Memcache restart every redirect would miss the cache and reach
+        MongoDB at once. Warming the caches loads the `top` most clicked short URLs of the last
+        `hours` first, then the `recent` ones expiring last, i.e. created or shortened again most
+        recently, with the same Memcache entries and remaining lifetime a lookup would store. The
+        local cache of this worker gets the first of them, as many as it holds. Documents are read
+        in batches of `batch_size` and paced to at most `rate` per second to leave MongoDB capacity
+        for the requests that still miss.
+
+        Args:
+            mongodb (StorageBackend): MongoDB instance, or another storage backend.
+            memcache (AsyncMemcache): Memcache instance.
+            local_cache (LocalCache, optional): The in-process cache of this worker.
+            top (int): Number of most clicked short URLs to load.
+            recent (int): Number of most recent short URLs to load.
+            hours (float): Clicks of the last hours ranking the most clicked short URLs.
+            batch_size (int): Number of documents read and cached per batch.
+            rate (float): Maximum number of documents read per second, 0 for no limit.
+            cache_ttl (float): Lifetime in seconds of the Memcache entries, 0 for no limit.
+            stale_ttl (float): Lifetime in seconds of the stale copies, 0 disables them.
+        """
+        self.mongodb = mongodb
+        self.memcache = memcache
+        self.local_cache = local_cache
+        self.top = top
+        self.recent = recent
+        self.hours = hours
+        self.batch_size = batch_size
+        self.rate = rate
+        self.cache_ttl = cache_ttl
+        self.stale_ttl = stale_ttl
+        self.task: asyncio.Task | None = None
+        self.progress = {'state': 'idle', 'read': 0, 'loaded': 0, 'top': 0, 'recent': 0, 'seconds': 0.0,
+                         'error': None}
+        self.runs = 0
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    async def _load(self, url_docs: list[dict], source: str, started: float) -> None:
+        """ Cache a batch of documents, then wait as long as the rate limit requires. """
+        now = time.time()
+        self.progress['read'] += len(url_docs)
+        items = []
+        for url_data in url_docs:
+            expires_at = url_data['expiration_date'].timestamp()
+            if expires_at <= now:
+                continue
+            items.extend(memcache_entries(url_data['short_url'], url_data['original_url'], expires_at,
+                                          self.cache_ttl, self.stale_ttl))
+            if self.local_cache and self.progress['loaded'] < self.local_cache.max_size:
+                self.local_cache.set(url_data['short_url'], OriginalURL(url_data['original_url'], expires_at),
+                                     expires_at)
+            self.progress['loaded'] += 1
+            self.progress[source] += 1
+        if items:
+            await self.memcache.set_cache_multi(items)
+
+        self.progress['seconds'] = time.perf_counter() - started
+        print(f"Cache warm-up: {self.progress['loaded']} mappings loaded in {self.progress['seconds']:.1f}s")
+        if self.rate > 0:
+            # Stay on the schedule of `rate` documents per second since the start
+            await asyncio.sleep(max(0.0, started + self.progress['read'] / self.rate - time.perf_counter()))
+
+    async def warm(self, top: int | None = None, recent: int | None = None, once: bool = False) -> dict:
+        """
+        Load the most clicked and the most recent mappings into the caches.
+
+        Args:
+            top (int, optional): Number of most clicked short URLs, `top` of the warmer if omitted.
+            recent (int, optional): Number of most recent short URLs, `recent` of the warmer if omitted.
+            once (bool): Skip the warm-up if another worker started one in the last `WARMUP_LOCK_SECONDS`.
+
+        Returns:
+            dict: The progress, with the number of mappings loaded from each source and the duration.
+        """
+        top = self.top if top is None else top
+        recent = self.recent if recent is None else recent
+        self.progress = {'state': 'running', 'read': 0, 'loaded': 0, 'top': 0, 'recent': 0, 'seconds': 0.0,
+                         'error': None}
+        started = time.perf_counter()
+        loaded = set()
+        try:
+            if once and not await self.memcache.add_cache(WARMUP_LOCK_KEY, str(os.getpid()), WARMUP_LOCK_SECONDS):
+                self.progress['state'] = 'skipped'
+                return self.progress
+            self.runs += 1
+            if top > 0:
+                since = int(time.time() - self.hours * 3600)
+                ranking = [link['short_url'] for link in await self.mongodb.top_clicked(top, since)]
+                for start in range(0, len(ranking), self.batch_size):
+                    found = await self.mongodb.lookup_by_short_urls(ranking[start:start + self.batch_size])
+                    loaded.update(found)
+                    await self._load(list(found.values()), 'top', started)
+
+            batch = []
+            async for url_data in self.mongodb.latest_short_urls(recent, self.batch_size):
+                if url_data['short_url'] not in loaded:
+                    batch.append(url_data)
+                if len(batch) >= self.batch_size:
+                    await self._load(batch, 'recent', started)
+                    batch = []
+            if batch:
+                await self._load(batch, 'recent', started)
+        except asyncio.CancelledError:
+            self.progress['state'] = 'cancelled'
+            raise
+        except Exception as e:
+            print('Error occurred while warming the caches: ', e)
+            self.progress.update(state='failed', error=str(e))
+        else:
+            self.progress['state'] = 'done'
+        finally:
+            self.progress['seconds'] = time.perf_counter() - started
+            self.progress['finished_at'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        return self.progress
+
+    def start(self, top: int | None = None, recent: int | None = None, once: bool = False) -> bool:
+        """
+        Warm the caches in the background.
+
+        Args:
+            top (int, optional): Number of most clicked short URLs.
+            recent (int, optional): Number of most recent short URLs.
+            once (bool): Skip the warm-up if another worker started one recently.
+
+        Returns:
+            bool: True if a warm-up was started, False if one is running already.
+        """
+        if self.running:
+            return False
+        self.task = asyncio.create_task(self.warm(top, recent, once))
+        return True
+
+    async def stop(self) -> None:
+        """ Cancel a warm-up running in the background. """
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def collect(self) -> list[Sample]:
+        """
+        Report the last warm-up as metric samples.
+
+        Returns:
+            list: Samples for the registry exposition.
+        """
+        return [
+            ('url_shortener_cache_warmups_total', 'Cache warm-ups started by this worker.', 'counter', {},
+             self.runs),
+            ('url_shortener_cache_warmup_loaded', 'Mappings loaded by the last cache warm-up.', 'gauge', {},
+             self.progress['loaded']),
+            ('url_shortener_cache_warmup_seconds', 'Duration of the last cache warm-up.', 'gauge', {},
+             self.progress['seconds']),
+        ]
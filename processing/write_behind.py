@@ -0,0 +1,151 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from db.memcache import AsyncMemcache
+from db.storage import StorageBackend
+from processing.cache_values import memcache_entries
+
+
+class ExpiryWriteBehind:
+    def __init__(self, mongodb: StorageBackend, memcache: AsyncMemcache, interval: float = 5.0,
+                 min_extension: float = 3600, cache_ttl: float = 0, stale_ttl: float = 0) -> None:
+        """
+        Initialize a buffer that coalesces expiry extensions and writes them in batches.
+
+        Re-shortening a known URL records the extension in memory instead of updating MongoDB
+        right away. Every `interval` seconds the buffered extensions are written with a single
+        `bulk_write`, and the Memcache entries of the extended short URLs that still exist get
+        their new TTL. Short URLs expiring before the next flush or two are extended right away
+        instead, see `is_urgent`, so MongoDB's TTL monitor cannot remove them in the meantime.
+
+        Args:
+            mongodb (StorageBackend): MongoDB instance, or another storage backend.
+            memcache (AsyncMemcache): Memcache instance.
+            interval (float): Seconds between flushes.
+            min_extension (float): Extensions moving the expiry by fewer seconds than this are dropped.
+            cache_ttl (float): Lifetime in seconds of the refreshed Memcache entries, 0 for no limit.
+            stale_ttl (float): Lifetime in seconds of the refreshed stale copies, 0 disables them.
+        """
+        self.mongodb = mongodb
+        self.memcache = memcache
+        self.interval = interval
+        self.min_extension = timedelta(seconds=min_extension)
+        self.cache_ttl = cache_ttl
+        self.stale_ttl = stale_ttl
+        self.pending: dict[str, tuple[str, datetime]] = {}
+        # Short URLs deleted while a flush is running, whose Memcache entries it must not restore
+        self.discarded: set[str] = set()
+        self.flushing = False
+        self.task: asyncio.Task | None = None
+        self.skipped = 0
+        self.flushed = 0
+
+    def extend(self, short_url: str, original_url: str, expiration_date: datetime,
+               new_expiration_date: datetime) -> bool:
+        """
+        Record that a short URL should expire at `new_expiration_date` at the earliest.
+
+        Args:
+            short_url (str): The short URL to extend.
+            original_url (str): Its original URL, needed to refresh the Memcache entry.
+            expiration_date (datetime): The expiration date currently stored in MongoDB.
+            new_expiration_date (datetime): The requested expiration date.
+
+        Returns:
+            bool: True if the extension was buffered, False if it would not materially change the expiry.
+        """
+        _, pending_date = self.pending.get(short_url, (None, expiration_date))
+        if new_expiration_date - max(expiration_date, pending_date) < self.min_extension:
+            self.skipped += 1
+            return False
+        self.pending[short_url] = (original_url, new_expiration_date)
+        return True
+
+    def is_urgent(self, expiration_date: datetime) -> bool:
+        """
+        Tell whether a short URL expires too soon for its extension to wait for a flush.
+
+        Args:
+            expiration_date (datetime): The expiration date currently stored in MongoDB.
+
+        Returns:
+            bool: True if the extension should be written right away.
+        """
+        return expiration_date - datetime.now(timezone.utc) < timedelta(seconds=2 * self.interval)
+
+    def discard(self, short_urls: list[str]) -> None:
+        """
+        Drop the buffered extensions of deleted short URLs, so a flush does not bring them back into Memcache.
+
+        Args:
+            short_urls (list[str]): The deleted short URLs.
+        """
+        for short_url in short_urls:
+            self.pending.pop(short_url, None)
+            if self.flushing:
+                self.discarded.add(short_url)
+
+    async def flush(self) -> None:
+        """
+        Write all buffered extensions to MongoDB and refresh the Memcache entries of the short URLs that exist.
+
+        The Memcache entries are rebuilt from the documents read back after the write, so short
+        URLs deleted or expired in the meantime are left alone. Extensions that could not be
+        written are put back into the buffer for the next flush.
+        """
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        self.flushing = True
+        try:
+            try:
+                await self.mongodb.extend_expiration_dates(
+                    {short_url: expiration_date for short_url, (_, expiration_date) in batch.items()})
+            except BaseException:
+                # Keep the extensions, also when stop() cancelled the write, merging them with ones buffered
+                # while the write was running
+                for short_url, (original_url, expiration_date) in batch.items():
+                    if short_url in self.discarded:
+                        continue
+                    _, pending_date = self.pending.get(short_url, (None, expiration_date))
+                    self.pending[short_url] = (original_url, max(expiration_date, pending_date))
+                raise
+            self.flushed += len(batch)
+
+            url_docs = await self.mongodb.lookup_by_short_urls(list(batch))
+            now = datetime.now(timezone.utc)
+            items = [item for short_url, url_data in url_docs.items()
+                     if url_data['expiration_date'] > now and short_url not in self.discarded
+                     for item in memcache_entries(short_url, url_data['original_url'],
+                                                  url_data['expiration_date'].timestamp(), self.cache_ttl,
+                                                  self.stale_ttl)]
+            if items:
+                await self.memcache.set_cache_multi(items)
+        finally:
+            self.flushing = False
+            self.discarded.clear()
+
+    async def run(self) -> None:
+        """ Flush the buffer every `interval` seconds until cancelled. """
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print('Error occurred while flushing expiry extensions: ', e)
+
+    def start(self) -> None:
+        """ Start flushing in the background. """
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """ Stop the background flushes and write everything still buffered. """
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
@@ -0,0 +1,349 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Any, Mapping
+
+from pymongo.errors import ServerSelectionTimeoutError
+
+from db.mongodb import UNAVAILABLE_ERRORS, check_expiration, match_original_urls
+
+
+class FakeBackend:
+    def __init__(self, latency: float = 0.0, blocking: bool = False) -> None:
+        """
+        Base class for in-process backend stand-ins with injectable latency.
+
+        Args:
+            latency (float): Seconds every call takes.
+            blocking (bool): Sleep synchronously, the way a blocking driver stalls the event loop.
+        """
+        self.latency = latency
+        self.blocking = blocking
+        self.calls = 0
+        # Set to make every call fail the way an unreachable MongoDB does
+        self.down = False
+
+    async def _round_trip(self) -> None:
+        self.calls += 1
+        if self.down:
+            raise ServerSelectionTimeoutError("No servers available")
+        if self.blocking:
+            time.sleep(self.latency)
+        elif self.latency:
+            await asyncio.sleep(self.latency)
+        else:
+            await asyncio.sleep(0)
+
+
+class FakeMongoDB(FakeBackend):
+    """ An in-memory stand-in for `AsyncMongoDB`. """
+
+    unavailable_errors = UNAVAILABLE_ERRORS
+    duplicate_errors = (ValueError,)
+
+    def __init__(self, latency: float = 0.0, blocking: bool = False) -> None:
+        super().__init__(latency, blocking)
+        self.documents: dict[str, dict] = {}
+        self.counters: dict[str, int] = {}
+        self.clicks: dict[tuple[str, int], int] = {}
+
+    async def ensure_indexes(self) -> None:
+        pass
+
+    async def reserve_sequence_block(self, name: str, size: int) -> int:
+        await self._round_trip()
+        self.counters[name] = self.counters.get(name, 0) + size
+        return self.counters[name] - size
+
+    async def insert_short_url(self, short_url: str, original_url: str, expiration_date: datetime) -> None:
+        await self._round_trip()
+        if short_url in self.documents:
+            raise ValueError(f"Duplicate short URL {short_url}")
+        self.documents[short_url] = {'short_url': short_url, 'original_url': original_url,
+                                     'expiration_date': expiration_date}
+
+    async def find_short_url(self, search_criteria: dict, get_expired_url: bool = False) -> Mapping[str, Any]:
+        await self._round_trip()
+        if set(search_criteria) == {'short_url'}:
+            url_data = self.documents.get(search_criteria['short_url'])
+        else:
+            url_data = next((doc for doc in self.documents.values()
+                             if all(doc.get(key) == value for key, value in search_criteria.items())), None)
+        return check_expiration(dict(url_data) if url_data else None, get_expired_url)
+
+    async def delete_short_url(self, short_url: str) -> None:
+        await self._round_trip()
+        self.documents.pop(short_url, None)
+
+    async def delete_short_urls(self, short_urls: list[str]) -> None:
+        await self._round_trip()
+        for short_url in short_urls:
+            self.documents.pop(short_url, None)
+
+    async def scan_short_urls(self, after: str | None = None, batch_size: int = 1000):
+        for short_url in sorted(self.documents):
+            if after is None or short_url > after:
+                await self._round_trip()
+                if short_url in self.documents:
+                    yield dict(self.documents[short_url])
+
+    async def latest_short_urls(self, limit: int, batch_size: int = 1000):
+        await self._round_trip()
+        now = datetime.now(timezone.utc)
+        latest = sorted((doc for doc in self.documents.values() if doc['expiration_date'] > now),
+                        key=lambda doc: (doc['expiration_date'], doc['short_url']), reverse=True)
+        for url_data in latest[:limit]:
+            yield dict(url_data)
+
+    async def update_expiration_date(self, short_url: str, new_expiration_date: datetime) -> None:
+        await self._round_trip()
+        if short_url in self.documents:
+            self.documents[short_url]['expiration_date'] = new_expiration_date
+
+    async def close_connection(self) -> None:
+        pass
+
+    async def lookup_by_original_url(self, original_url: str) -> Mapping[str, Any] | None:
+        await self._round_trip()
+        return match_original_urls(map(dict, self.documents.values()), [original_url]).get(original_url)
+
+    async def lookup_by_short_url(self, short_url: str) -> Mapping[str, Any]:
+        return await self.find_short_url({"short_url": short_url})
+
+    async def insert_short_urls(self, url_docs: list[dict]) -> list[str | None]:
+        await self._round_trip()
+        errors = []
+        for url_doc in url_docs:
+            if url_doc['short_url'] in self.documents:
+                errors.append(f"Duplicate short URL {url_doc['short_url']}")
+            else:
+                self.documents[url_doc['short_url']] = dict(url_doc)
+                errors.append(None)
+        return errors
+
+    async def upsert_short_urls(self, url_docs: list[dict]) -> None:
+        await self._round_trip()
+        for url_doc in url_docs:
+            self.documents[url_doc['short_url']] = dict(url_doc)
+
+    async def update_expiration_dates(self, short_urls: list[str], new_expiration_date: datetime) -> None:
+        await self._round_trip()
+        for short_url in short_urls:
+            if short_url in self.documents:
+                self.documents[short_url]['expiration_date'] = new_expiration_date
+
+    async def extend_expiration_dates(self, expiration_dates) -> None:
+        await self._round_trip()
+        for short_url, expiration_date in expiration_dates.items():
+            if short_url in self.documents:
+                url_doc = self.documents[short_url]
+                url_doc['expiration_date'] = max(url_doc['expiration_date'], expiration_date)
+
+    async def lookup_by_original_urls(self, original_urls: list[str]) -> dict[str, Mapping[str, Any]]:
+        await self._round_trip()
+        return match_original_urls(map(dict, self.documents.values()), original_urls)
+
+    async def lookup_by_short_urls(self, short_urls: list[str]) -> dict[str, Mapping[str, Any]]:
+        await self._round_trip()
+        return {short_url: dict(self.documents[short_url]) for short_url in short_urls
+                if short_url in self.documents}
+
+    async def increment_clicks(self, counts) -> None:
+        await self._round_trip()
+        for key, count in counts.items():
+            self.clicks[key] = self.clicks.get(key, 0) + count
+
+    async def top_clicked(self, limit: int, since: int = 0) -> list[dict]:
+        await self._round_trip()
+        totals: dict[str, int] = {}
+        for (short_url, bucket), count in self.clicks.items():
+            if bucket >= since:
+                totals[short_url] = totals.get(short_url, 0) + count
+        ranked = sorted(totals.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [{'short_url': short_url, 'count': count} for short_url, count in ranked]
+
+    async def click_history(self, short_url: str, since: int = 0) -> list[dict]:
+        await self._round_trip()
+        return [{'bucket': bucket, 'count': count} for (code, bucket), count in sorted(self.clicks.items())
+                if code == short_url and bucket >= since]
+
+
+class FakeMemcache(FakeBackend):
+    """ An in-memory stand-in for `AsyncMemcache`. """
+
+    def __init__(self, latency: float = 0.0, blocking: bool = False) -> None:
+        super().__init__(latency, blocking)
+        self.values: dict[str, tuple[str, float]] = {}
+
+    async def set_cache(self, key: str, value: str, expiration_time: float, all_nodes: bool = False) -> None:
+        await self._round_trip()
+        self.values[key] = (value, time.time() + expiration_time)
+
+    async def add_cache(self, key: str, value: str, expiration_time: float) -> bool:
+        if await self.get_cache(key) is not None:
+            return False
+        self.values[key] = (value, time.time() + expiration_time)
+        return True
+
+    async def get_cache(self, key: str) -> str | None:
+        await self._round_trip()
+        value, expires_at = self.values.get(key, (None, 0.0))
+        return value if expires_at > time.time() else None
+
+    async def delete_cache(self, key: str) -> None:
+        await self._round_trip()
+        self.values.pop(key, None)
+
+    async def incr_cache(self, key: str, delta: int, expiration_time: float) -> int | None:
+        value = await self.get_cache(key)
+        if value is None:
+            self.values[key] = (str(delta), time.time() + expiration_time)
+            return delta
+        self.values[key] = (str(int(value) + delta), self.values[key][1])
+        return int(value) + delta
+
+    async def set_cache_multi(self, items) -> None:
+        await self._round_trip()
+        for key, value, expiration_time in items:
+            self.values[key] = (value, time.time() + expiration_time)
+
+    async def get_cache_multi(self, keys) -> dict[str, str]:
+        await self._round_trip()
+        now = time.time()
+        return {key: self.values[key][0] for key in keys if key in self.values and self.values[key][1] > now}
+
+    def close_connection(self) -> None:
+        pass
+
+
+class MemcachedStandIn:
+    """
+    A tiny memcached server speaking the subset of the text protocol used by `MemcacheProtocolClient`.
+
+    It listens on an ephemeral localhost port, so tests can exercise the real client over TCP.
+    """
+
+    def __init__(self) -> None:
+        self.values: dict[bytes, tuple[bytes, float]] = {}
+        self.server: asyncio.AbstractServer | None = None
+        self.port = 0
+        self.writers: set[asyncio.StreamWriter] = set()
+
+    async def start(self) -> "MemcachedStandIn":
+        # A stopped stand-in restarts on its previous port, keeping its values
+        self.server = await asyncio.start_server(self._serve, '127.0.0.1', self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self) -> None:
+        self.server.close()
+        # Drop open connections too, the way a crashed memcached would
+        for writer in list(self.writers):
+            writer.close()
+        await self.server.wait_closed()
+
+    @property
+    def url(self) -> str:
+        return f'127.0.0.1:{self.port}'
+
+    def _get(self, key: bytes) -> bytes | None:
+        value, expires_at = self.values.get(key, (None, 0.0))
+        if value is None or (expires_at and expires_at < time.time()):
+            return None
+        return value
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.writers.add(writer)
+        try:
+            while line := await reader.readline():
+                command, *args = line.split()
+                if command == b'get':
+                    for key in args:
+                        value = self._get(key)
+                        if value is not None:
+                            writer.write(b'VALUE %s 0 %d\r\n%s\r\n' % (key, len(value), value))
+                    writer.write(b'END\r\n')
+                elif command in (b'set', b'add'):
+                    key, _, exptime, length = args[:4]
+                    value = (await reader.readexactly(int(length) + 2))[:-2]
+                    if command == b'add' and self._get(key) is not None:
+                        writer.write(b'NOT_STORED\r\n')
+                        continue
+                    exptime = int(exptime)
+                    expires_at = 0.0 if not exptime else (
+                        exptime if exptime > 60 * 60 * 24 * 30 else time.time() + exptime)
+                    self.values[key] = (value, expires_at)
+                    writer.write(b'STORED\r\n')
+                elif command == b'delete':
+                    writer.write(b'DELETED\r\n' if self.values.pop(args[0], None) else b'NOT_FOUND\r\n')
+                elif command == b'incr':
+                    value = self._get(args[0])
+                    if value is None:
+                        writer.write(b'NOT_FOUND\r\n')
+                    else:
+                        value = b'%d' % (int(value) + int(args[1]))
+                        self.values[args[0]] = (value, self.values[args[0]][1])
+                        writer.write(value + b'\r\n')
+                else:
+                    writer.write(b'ERROR\r\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+
+class CachingProxy:
+    """
+    A caching reverse proxy standing in for a CDN in front of an ASGI application.
+
+    `GET` responses allowed by their `Cache-Control` max-age are replayed until they are that
+    old, everything else reaches the application. `PURGE` requests and `purge` drop cached paths.
+    """
+
+    def __init__(self, app, clock=time.time) -> None:
+        self.app = app
+        self.clock = clock
+        self.cache: dict[str, tuple[float, list[dict]]] = {}
+        self.origin_requests = 0
+
+    async def purge(self, short_urls: list[str]) -> None:
+        for short_url in short_urls:
+            self.cache.pop('/' + short_url, None)
+
+    @staticmethod
+    def _max_age(messages: list[dict]) -> int | None:
+        headers = dict(messages[0]['headers'])
+        directives = [directive.strip() for directive in headers.get(b'cache-control', b'').split(b',')]
+        if b'no-store' in directives or b'private' in directives:
+            return None
+        return next((int(directive[8:]) for directive in directives if directive.startswith(b'max-age=')), None)
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope['type'] != 'http' or scope['method'] not in ('GET', 'PURGE'):
+            await self.app(scope, receive, send)
+            return
+        path = scope['path']
+        if scope['method'] == 'PURGE':
+            status = 200 if self.cache.pop(path, None) else 404
+            await send({'type': 'http.response.start', 'status': status, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        cached = self.cache.get(path)
+        if cached is None or cached[0] <= self.clock():
+            messages = []
+
+            async def capture(message: dict) -> None:
+                messages.append(message)
+
+            self.origin_requests += 1
+            await self.app(scope, receive, capture)
+            max_age = self._max_age(messages)
+            if max_age:
+                self.cache[path] = (self.clock() + max_age, messages)
+        else:
+            messages = cached[1]
+        for message in messages:
+            await send(message)
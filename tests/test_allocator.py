@@ -0,0 +1,52 @@
+import asyncio
+
+from processing.allocator import KeyAllocator
+from tests.fakes import FakeMongoDB
+
+
+def test_codes_are_unique_and_fixed_length():
+    """
+    Test case for allocating short URLs from leased blocks.
+    Two allocators sharing a counter, like two workers, must never hand out the same code.
+    """
+    async def scenario():
+        mongodb = FakeMongoDB()
+        workers = [KeyAllocator(mongodb, block_size=50), KeyAllocator(mongodb, block_size=50)]
+        codes = await asyncio.gather(*(workers[i % 2].allocate() for i in range(1000)))
+        assert len(set(codes)) == 1000
+        assert {len(code) for code in codes} == {7}
+        # Blocks are leased once per 50 codes and worker, plus the background prefetches
+        assert mongodb.counters["short_url"] <= 1000 + 4 * 50
+
+    asyncio.run(scenario())
+
+
+def test_encoding_is_bijective():
+    """
+    Test case for mapping sequence numbers to codes and back.
+    """
+    allocator = KeyAllocator(FakeMongoDB(), code_length=3)
+    codes = {allocator.encode(sequence) for sequence in range(allocator.space)}
+    assert len(codes) == allocator.space
+    assert all(allocator.decode(allocator.encode(sequence)) == sequence for sequence in range(0, allocator.space, 97))
+    assert allocator.decode("0OI") is None
+    assert allocator.decode("abcd") is None
+
+
+def test_old_blocks_are_given_up(monkeypatch):
+    """
+    Test case for leasing a new block once the current one is older than the maximum block age,
+    so no code is issued from a block leased before that.
+    """
+    async def scenario():
+        now = [1000.0]
+        monkeypatch.setattr('processing.allocator.time.time', lambda: now[0])
+        mongodb = FakeMongoDB()
+        allocator = KeyAllocator(mongodb, block_size=100, max_block_age=60)
+        first = await allocator.allocate()
+        assert allocator.decode(first) == 0
+        now[0] += 61
+        assert allocator.decode(await allocator.allocate()) >= 100
+        assert mongodb.counters["short_url"] == 200
+
+    asyncio.run(scenario())
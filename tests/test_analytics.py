@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api import endpoints
+from main import app
+from processing.analytics import ClickAnalytics
+from processing.shortener import URLShortener
+from tests.fakes import FakeMemcache, FakeMongoDB
+
+
+class FakeClock:
+    def __init__(self, now: float) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_clicks_are_aggregated_and_dropped_under_backpressure():
+    """
+    Test case for the click buffer.
+    Clicks are aggregated per short URL and time bucket, flushed in one write, kept when the write fails,
+    and dropped once the buffer is full.
+    """
+    async def scenario():
+        mongodb = FakeMongoDB()
+        clock = FakeClock(7200.0)
+        analytics = ClickAnalytics(mongodb, bucket_seconds=3600, max_pending=2, clock=clock)
+
+        for _ in range(3):
+            analytics.record("abc")
+        analytics.record("def")
+        clock.now = 10800.0
+        analytics.record("abc")
+        assert analytics.pending == {("abc", 7200): 3, ("def", 7200): 1}
+        assert (analytics.recorded, analytics.dropped) == (4, 1)
+
+        mongodb.down = True
+        with pytest.raises(Exception):
+            await analytics.flush()
+        assert analytics.pending == {("abc", 7200): 3, ("def", 7200): 1}
+
+        mongodb.down = False
+        calls = mongodb.calls
+        await analytics.flush()
+        assert mongodb.calls == calls + 1
+        assert mongodb.clicks == {("abc", 7200): 3, ("def", 7200): 1}
+        assert not analytics.pending and analytics.flushed == 4
+
+        analytics.record("abc")
+        await analytics.flush()
+        assert await analytics.top_links(1) == [{"short_url": "abc", "count": 4}]
+        assert await analytics.history("abc") == [{"bucket": 7200, "count": 3}, {"bucket": 10800, "count": 1}]
+        clock.now = 18000.0
+        assert await analytics.history("abc", hours=2) == [{"bucket": 10800, "count": 1}]
+
+    asyncio.run(scenario())
+
+
+def test_analytics_endpoints(monkeypatch):
+    """
+    Test case for recording redirects and querying their counts through the API.
+    Buffered clicks must be written on shutdown.
+    """
+    mongodb = FakeMongoDB()
+    analytics = ClickAnalytics(mongodb, interval=3600)
+    monkeypatch.setattr(endpoints, "shortener", URLShortener(mongodb, FakeMemcache()))
+    monkeypatch.setattr(endpoints, "analytics", analytics)
+
+    with TestClient(app) as client:
+        codes = [client.post("/shorten/", json={"original_url": f"https://example.com/{i}"}).json()["short_url"]
+                 .rsplit('/', 1)[-1] for i in range(3)]
+        for clicks, code in enumerate(codes, start=1):
+            for _ in range(clicks):
+                client.get(f"/{code}", follow_redirects=False)
+        client.get("/unknown", follow_redirects=False)
+        assert analytics.recorded == 6
+
+    with TestClient(app) as client:
+        top = client.get("/analytics/top", params={"limit": 2}).json()["links"]
+        assert top == [{"short_url": codes[2], "count": 3}, {"short_url": codes[1], "count": 2}]
+
+        history = client.get(f"/analytics/{codes[2]}", params={"hours": 24}).json()
+        assert history["total"] == 3 and len(history["buckets"]) == 1
+
+    monkeypatch.setattr(endpoints, "analytics", None)
+    assert TestClient(app).get("/analytics/top").status_code == 404
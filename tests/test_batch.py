@@ -0,0 +1,57 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from api import endpoints
+from main import app
+from processing.shortener import URLShortener
+from tests.fakes import FakeMemcache, FakeMongoDB
+
+client = TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def shortener(monkeypatch):
+    """ Serve the endpoints from in-process storage stand-ins. """
+    shortener = URLShortener(FakeMongoDB(), FakeMemcache())
+    monkeypatch.setattr(endpoints, "shortener", shortener)
+    return shortener
+
+
+def test_shorten_batch(shortener):
+    """
+    Test case for the batch shorten endpoint.
+    The tests cover new URLs, a duplicate within the batch, an already shortened URL and an invalid URL.
+    """
+    existing = client.post("/shorten/", json={"original_url": "https://gmail.com"}).json()["short_url"]
+
+    data = {"original_urls": ["https://example.com/a", "invalid_url", "https://gmail.com", "https://example.com/a"],
+            "expiration_in_hrs": 10}
+    response = client.post("/shorten/batch", json=data)
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert results[0]["short_url"] == results[3]["short_url"]
+    assert results[1] == {"original_url": "invalid_url", "error": "Invalid URL provided"}
+    assert results[2]["short_url"] == existing
+    assert len(shortener.mongodb.documents) == 2
+
+    response = client.post("/shorten/batch", json={"original_urls": ["https://example.com"] * 1001})
+    assert response.status_code == 422
+
+
+def test_resolve_batch(shortener):
+    """
+    Test case for the batch resolve endpoint.
+    The tests cover cached, uncached and non-existing short URLs.
+    """
+    results = client.post("/shorten/batch",
+                          json={"original_urls": ["https://example.com/a", "https://example.com/b"]}).json()["results"]
+    shortener.memcache.values.pop(results[1]["short_url"].rsplit('/', 1)[-1])
+
+    short_urls = [results[0]["short_url"], results[1]["short_url"], "non_existing_short_url"]
+    response = client.post("/resolve/batch", json={"short_urls": short_urls})
+    assert response.status_code == 200
+    assert response.json()["results"] == [
+        {"short_url": short_urls[0], "original_url": "https://example.com/a"},
+        {"short_url": short_urls[1], "original_url": "https://example.com/b"},
+        {"short_url": "non_existing_short_url", "error": "Short URL not found"},
+    ]
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from pymongo.errors import ServerSelectionTimeoutError
+
+from api import endpoints
+from db.mongodb import UNAVAILABLE_ERRORS
+from main import app
+from processing.circuit_breaker import CircuitBreaker, CircuitOpenError
+from processing.shortener import URLShortener
+from tests.fakes import FakeMemcache, FakeMongoDB
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_circuit_breaker_states():
+    """
+    Test case for the circuit breaker state machine.
+    It opens after consecutive failures, lets a single trial through once the reset timeout passed,
+    and treats errors about the request itself as a healthy backend.
+    """
+    async def scenario():
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, failure_types=UNAVAILABLE_ERRORS, clock=clock)
+
+        async def fail():
+            raise ServerSelectionTimeoutError("No servers available")
+
+        async def missing():
+            raise ValueError("Short URL not found")
+
+        async def succeed():
+            return "ok"
+
+        with pytest.raises(ValueError):
+            await breaker.call(missing)
+        for _ in range(2):
+            with pytest.raises(ServerSelectionTimeoutError):
+                await breaker.call(fail)
+        assert breaker.state == 'open'
+        with pytest.raises(CircuitOpenError) as error:
+            await breaker.call(succeed)
+        assert error.value.retry_after == 10
+
+        clock.now = 10
+        assert breaker.state == 'half_open'
+        # A failed trial keeps the circuit open for another reset timeout
+        with pytest.raises(ServerSelectionTimeoutError):
+            await breaker.call(fail)
+        assert breaker.state == 'open'
+
+        clock.now = 20
+        assert breaker.allow() and not breaker.allow()
+        breaker.record_success()
+        assert breaker.state == 'closed'
+        assert await breaker.call(succeed) == "ok"
+
+    asyncio.run(scenario())
+
+
+def test_redirects_fail_fast_while_mongodb_is_down(monkeypatch):
+    """
+    Test case for redirects during a MongoDB outage.
+    Cached short URLs keep resolving, while cache misses stop reaching MongoDB and answer 503.
+    """
+    mongodb, memcache = FakeMongoDB(), FakeMemcache()
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30, failure_types=UNAVAILABLE_ERRORS)
+    shortener = URLShortener(mongodb, memcache, negative_cache_ttl=0, breaker=breaker)
+    monkeypatch.setattr(endpoints, "shortener", shortener)
+
+    client = TestClient(app)
+    cached = client.post("/shorten/", json={"original_url": "https://gmail.com"}).json()["short_url"]
+    uncached = client.post("/shorten/", json={"original_url": "https://github.com"}).json()["short_url"]
+    memcache.values.pop(uncached.rsplit('/', 1)[-1])
+
+    mongodb.down = True
+    for _ in range(3):
+        with pytest.raises(ServerSelectionTimeoutError):
+            client.get(f"/{uncached.rsplit('/', 1)[-1]}", follow_redirects=False)
+    calls = mongodb.calls
+
+    response = client.get(f"/{uncached.rsplit('/', 1)[-1]}", follow_redirects=False)
+    assert response.status_code == 503
+    assert 0 < int(response.headers["Retry-After"]) <= 30
+    assert mongodb.calls == calls
+
+    response = client.get(f"/{cached.rsplit('/', 1)[-1]}", follow_redirects=False)
+    assert response.status_code == 307
+    assert response.headers["location"] == "https://gmail.com/"
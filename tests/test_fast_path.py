@@ -0,0 +1,52 @@
+from fastapi.testclient import TestClient
+
+from api import endpoints
+from api.fast_path import RedirectFastPath
+from main import app
+from processing.analytics import ClickAnalytics
+from processing.shortener import URLShortener
+from tests.fakes import FakeMemcache, FakeMongoDB
+
+
+def test_fast_path_answers_like_fastapi(monkeypatch):
+    """
+    Test case for the redirect fast path.
+    Redirects, unknown short URLs and the routes it hands over to FastAPI must be answered the same way
+    with and without it, and clicks must still be counted.
+    """
+    mongodb = FakeMongoDB()
+    analytics = ClickAnalytics(mongodb)
+    monkeypatch.setattr(endpoints, "shortener", URLShortener(mongodb, FakeMemcache()))
+    monkeypatch.setattr(endpoints, "analytics", analytics)
+    client = TestClient(app)
+    fast_client = TestClient(RedirectFastPath(app, routes=[*app.routes, *endpoints.router.routes]))
+
+    short_url = client.post("/shorten/", json={"original_url": "https://example.com/a b?q=ü"}).json()["short_url"]
+    code = short_url.rsplit('/', 1)[-1]
+    for path in (f"/{code}", "/unknown1", "/metrics", "/shorten", "/docs"):
+        expected = client.get(path, follow_redirects=False)
+        response = fast_client.get(path, follow_redirects=False)
+        assert response.status_code == expected.status_code, path
+        assert response.headers.get("location") == expected.headers.get("location"), path
+        if path != "/metrics":
+            assert response.content == expected.content, path
+    assert analytics.recorded == 2
+
+    shortened = fast_client.post("/shorten/", json={"original_url": "https://gmail.com"})
+    assert shortened.status_code == 200
+
+
+def test_fast_path_serves_index_with_etag():
+    """
+    Test case for the in-memory index page: it matches the file and supports conditional requests.
+    """
+    fast_client = TestClient(RedirectFastPath(app, routes=[*app.routes, *endpoints.router.routes]))
+    response = fast_client.get("/")
+    assert response.status_code == 200
+    assert response.content == TestClient(app).get("/").content
+    assert response.headers["content-type"] == "text/html; charset=utf-8"
+
+    etag = response.headers["etag"]
+    assert fast_client.get("/", headers={"If-None-Match": etag}).status_code == 304
+    assert fast_client.get("/", headers={"If-None-Match": '"other", ' + etag}).status_code == 304
+    assert fast_client.get("/", headers={"If-None-Match": '"other"'}).status_code == 200
@@ -0,0 +1,48 @@
+from fastapi.testclient import TestClient
+
+from api import endpoints
+from db.database import Backends, Settings
+from db.sqlite import SQLiteStorage
+from main import app
+
+
+def test_backends_are_created_per_worker_and_closed_on_shutdown():
+    """
+    Test case for the lazy storage clients.
+    Importing the application connects nothing, startup creates the clients of the worker, a shortener
+    inherited from another process is replaced, and shutdown closes the clients and drops their metrics.
+    """
+    assert endpoints.backends is None and endpoints.shortener is None
+
+    with TestClient(app) as client:
+        backends = endpoints.backends
+        shortener = endpoints.shortener
+        assert set(vars(backends)) >= {'async_mongodb', 'async_memcache'}
+        assert 'mongodb' not in vars(backends) and 'memcache' not in vars(backends)
+        assert client.get("/").status_code == 200
+        assert shortener.collect in endpoints.metrics.collectors
+
+        # A worker forked after startup builds its own clients
+        backends.pid = -1
+        assert endpoints.get_shortener() is not shortener
+        assert endpoints.backends is not backends
+
+    assert endpoints.backends is None and endpoints.shortener is None
+    assert all(getattr(collector, '__self__', None) is not shortener for collector in endpoints.metrics.collectors)
+
+
+def test_backends_follow_their_settings():
+    """
+    Test case for building the clients from an explicit settings object.
+    """
+    backends = Backends(Settings(memcache_uri='127.0.0.1:11311,127.0.0.1:11312', analytics_enabled=True,
+                                 short_url_length=8))
+    assert list(backends.async_memcache.nodes) == ['127.0.0.1:11311', '127.0.0.1:11312']
+    assert backends.key_allocator.code_length == 8
+    assert backends.key_allocator.mongodb is backends.storage is backends.async_mongodb
+    assert backends.click_analytics.mongodb is backends.storage
+    assert backends.expiry_write_behind is None
+
+    backends = Backends(Settings(storage_backend='sqlite', sqlite_path=':memory:'))
+    assert isinstance(backends.key_allocator.mongodb, SQLiteStorage)
+    assert 'async_mongodb' not in vars(backends)
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from db.local_cache import LocalCache
+from processing.shortener import URLShortener
+from tests.fakes import FakeMemcache, FakeMongoDB
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_lru_eviction_and_expiry():
+    """
+    Test case for the local cache limits.
+    The tests cover LRU eviction, per-entry expiry and the maximum staleness.
+    """
+    clock = FakeClock()
+    cache = LocalCache(max_size=2, max_staleness=30, clock=clock)
+
+    cache.set("a", "A", expires_at=clock.now + 10)
+    cache.set("b", "B")
+    assert cache.get("a") == "A"  # "a" becomes the most recently used entry
+    cache.set("c", "C")
+    assert cache.get("b") is None
+    assert cache.stats()["evictions"] == 1
+
+    # "a" expires with its own expiry, "c" with the maximum staleness
+    clock.now += 11
+    assert cache.get("a") is None
+    assert cache.get("c") == "C"
+    clock.now += 20
+    assert cache.get("c") is None
+    assert cache.stats()["hits"] == 2
+
+
+def test_shortener_uses_local_cache():
+    """
+    Test case for the shortener with a local cache in front of Memcache.
+    Hot lookups must not reach Memcache, and a deletion must invalidate the local entry.
+    """
+    async def scenario():
+        mongodb, memcache = FakeMongoDB(), FakeMemcache()
+        shortener = URLShortener(mongodb, memcache, LocalCache())
+        short_url = await shortener.generate_short_url("https://gmail.com")
+
+        assert await shortener.get_original_url(short_url) == "https://gmail.com"
+        calls = memcache.calls
+        assert await shortener.get_original_url(short_url) == "https://gmail.com"
+        assert memcache.calls == calls
+
+        await shortener.delete_short_url(short_url)
+        with pytest.raises(ValueError):
+            await shortener.get_original_url(short_url)
+
+    asyncio.run(scenario())
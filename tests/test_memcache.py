@@ -0,0 +1,208 @@
+import asyncio
+import time
+
+from db.aiomemcache import MAX_RELATIVE_EXPIRATION, to_exptime
+from db.hash_ring import HashRing
+from db.memcache import AsyncMemcache
+from tests.fakes import MemcachedStandIn
+
+
+def test_async_memcache_round_trip():
+    """
+    Test case for the asyncio Memcache client against a local memcached stand-in.
+    The tests cover set, add, get, delete, incr, a missing key and a key memcached cannot store.
+    """
+    async def scenario():
+        server = await MemcachedStandIn().start()
+        memcache = AsyncMemcache(server.url)
+        try:
+            await memcache.set_cache("abc", "https://gmail.com", 60)
+            assert await memcache.get_cache("abc") == "https://gmail.com"
+            assert await memcache.get_cache("missing") is None
+
+            assert not await memcache.add_cache("abc", "https://other.com", 60)
+            assert await memcache.get_cache("abc") == "https://gmail.com"
+
+            await memcache.delete_cache("abc")
+            assert await memcache.get_cache("abc") is None
+            assert await memcache.add_cache("abc", "https://other.com", 60)
+            assert await memcache.get_cache("abc") == "https://other.com"
+
+            # A missing counter is created with its expiration time, then incremented in place
+            assert await memcache.incr_cache("counter", 3, 60) == 3
+            assert await memcache.incr_cache("counter", 2, 60) == 5
+            assert await memcache.get_cache("counter") == "5"
+            assert await memcache.incr_cache("has space", 1, 60) is None
+
+            # Keys with whitespace are ignored rather than corrupting the protocol stream
+            await memcache.set_cache("has space", "https://gmail.com", 60)
+            assert await memcache.get_cache("has space") is None
+        finally:
+            memcache.close_connection()
+            await server.stop()
+
+    asyncio.run(scenario())
+
+
+def test_async_memcache_concurrent_requests():
+    """
+    Test case for concurrent commands sharing the connection pool.
+    Every coroutine must read back its own value.
+    """
+    async def scenario():
+        server = await MemcachedStandIn().start()
+        memcache = AsyncMemcache(server.url)
+        try:
+            await asyncio.gather(*(memcache.set_cache(f"key{i}", f"value{i}", 60) for i in range(50)))
+            values = await asyncio.gather(*(memcache.get_cache(f"key{i}") for i in range(50)))
+            assert values == [f"value{i}" for i in range(50)]
+        finally:
+            memcache.close_connection()
+            await server.stop()
+
+    asyncio.run(scenario())
+
+
+def test_expiration_time_conversion():
+    """
+    Test case for converting relative expirations into memcached expiration times.
+    """
+    assert to_exptime(0) == 0
+    assert to_exptime(0.2) == 1
+    assert to_exptime(3600) == 3600
+    # Longer than 30 days must be sent as an absolute timestamp
+    assert abs(to_exptime(MAX_RELATIVE_EXPIRATION + 10) - (time.time() + MAX_RELATIVE_EXPIRATION + 10)) <= 2
+
+
+def test_hash_ring_remaps_one_nth_of_keys():
+    """
+    Test case for the consistent hash ring.
+    Keys spread evenly, and adding a fifth node only moves about a fifth of them, all to the new node.
+    """
+    keys = [f"key{i}" for i in range(10000)]
+    ring = HashRing([f"node{i}:11211" for i in range(4)])
+    grown = HashRing([f"node{i}:11211" for i in range(5)])
+
+    owners = [ring.get_node(key) for key in keys]
+    for node in ring.nodes:
+        assert 0.15 < owners.count(node) / len(keys) < 0.35
+
+    moved = [key for key, owner in zip(keys, owners) if grown.get_node(key) != owner]
+    assert 0.12 < len(moved) / len(keys) < 0.28
+    assert {grown.get_node(key) for key in moved} == {"node4:11211"}
+
+    # The failover order starts with the owner and visits every node once
+    assert list(ring.iter_nodes("abc"))[0] == ring.get_node("abc")
+    assert sorted(ring.iter_nodes("abc")) == sorted(ring.nodes)
+
+
+def test_async_memcache_multiple_nodes():
+    """
+    Test case for spreading keys over several memcached stand-ins.
+    Pipelined multi commands must reach every node.
+    """
+    async def scenario():
+        servers = [await MemcachedStandIn().start() for _ in range(3)]
+        memcache = AsyncMemcache(",".join(server.url for server in servers))
+        try:
+            items = [(f"key{i}", f"value{i}", 60) for i in range(300)]
+            await memcache.set_cache_multi(items)
+            assert all(server.values for server in servers)
+            assert sum(len(server.values) for server in servers) == 300
+
+            values = await memcache.get_cache_multi([key for key, _, _ in items] + ["missing"])
+            assert values == {key: value for key, value, _ in items}
+        finally:
+            memcache.close_connection()
+            for server in servers:
+                await server.stop()
+
+    asyncio.run(scenario())
+
+
+def test_async_memcache_failover():
+    """
+    Test case for a memcached node going down and coming back.
+    A single failure is retried on the next node, repeated failures make its keys fail over to the other node,
+    and it is used again as it is, without being flushed.
+    """
+    async def scenario():
+        servers = [await MemcachedStandIn().start() for _ in range(2)]
+        memcache = AsyncMemcache([server.url for server in servers], retry_interval=0.2, failure_threshold=3)
+        down = servers[0]
+        keys = [f"key{i}" for i in range(100) if memcache.ring.get_node(f"key{i}") == down.url]
+        key, kept = keys[0], keys[1]
+        try:
+            await memcache.set_cache(key, "old", 1)
+            await memcache.set_cache(kept, "kept", 60)
+            await down.stop()
+
+            assert await memcache.get_cache(key) is None
+            assert memcache.stats()["dead"] == []
+            assert await memcache.get_cache_multi([key]) == {}
+            await memcache.set_cache(key, "new", 60)
+            assert memcache.stats()["dead"] == [down.url]
+            assert {sample[3]["node"]: sample[4] for sample in memcache.collect()} == {down.url: 0, servers[1].url: 1}
+            assert await memcache.get_cache(key) == "new"
+            assert await memcache.get_cache_multi([key]) == {key: "new"}
+
+            # The node comes back with the values it held before failing, which expire on their own
+            await down.start()
+            await asyncio.sleep(0.25)
+            assert await memcache.get_cache(kept) == "kept"
+            assert await memcache.get_cache(key) == "old"
+            assert memcache.stats()["dead"] == [] and memcache.failures == {}
+            await asyncio.sleep(1)
+            assert await memcache.get_cache(key) is None
+        finally:
+            memcache.close_connection()
+            for server in servers:
+                await server.stop()
+
+    asyncio.run(scenario())
+
+
+def fail_once(client, operation: str) -> None:
+    """ Make the next call of an operation of a node client time out. """
+    original = getattr(client, operation)
+
+    async def failing(*args):
+        setattr(client, operation, original)
+        raise asyncio.TimeoutError()
+    setattr(client, operation, failing)
+
+
+def test_async_memcache_writes_do_not_fail_over_on_a_single_failure():
+    """
+    Test case for a write retried on its node after a single failure instead of landing on the next node,
+    and for deletions and tombstones reaching every node a read may fail over to.
+    """
+    async def scenario():
+        servers = [await MemcachedStandIn().start() for _ in range(2)]
+        memcache = AsyncMemcache([server.url for server in servers], failure_threshold=3)
+        owner, other = (server.url for server in servers)
+        key = next(f"key{i}" for i in range(100) if memcache.ring.get_node(f"key{i}") == owner)
+        try:
+            await memcache.set_cache(key, "mapping", 60)
+            await memcache.set_cache("~" + key, "stale", 60)
+            # The next node kept a value from an earlier failure of the owner
+            await memcache._call(other, "set", key, b"older", 0)
+
+            fail_once(memcache.nodes[owner], "delete")
+            await memcache.delete_cache(key)
+            fail_once(memcache.nodes[owner], "set")
+            await memcache.set_cache("~" + key, "tombstone", 60, all_nodes=True)
+            for server in servers:
+                assert key.encode() not in server.values
+                assert server.values[("~" + key).encode()][0] == b"tombstone"
+
+            fail_once(memcache.nodes[owner], "set")
+            await memcache.set_cache(key, "new", 60)
+            assert await memcache.get_cache(key) == "new" and key.encode() not in servers[1].values
+            assert memcache.stats()["dead"] == [] and memcache.failures == {}
+        finally:
+            memcache.close_connection()
+            for server in servers:
+                await server.stop()
+
+    asyncio.run(scenario())
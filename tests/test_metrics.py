@@ -0,0 +1,60 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from api import endpoints
+from main import app
+from processing.metrics import MetricsRegistry
+from processing.shortener import URLShortener
+from tests.fakes import FakeMemcache, FakeMongoDB
+
+client = TestClient(app)
+
+# The request middleware keeps the registry it was created with
+http_metrics = endpoints.metrics
+
+
+@pytest.fixture(autouse=True)
+def shortener(monkeypatch):
+    """ Serve the endpoints from in-process storage stand-ins with a fresh registry. """
+    metrics = MetricsRegistry()
+    shortener = URLShortener(FakeMongoDB(), FakeMemcache(), metrics=metrics)
+    monkeypatch.setattr(endpoints, "metrics", metrics)
+    monkeypatch.setattr(endpoints, "shortener", shortener)
+    return shortener
+
+
+def test_registry_exposition():
+    """
+    Test case for rendering counters and histograms in the Prometheus text format.
+    """
+    clock = iter([1.0, 1.003])
+    metrics = MetricsRegistry(clock=lambda: next(clock))
+    metrics.counter("requests_total", "Requests.", ("endpoint",)).inc('GET "/"')
+    with metrics.histogram("stage_seconds", "Stages.", ("stage",), buckets=(0.001, 0.01)).labels("find").time():
+        pass
+
+    exposition = metrics.render()
+    assert 'requests_total{endpoint="GET \\"/\\""} 1' in exposition
+    assert 'stage_seconds_bucket{stage="find",le="0.001"} 0' in exposition
+    assert 'stage_seconds_bucket{stage="find",le="0.01"} 1' in exposition
+    assert 'stage_seconds_bucket{stage="find",le="+Inf"} 1' in exposition
+    assert 'stage_seconds_count{stage="find"} 1' in exposition
+
+
+def test_metrics_endpoint(shortener):
+    """
+    Test case for the metrics endpoint after a shorten, a redirect and a lookup of a missing short URL.
+    Stage latencies and lookup outcomes must be labelled with the endpoint that caused them.
+    """
+    short_url = client.post("/shorten/", json={"original_url": "https://gmail.com"}).json()["short_url"]
+    shortener.memcache.values.clear()
+    client.get(short_url.rsplit('/', 1)[-1], follow_redirects=False)
+    client.get("/shorten/?short_url=missing")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    exposition = response.text
+    assert 'url_shortener_stage_seconds_count{operation="generate_short_url",stage="mongo_insert"} 1' in exposition
+    assert 'url_shortener_lookup_results_total{endpoint="GET /{short_url}",result="cache_miss"} 1' in exposition
+    assert 'url_shortener_lookup_results_total{endpoint="GET /shorten/",result="not_found"} 1' in exposition
+    assert 'http_request_duration_seconds_count{endpoint="GET /{short_url}",status="307"}' in http_metrics.render()
@@ -0,0 +1,117 @@
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from pymongo.errors import OperationFailure
+
+from db.migrations import backfill_url_digests
+from db.mongodb import check_expiration, match_original_urls, short_url_indexes, with_expiry_filter
+from processing.canonical_url import canonicalize_url, url_digest
+
+
+def test_short_url_indexes():
+    """
+    Test case for the index specification of the short URL collection.
+    The TTL index must be optional, the short URL index unique.
+    """
+    indexes = {index.document["name"]: index.document for index in short_url_indexes(60)}
+    assert indexes["short_url_unique"]["unique"] is True
+    assert indexes["original_url_digest"]["key"] == {"original_url_digest": 1}
+    assert indexes["expiration_date_ttl"]["expireAfterSeconds"] == 60
+
+    assert "expiration_date_ttl" not in {index.document["name"] for index in short_url_indexes(None)}
+
+
+def test_expiry_filter():
+    """
+    Test case for pushing the expiry check into the query filter.
+    """
+    assert with_expiry_filter({"short_url": "abc"}, False, False) == {"short_url": "abc"}
+    assert with_expiry_filter({"short_url": "abc"}, True, True) == {"short_url": "abc"}
+    criteria = with_expiry_filter({"short_url": "abc"}, True, False)
+    assert set(criteria) == {"short_url", "expiration_date"}
+
+
+def test_expiration_dates_are_utc(monkeypatch):
+    """
+    Test case for comparing expiration dates in UTC, as the TTL index does, whatever the local time zone.
+    """
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    try:
+        cutoff = with_expiry_filter({"short_url": "abc"}, True, False)["expiration_date"]["$gt"]
+        assert cutoff.utcoffset() == timedelta(0)
+        assert abs(cutoff - datetime.now(timezone.utc)) < timedelta(seconds=5)
+        soon = {"short_url": "abc", "expiration_date": datetime.now(timezone.utc) + timedelta(minutes=30)}
+        assert check_expiration(soon) is soon
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+
+def test_canonical_url_and_digest():
+    """
+    Test case for the canonical form of original URLs.
+    Spellings differing in case, default port, trailing slash or query order share a canonical form and digest.
+    """
+    spellings = ["https://Example.com:443/a/?b=2&a=1", "HTTPS://example.com/a?a=1&b=2",
+                 "https://example.com/a/?a=1&b=2"]
+    assert {canonicalize_url(url) for url in spellings} == {"https://example.com/a?a=1&b=2"}
+    assert len({url_digest(url) for url in spellings}) == 1
+    assert len(url_digest(spellings[0])) == 16
+
+    assert canonicalize_url("http://example.com") == "http://example.com/"
+    assert canonicalize_url("http://user:Pw@[::1]:8080/A#Frag") == "http://user:Pw@[::1]:8080/A#Frag"
+    assert canonicalize_url("https://example.com/a") != canonicalize_url("https://example.com/A")
+    assert canonicalize_url("http://example.com:443/") != canonicalize_url("https://example.com/")
+
+    # A digest collision or an expired mapping is not a match
+    future, past = datetime.now(timezone.utc) + timedelta(hours=1), datetime.now(timezone.utc) - timedelta(hours=1)
+    url_docs = [{"original_url": "https://other.com/", "expiration_date": future},
+                {"original_url": "https://example.com/a?b=2&a=1", "expiration_date": past},
+                {"original_url": "https://example.com/a?a=1&b=2", "expiration_date": future}]
+    assert match_original_urls(url_docs, spellings) == {url: url_docs[2] for url in spellings}
+
+
+class FakeCollection:
+    """ The part of a pymongo collection used by the digest backfill. """
+
+    def __init__(self, documents: list[dict]) -> None:
+        self.documents = {document["_id"]: document for document in documents}
+        self.indexes = {"original_url_hashed"}
+        self.writes = 0
+
+    def create_indexes(self, indexes) -> None:
+        self.indexes.update(index.document["name"] for index in indexes)
+
+    def drop_index(self, name: str) -> None:
+        if name not in self.indexes:
+            raise OperationFailure(f"index not found with name [{name}]")
+        self.indexes.remove(name)
+
+    def find(self, criteria: dict, projection: dict, batch_size: int):
+        missing = [document for document in self.documents.values() if "original_url_digest" not in document]
+        return SimpleNamespace(sort=lambda key: iter(sorted(missing, key=lambda document: document[key])))
+
+    def bulk_write(self, requests, ordered: bool):
+        self.writes += 1
+        for request in requests:
+            self.documents[request._filter["_id"]].update(request._doc["$set"])
+        return SimpleNamespace(modified_count=len(requests))
+
+
+def test_backfill_url_digests():
+    """
+    Test case for the migration adding digests to documents created before them.
+    """
+    collection = FakeCollection([{"_id": n, "original_url": f"https://example.com/{n}"} for n in range(5)])
+    collection.documents[2]["original_url_digest"] = url_digest("https://example.com/2")
+
+    assert backfill_url_digests(collection, batch_size=2) == 4
+    assert collection.writes == 2
+    assert all(document["original_url_digest"] == url_digest(document["original_url"])
+               for document in collection.documents.values())
+    assert collection.indexes == {"original_url_digest"}
+
+    # A second run finds nothing left to do
+    assert backfill_url_digests(collection, batch_size=2) == 0
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api import endpoints
+from api.rate_limit import RateLimitMiddleware
+from main import app
+from processing.rate_limit import RateLimiter
+from processing.shortener import URLShortener
+from tests.fakes import FakeMemcache, FakeMongoDB
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_token_buckets_per_budget_and_client():
+    """
+    Test case for separate buckets per budget and client, refilled at their rate up to their burst,
+    the time to wait when one is empty, capped costs, disabled budgets and the bound on tracked clients.
+    """
+    clock = Clock()
+    limiter = RateLimiter(FakeMemcache(), {'shorten': (2, 3), 'redirect': (100, 100), 'resolve': (0, 0)},
+                          max_clients=3, clock=clock)
+
+    assert [limiter.check('shorten', 'ip:a') for _ in range(3)] == [None, None, None]
+    assert limiter.check('shorten', 'ip:a') == pytest.approx(0.5)
+    assert limiter.check('redirect', 'ip:a') is None
+    assert limiter.check('shorten', 'ip:b') is None
+    assert all(limiter.check('resolve', 'ip:a') is None for _ in range(1000))
+
+    clock.now += 1
+    assert limiter.check('shorten', 'ip:a') is None and limiter.check('shorten', 'ip:a') is None
+    assert limiter.check('shorten', 'ip:a') is not None
+    # A batch larger than the burst is charged as the burst
+    assert limiter.check('shorten', 'ip:c', cost=50) is None and limiter.check('shorten', 'ip:c') is not None
+    assert limiter.allowed == {'shorten': 7, 'redirect': 1} and limiter.rejected == {'shorten': 3, 'redirect': 0}
+
+    # The least recently seen client is dropped, and starts again from a full bucket
+    assert list(limiter.buckets) == [('shorten', 'ip:b'), ('shorten', 'ip:a'), ('shorten', 'ip:c')]
+    assert all(limiter.check('redirect', 'ip:a') is None for _ in range(100))
+
+
+def test_shared_budget_across_workers():
+    """
+    Test case for workers reconciling the requests they admitted through Memcache and rejecting a client
+    whose requests over all workers exhausted the window, until the window ends.
+    """
+    async def scenario():
+        clock, memcache = Clock(), FakeMemcache()
+        workers = [RateLimiter(memcache, {'shorten': (1, 5)}, window=10, clock=clock) for _ in range(2)]
+        for worker in workers:
+            assert all(worker.check('shorten', 'key:k') is None for _ in range(5))
+            await worker.sync()
+        # Both workers refilled their buckets, and 10 requests are still under the 15 of the window
+        clock.now += 4
+        for worker in workers:
+            assert all(worker.check('shorten', 'key:k') is None for _ in range(3))
+        await workers[0].sync()
+        assert memcache.values[f'rate_limit:shorten:key:k:{int(clock.now // 10)}'][0] == '13'
+        assert workers[0].check('shorten', 'key:k') is None
+
+        await workers[1].sync()
+        assert workers[1].blocked
+        clock.now += 1
+        assert workers[1].check('shorten', 'key:k') == pytest.approx(5)
+        assert workers[1].check('shorten', 'key:other') is None
+        await workers[0].sync()
+        assert workers[0].check('shorten', 'key:k') == pytest.approx(5)
+
+        # The next window starts from a clean slate
+        clock.now += 5
+        assert workers[0].check('shorten', 'key:k') is None
+        await workers[0].sync()
+        assert not workers[0].blocked
+
+    asyncio.run(scenario())
+
+
+def test_requests_over_budget_are_answered_429(monkeypatch):
+    """
+    Test case for the middleware charging shorten and redirect requests to separate budgets per API key
+    or IP address, answering 429 with Retry-After, leaving other routes alone and charging batches per URL.
+    """
+    limited_app = RateLimitMiddleware(app, routes=[*app.routes, *endpoints.router.routes],
+                                      api_keys=["secret", "batch"])
+    limiter = RateLimiter(FakeMemcache(), {'shorten': (0.01, 3), 'redirect': (0.01, 5)})
+    monkeypatch.setattr(endpoints, "shortener", URLShortener(FakeMongoDB(), FakeMemcache()))
+    monkeypatch.setattr(endpoints, "rate_limiter", limiter)
+
+    with TestClient(limited_app) as client:
+        short_urls = [client.post("/shorten/", json={"original_url": f"https://example.com/{i}"}).json()["short_url"]
+                      for i in range(3)]
+        response = client.post("/shorten/", json={"original_url": "https://example.com/4"})
+        assert response.status_code == 429
+        assert 90 <= int(response.headers["retry-after"]) <= 100
+        assert response.json() == {"detail": "Too many shorten requests, retry later"}
+
+        # Another API key, and redirects of the same client, have budgets of their own
+        assert client.post("/shorten/", json={"original_url": "https://example.com/4"},
+                           headers={"X-API-Key": "secret"}).status_code == 200
+        path = '/' + short_urls[0].rsplit('/', 1)[-1]
+        statuses = [client.get(path, follow_redirects=False).status_code for _ in range(6)]
+        assert statuses == [307] * 5 + [429]
+        assert client.get("/metrics").status_code == 200
+        assert client.get("/docs").status_code == 200
+
+        # A batch is charged one request per URL
+        response = client.post("/shorten/batch", json={"original_urls": ["https://example.com/5"] * 2},
+                               headers={"X-API-Key": "batch"})
+        assert response.status_code == 200
+        response = client.post("/shorten/batch", json={"original_urls": ["https://example.com/6"] * 2},
+                               headers={"X-API-Key": "batch"})
+        assert response.status_code == 429 and "retry-after" in response.headers
+
+    # API keys are only kept as digests
+    assert ('shorten', 'ip:testclient') in limiter.buckets
+    assert not any('secret' in client for _, client in limiter.buckets)
+
+
+def test_made_up_api_keys_are_throttled_by_address(monkeypatch):
+    """
+    Test case for a client rotating unknown API keys, which is limited by its IP address and cannot
+    push the buckets of other clients out.
+    """
+    limited_app = RateLimitMiddleware(app, routes=[*app.routes, *endpoints.router.routes], api_keys=["secret"])
+    limiter = RateLimiter(FakeMemcache(), {'shorten': (0.01, 3)}, max_clients=2)
+    monkeypatch.setattr(endpoints, "shortener", URLShortener(FakeMongoDB(), FakeMemcache()))
+    monkeypatch.setattr(endpoints, "rate_limiter", limiter)
+
+    with TestClient(limited_app) as client:
+        assert client.post("/shorten/", json={"original_url": "https://example.com/0"},
+                           headers={"X-API-Key": "secret"}).status_code == 200
+        statuses = [client.post("/shorten/", json={"original_url": f"https://example.com/{i}"},
+                                headers={"X-API-Key": f"made-up-{i}"}).status_code for i in range(10)]
+        assert statuses == [200] * 3 + [429] * 7
+
+    assert len(limiter.buckets) == 2 and ('shorten', 'ip:testclient') in limiter.buckets
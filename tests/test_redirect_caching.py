@@ -0,0 +1,93 @@
+from email.utils import parsedate_to_datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api import endpoints
+from api.fast_path import RedirectFastPath
+from api.redirect_policy import RedirectPolicy
+from main import app
+from processing.shortener import OriginalURL, StaleOriginalURL, URLShortener
+from tests.fakes import CachingProxy, FakeMemcache, FakeMongoDB
+
+
+def test_policy_derives_caching_from_the_remaining_lifetime():
+    """
+    Test case for caching stable links for their remaining lifetime up to the cap, and never caching
+    short-lived links, links of unknown lifetime or stale ones.
+    """
+    policy = RedirectPolicy(308, max_age=3600, min_lifetime=300, clock=lambda: 1000000.0)
+
+    status, headers = policy.redirect(OriginalURL('https://example.com', 1000000.0 + 86400))
+    headers = dict(headers)
+    assert status == 308 and headers[b'cache-control'] == b'public, max-age=3600'
+    assert parsedate_to_datetime(headers[b'expires'].decode()).timestamp() == 1000000.0 + 3600
+
+    status, headers = policy.redirect(OriginalURL('https://example.com', 1000000.0 + 1800.5))
+    assert dict(headers)[b'cache-control'] == b'public, max-age=1800'
+
+    for original_url in (OriginalURL('https://example.com', 1000000.0 + 60), 'https://example.com',
+                         StaleOriginalURL('https://example.com')):
+        assert policy.redirect(original_url) == (307, [(b'cache-control', b'no-store')])
+    assert policy.not_found() == [(b'cache-control', b'no-store')]
+
+    # Without a maximum age redirects are sent as they were, without caching headers
+    disabled = RedirectPolicy()
+    assert disabled.redirect(OriginalURL('https://example.com', 1000000.0 + 86400)) == (307, [])
+    assert disabled.not_found() == []
+    with pytest.raises(ValueError):
+        RedirectPolicy(200)
+
+
+@pytest.mark.parametrize('fast_path', [False, True])
+def test_caching_proxy_offloads_the_origin(monkeypatch, fast_path):
+    """
+    Test case for a caching proxy in front of the application answering repeated clicks on a stable link
+    itself, while short-lived links keep reaching the origin and a deletion purges the cached redirect.
+    """
+    origin = RedirectFastPath(app, routes=[*app.routes, *endpoints.router.routes]) if fast_path else app
+    proxy = CachingProxy(origin)
+    mongodb = FakeMongoDB()
+    monkeypatch.setattr(endpoints, "shortener", URLShortener(mongodb, FakeMemcache(), purge=proxy.purge))
+    monkeypatch.setattr(endpoints, "redirect_policy", RedirectPolicy(301, max_age=3600, min_lifetime=7200))
+
+    with TestClient(proxy) as client:
+        stable = client.post("/shorten/", json={"original_url": "https://example.com/stable",
+                                                "expiration_in_hrs": 72}).json()["short_url"]
+        short_lived = client.post("/shorten/", json={"original_url": "https://example.com/short-lived",
+                                                     "expiration_in_hrs": 1}).json()["short_url"]
+        stable_path, short_lived_path = '/' + stable.rsplit('/', 1)[-1], '/' + short_lived.rsplit('/', 1)[-1]
+
+        for _ in range(50):
+            response = client.get(stable_path, follow_redirects=False)
+            assert response.status_code == 301
+            assert response.headers["location"] == "https://example.com/stable"
+        assert response.headers["cache-control"] == "public, max-age=3600" and "expires" in response.headers
+        assert proxy.origin_requests == 1
+
+        for _ in range(50):
+            response = client.get(short_lived_path, follow_redirects=False)
+        assert response.status_code == 302 and response.headers["cache-control"] == "no-store"
+        assert proxy.origin_requests == 51
+
+        # Deleting the link purges its cached redirect, and the not found answer is not cached either
+        assert client.request("DELETE", "/shorten/", json={"short_url": stable}).status_code == 200
+        for _ in range(3):
+            response = client.get(stable_path, follow_redirects=False)
+            assert response.status_code == 404 and response.headers["cache-control"] == "no-store"
+        assert proxy.origin_requests == 54
+
+
+def test_caching_proxy_without_caching_headers(monkeypatch):
+    """
+    Test case for the default policy, under which every click reaches the origin as before.
+    """
+    proxy = CachingProxy(app)
+    monkeypatch.setattr(endpoints, "shortener", URLShortener(FakeMongoDB(), FakeMemcache()))
+    monkeypatch.setattr(endpoints, "redirect_policy", RedirectPolicy())
+    with TestClient(proxy) as client:
+        short_url = client.post("/shorten/", json={"original_url": "https://example.com"}).json()["short_url"]
+        for _ in range(20):
+            response = client.get('/' + short_url.rsplit('/', 1)[-1], follow_redirects=False)
+        assert response.status_code == 307 and "cache-control" not in response.headers
+        assert proxy.origin_requests == 20
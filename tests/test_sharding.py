@@ -0,0 +1,169 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from db.database import Backends, Settings
+from db.rebalance import rebalance
+from db.sharding import ShardedStorage, parse_shard_layout, parse_shard_uris
+from processing.shortener import URLShortener
+from tests.fakes import FakeMemcache, FakeMongoDB
+
+
+def make_shards(*names: str) -> dict[str, FakeMongoDB]:
+    return {name: FakeMongoDB() for name in names}
+
+
+def test_documents_are_routed_to_their_shards():
+    """
+    Test case for placing a document on the shard of its short URL and a copy on the shard of its original URL,
+    so that either lookup touches a single shard.
+    """
+    async def scenario():
+        shards = make_shards('a', 'b', 'c', 'd')
+        storage = ShardedStorage(shards)
+        future = datetime.now(timezone.utc) + timedelta(hours=1)
+        url_docs = [{'short_url': f'code{i}', 'original_url': f'https://example.com/{i}', 'expiration_date': future}
+                    for i in range(200)]
+        assert await storage.insert_short_urls(url_docs) == [None] * 200
+
+        for url_doc in url_docs:
+            holders = {name for name, shard in shards.items() if url_doc['short_url'] in shard.documents}
+            assert holders == storage.holders(url_doc)
+        assert all(len(shard.documents) > 30 for shard in shards.values())
+
+        calls = {name: shard.calls for name, shard in shards.items()}
+        assert (await storage.lookup_by_short_url('code7'))['original_url'] == 'https://example.com/7'
+        assert (await storage.lookup_by_original_url('https://EXAMPLE.com/7/'))['short_url'] == 'code7'
+        assert sum(shard.calls for shard in shards.values()) - sum(calls.values()) == 2
+
+        # A single query per shard for a batch
+        calls = {name: shard.calls for name, shard in shards.items()}
+        found = await storage.lookup_by_short_urls([url_doc['short_url'] for url_doc in url_docs])
+        assert len(found) == 200
+        assert all(shard.calls - calls[name] == 1 for name, shard in shards.items())
+
+        # Updates and deletions reach the copies too, and only the shards owning them after a lookup
+        owners = storage.holders(url_docs[7])
+        calls = {name: shard.calls for name, shard in shards.items()}
+        await storage.update_expiration_date('code7', future + timedelta(days=1))
+        touched = {name for name, shard in shards.items() if shard.calls > calls[name]}
+        assert touched == owners | {storage.primary_shard('code7')}
+        assert sum(shard.calls for shard in shards.values()) - sum(calls.values()) == 1 + len(owners)
+        assert all(shard.documents['code7']['expiration_date'] == future + timedelta(days=1)
+                   for shard in shards.values() if 'code7' in shard.documents)
+        await storage.delete_short_url('code7')
+        assert not any('code7' in shard.documents for shard in shards.values())
+        assert await storage.lookup_by_original_url('https://example.com/7') is None
+
+    asyncio.run(scenario())
+
+
+def test_shortener_on_shards():
+    """
+    Test case for the shortener deduplicating and resolving short URLs spread across shards, unchanged.
+    """
+    async def scenario():
+        shards = make_shards('a', 'b', 'c')
+        shortener = URLShortener(ShardedStorage(shards), FakeMemcache())
+        short_urls = await shortener.generate_short_urls([f'https://example.com/{i}' for i in range(50)])
+        assert await shortener.generate_short_url('https://example.com/7') == short_urls[7]
+        shortener.memcache.values.clear()
+        assert await shortener.get_original_url(short_urls[7]) == 'https://example.com/7'
+        # The counters only live on the first shard
+        assert shards['a'].counters and not shards['b'].counters and not shards['c'].counters
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize('previous_names, names', [(('a', 'b'), ('a', 'b', 'c')), (('a', 'b', 'c'), ('a', 'c'))])
+def test_rebalance_adds_and_removes_shards(previous_names, names):
+    """
+    Test case for moving documents after a shard is added or removed, while lookups keep working.
+    """
+    async def scenario():
+        shards = make_shards(*dict.fromkeys(previous_names + names))
+        old = ShardedStorage({name: shards[name] for name in previous_names})
+        future = datetime.now(timezone.utc) + timedelta(hours=1)
+        url_docs = [{'short_url': f'code{i}', 'original_url': f'https://example.com/{i}', 'expiration_date': future}
+                    for i in range(300)]
+        await old.insert_short_urls(url_docs)
+
+        # During the move, documents are found where they were
+        moving = ShardedStorage({name: shards[name] for name in names},
+                                {name: shards[name] for name in previous_names})
+        assert (await moving.lookup_by_short_url('code1'))['short_url'] == 'code1'
+        assert len(await moving.lookup_by_short_urls([url_doc['short_url'] for url_doc in url_docs])) == 300
+        assert len(await moving.lookup_by_original_urls([url_doc['original_url'] for url_doc in url_docs])) == 300
+
+        stats = await rebalance(moving.shards, moving.previous_shards, batch_size=16)
+        assert stats['scanned'] >= 300 and stats['copied'] and stats['deleted']
+
+        new = ShardedStorage({name: shards[name] for name in names})
+        for url_doc in url_docs:
+            holders = {name for name, shard in shards.items() if url_doc['short_url'] in shard.documents}
+            assert holders == new.holders(url_doc)
+        assert [url_data['short_url'] async for url_data in new.scan_short_urls()] == sorted(
+            url_doc['short_url'] for url_doc in url_docs)
+        assert len(await new.lookup_by_original_urls([url_doc['original_url'] for url_doc in url_docs])) == 300
+
+        # Running it again finds nothing to move
+        again = await rebalance(moving.shards, moving.previous_shards, batch_size=16)
+        assert again['copied'] == again['deleted'] == 0
+
+    asyncio.run(scenario())
+
+
+def test_first_shard_cannot_change():
+    """
+    Test case for refusing a move that would lose the sequence counters.
+    """
+    with pytest.raises(ValueError, match="first shard"):
+        ShardedStorage(make_shards('b', 'a'), make_shards('a', 'b'))
+
+
+def test_updates_reach_both_layouts_during_rebalance():
+    """
+    Test case for updates and deletions reaching the shards owning a document in the new layout and in the
+    layout it is moved from, before the rebalance copied it.
+    """
+    async def scenario():
+        shards = make_shards('a', 'b', 'c', 'd')
+        old = ShardedStorage({name: shards[name] for name in 'ab'})
+        future = datetime.now(timezone.utc) + timedelta(hours=1)
+        url_docs = [{'short_url': f'code{i}', 'original_url': f'https://example.com/{i}', 'expiration_date': future}
+                    for i in range(100)]
+        await old.insert_short_urls(url_docs)
+        moving = ShardedStorage(shards, {name: shards[name] for name in 'ab'})
+        moved = [url_doc['short_url'] for url_doc in url_docs if moving.holders(url_doc) != old.holders(url_doc)]
+        assert moved
+
+        await moving.extend_expiration_dates({short_url: future + timedelta(days=1) for short_url in moved})
+        assert all(shard.documents[short_url]['expiration_date'] == future + timedelta(days=1)
+                   for shard in shards.values() for short_url in moved if short_url in shard.documents)
+        await moving.delete_short_urls(moved)
+        assert not any(short_url in shard.documents for shard in shards.values() for short_url in moved)
+
+    asyncio.run(scenario())
+
+
+def test_shard_names():
+    """
+    Test case for naming shards explicitly or by position, so the hash ring does not depend on their URIs.
+    """
+    assert parse_shard_uris(['eu=mongodb://user:secret@a/?replicaSet=rs0', 'mongodb://b/?w=1']) == {
+        'eu': 'mongodb://user:secret@a/?replicaSet=rs0', 'shard1': 'mongodb://b/?w=1'}
+    # Changing the credentials or the host of a shard keeps the short URLs where they are
+    layouts = [Backends(Settings(mongodb_shard_uris=(f'a=mongodb://user:{password}@{host}/', 'b=mongodb://b/')))
+               for password, host in (('old', 'a1'), ('new', 'a2'))]
+    before, after = (backends.sharded_mongodb for backends in layouts)
+    assert list(before.shards) == ['a', 'b']
+    assert all(before.primary_shard(f'code{i}') == after.primary_shard(f'code{i}') for i in range(100))
+
+    with pytest.raises(ValueError, match="Duplicate"):
+        parse_shard_uris(['a=mongodb://a/', 'a=mongodb://b/'])
+    # Removing the second of three unnamed shards would give the third one the name of the second
+    with pytest.raises(ValueError, match="name the shards"):
+        parse_shard_layout(['mongodb://a/', 'mongodb://c/'], ['mongodb://a/', 'mongodb://b/', 'mongodb://c/'])
+    assert parse_shard_layout(['a=mongodb://a/', 'c=mongodb://c/'],
+                              ['a=mongodb://a/', 'b=mongodb://b/', 'c=mongodb://c/'])[1]['b'] == 'mongodb://b/'
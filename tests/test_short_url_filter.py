@@ -0,0 +1,150 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from processing.allocator import KeyAllocator
+from processing.bloom import BloomFilter
+from processing.short_url_filter import IMPORT_LEASE, INSERT_MARGIN, ShortURLFilter
+from processing.shortener import URLShortener
+from tests.fakes import FakeMemcache, FakeMongoDB
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_bloom_filter_false_positive_rate_and_memory():
+    """
+    Test case for a Bloom filter never missing an added key and staying near its false positive rate.
+    """
+    bloom = BloomFilter(10000, 0.01)
+    for i in range(10000):
+        bloom.add(f'key{i}')
+    assert all(f'key{i}' in bloom for i in range(10000))
+    false_positives = sum(f'other{i}' in bloom for i in range(20000))
+    assert false_positives / 20000 < 0.02
+    assert bloom.memory < 10000 * 10 / 8 * 1.05
+    assert bloom.error_rate == pytest.approx(0.01, rel=0.2)
+
+
+def test_unknown_short_urls_are_rejected_without_backend_calls():
+    """
+    Test case for rejecting probed paths, codes far beyond the counter and codes below the lower bound
+    of the filter, while issued codes, including ones issued by another worker after the build, pass.
+    """
+    async def scenario():
+        mongodb, clock = FakeMongoDB(), Clock()
+        mine = KeyAllocator(mongodb, block_size=10, max_block_age=60)
+        other = KeyAllocator(mongodb, block_size=10, max_block_age=60)
+        old = [await mine.allocate() for _ in range(25)]
+        future = datetime.now(timezone.utc) + timedelta(hours=1)
+        await mongodb.insert_short_urls([{'short_url': short_url, 'original_url': 'https://example.com',
+                                          'expiration_date': future} for short_url in old])
+
+        code_filter = ShortURLFilter(mongodb, mine, sequence_headroom=1000, clock=clock)
+        await code_filter.rebuild()
+        assert code_filter.bloom.count == 25
+        calls = mongodb.calls
+        assert all(code_filter.may_exist(short_url) for short_url in old)
+        assert not code_filter.may_exist('favicon.ico')
+        assert not code_filter.may_exist(mine.encode(50000))
+        assert mongodb.calls == calls
+
+        # Another worker issues codes after the build, the filter has no lower bound yet
+        issued = [await other.allocate() for _ in range(15)]
+        assert all(code_filter.may_exist(short_url) for short_url in issued)
+
+        # Once every block in use was leased after the first build, its codes are below the bound
+        clock.now += 60 + INSERT_MARGIN
+        await code_filter.rebuild()
+        counter = mongodb.counters['short_url']
+        assert 0 < code_filter.lower_bound <= counter
+        unused = [allocator.encode(sequence) for allocator in (mine, other)
+                  for sequence in range(code_filter.lower_bound) if allocator.encode(sequence) not in old + issued]
+        assert unused and not any(code_filter.may_exist(short_url) for short_url in unused)
+        assert all(code_filter.may_exist(short_url) for short_url in old + issued)
+        assert code_filter.may_exist(mine.encode(counter + 5))
+
+        # A counter that was not read for a while no longer rejects codes beyond it
+        clock.now += 3600
+        assert code_filter.may_exist(mine.encode(50000))
+
+    asyncio.run(scenario())
+
+
+def test_codes_issued_while_building_are_kept():
+    """
+    Test case for codes issued by the worker itself before and during a build surviving the swap.
+    """
+    async def scenario():
+        mongodb = FakeMongoDB()
+        allocator = KeyAllocator(mongodb, block_size=10)
+        code_filter = ShortURLFilter(mongodb, allocator)
+        code_filter.add('early')
+        code_filter.building = True
+        code_filter.add('during')
+        code_filter.building = False
+        await code_filter.rebuild()
+        assert 'early' in code_filter.bloom and 'during' in code_filter.bloom and not code_filter.recent
+
+    asyncio.run(scenario())
+
+
+def test_imported_short_urls_are_looked_up_until_the_next_build():
+    """
+    Test case for a filter rejecting nothing while an import holds its lease, then rebuilding once it ended.
+    """
+    async def scenario():
+        mongodb, clock = FakeMongoDB(), Clock()
+        allocator = KeyAllocator(mongodb, block_size=10, max_block_age=60)
+        code_filter = ShortURLFilter(mongodb, allocator, sequence_headroom=1000, counter_interval=0.01, clock=clock)
+        code_filter.start()
+        await asyncio.sleep(0.05)
+        assert code_filter.builds == 1
+        assert not code_filter.may_exist('imported') and not code_filter.may_exist(allocator.encode(50000))
+
+        mongodb.counters[IMPORT_LEASE] = int(clock.now) + 60
+        await mongodb.insert_short_url('imported', 'https://example.com',
+                                       datetime.now(timezone.utc) + timedelta(hours=1))
+        await asyncio.sleep(0.05)
+        assert code_filter.may_exist('imported') and code_filter.may_exist(allocator.encode(50000))
+        assert code_filter.builds == 1
+
+        clock.now += 61
+        await asyncio.sleep(0.05)
+        await code_filter.stop()
+        assert code_filter.builds == 2
+        assert code_filter.may_exist('imported') and not code_filter.may_exist('other')
+
+    asyncio.run(scenario())
+
+
+def test_shortener_answers_filtered_lookups_without_io():
+    """
+    Test case for the shortener reporting a rejected short URL as not found without reaching Memcache or MongoDB.
+    """
+    async def scenario():
+        mongodb, memcache = FakeMongoDB(), FakeMemcache()
+        allocator = KeyAllocator(mongodb, block_size=10, max_block_age=600)
+        code_filter = ShortURLFilter(mongodb, allocator)
+        shortener = URLShortener(mongodb, memcache, allocator=allocator, code_filter=code_filter)
+        await code_filter.rebuild()
+        short_url = await shortener.generate_short_url('https://example.com/new')
+
+        calls = (mongodb.calls, memcache.calls)
+        with pytest.raises(ValueError, match="not found"):
+            await shortener.get_original_url('wp-login')
+        found = await shortener.get_original_urls(['wp-login', allocator.encode(10 ** 9)])
+        assert all(isinstance(result, ValueError) for result in found)
+        assert (mongodb.calls, memcache.calls) == calls
+        assert code_filter.rejected == 3
+
+        memcache.values.clear()
+        assert await shortener.get_original_url(short_url) == 'https://example.com/new'
+
+    asyncio.run(scenario())
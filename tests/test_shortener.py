@@ -0,0 +1,156 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from processing.allocator import KeyAllocator
+from processing.shortener import URLShortener
+from tests.fakes import FakeMemcache, FakeMongoDB
+
+
+def test_generate_and_resolve_short_url():
+    """
+    Test case for the shortener against in-process storage stand-ins.
+    The tests cover shortening, re-shortening the same URL, resolving and deleting.
+    """
+    async def scenario():
+        mongodb, memcache = FakeMongoDB(), FakeMemcache()
+        shortener = URLShortener(mongodb, memcache)
+
+        short_url = await shortener.generate_short_url("https://gmail.com", 1)
+        assert await shortener.generate_short_url("https://gmail.com", 5) == short_url
+        assert mongodb.documents[short_url]["expiration_date"] > datetime.now(timezone.utc) + timedelta(hours=4)
+
+        assert await shortener.get_original_url(short_url) == "https://gmail.com"
+
+        # A cache miss falls back to MongoDB
+        memcache.values.clear()
+        assert await shortener.get_original_url(short_url) == "https://gmail.com"
+
+        await shortener.delete_short_url(short_url)
+        with pytest.raises(ValueError):
+            await shortener.get_original_url(short_url)
+
+    asyncio.run(scenario())
+
+
+def test_slow_backend_does_not_block_other_requests():
+    """
+    Test case for concurrency: lookups against a slow backend must overlap instead of queueing.
+    """
+    async def scenario():
+        mongodb, memcache = FakeMongoDB(latency=0.05), FakeMemcache()
+        shortener = URLShortener(mongodb, memcache)
+        short_urls = [await shortener.generate_short_url(f"https://example.com/{i}") for i in range(20)]
+        memcache.values.clear()
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await asyncio.gather(*(shortener.get_original_url(short_url) for short_url in short_urls))
+        # Twenty sequential lookups would take a full second
+        assert loop.time() - started < 0.5
+
+    asyncio.run(scenario())
+
+
+def test_missing_short_urls_are_negatively_cached():
+    """
+    Test case for negative caching: repeated lookups of an unknown short URL reach MongoDB once,
+    and issuing that short URL later makes it resolvable right away.
+    """
+    async def scenario():
+        mongodb, memcache = FakeMongoDB(), FakeMemcache()
+        shortener = URLShortener(mongodb, memcache)
+
+        for _ in range(5):
+            with pytest.raises(ValueError, match="Short URL not found"):
+                await shortener.get_original_url("abc")
+        assert mongodb.calls == 1
+        assert shortener.stats()["negative_cache_hits"] == 4
+
+        await mongodb.insert_short_url("expired", "https://gmail.com", datetime.now(timezone.utc) - timedelta(hours=1))
+        for _ in range(2):
+            with pytest.raises(ValueError, match="Short URL has been expired"):
+                await shortener.get_original_url("expired")
+        assert mongodb.calls == 3
+
+        short_url = shortener.allocator.encode(0)
+        with pytest.raises(ValueError):
+            await shortener.get_original_url(short_url)
+        assert await shortener.generate_short_url("https://example.com") == short_url
+        assert await shortener.get_original_url(short_url) == "https://example.com"
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_misses_share_one_lookup():
+    """
+    Test case for request coalescing: concurrent misses for one short URL share a single backend lookup.
+    """
+    async def scenario():
+        mongodb, memcache = FakeMongoDB(latency=0.01), FakeMemcache(latency=0.01)
+        shortener = URLShortener(mongodb, memcache)
+        short_url = await shortener.generate_short_url("https://gmail.com")
+        memcache.values.clear()
+        lookups = mongodb.calls
+
+        results = await asyncio.gather(*(shortener.get_original_url(short_url) for _ in range(50)))
+        assert results == ["https://gmail.com"] * 50
+        assert mongodb.calls == lookups + 1
+        assert shortener.stats()["coalesced_lookups"] == 49
+
+    asyncio.run(scenario())
+
+
+def test_spellings_of_an_original_url_share_a_short_url():
+    """
+    Test case for deduplicating original URLs by their canonical form, one by one and in batches.
+    """
+    async def scenario():
+        mongodb, memcache = FakeMongoDB(), FakeMemcache()
+        shortener = URLShortener(mongodb, memcache)
+
+        short_url = await shortener.generate_short_url("https://Example.com:443/a/?utm=1&id=2")
+        assert await shortener.generate_short_url("https://example.com/a?id=2&utm=1") == short_url
+        # The mapping keeps the spelling it was created with
+        assert await shortener.get_original_url(short_url) == "https://Example.com:443/a/?utm=1&id=2"
+
+        results = await shortener.generate_short_urls(["https://example.com/b", "HTTPS://EXAMPLE.COM/b/",
+                                                       "https://example.com/a/?id=2&utm=1"])
+        assert results[0] == results[1] != short_url
+        assert results[2] == short_url
+        assert len(mongodb.documents) == 2
+
+    asyncio.run(scenario())
+
+
+def test_codes_taken_by_an_import_are_allocated_again():
+    """
+    Test case for a new short URL getting another code when an import wrote the leased one in the meantime,
+    for single and batch requests.
+    """
+    async def scenario():
+        mongodb = FakeMongoDB()
+        allocator = KeyAllocator(mongodb, block_size=10)
+        shortener = URLShortener(mongodb, FakeMemcache(), allocator=allocator)
+        await shortener.generate_short_url("https://example.com/first")
+        # An import wrote the next codes of the leased block
+        taken = [allocator.encode(sequence) for sequence in range(allocator._next, allocator._next + 2)]
+        await mongodb.upsert_short_urls([{"short_url": code, "original_url": "https://imported.com",
+                                          "expiration_date": datetime.now(timezone.utc) + timedelta(hours=1)}
+                                         for code in taken])
+
+        short_url = await shortener.generate_short_url("https://example.com/single")
+        assert short_url not in taken and mongodb.documents[short_url]["original_url"] == "https://example.com/single"
+        taken = [allocator.encode(sequence) for sequence in range(allocator._next, allocator._next + 2)]
+        await mongodb.upsert_short_urls([{"short_url": code, "original_url": "https://imported.com",
+                                          "expiration_date": datetime.now(timezone.utc) + timedelta(hours=1)}
+                                         for code in taken])
+        short_urls = await shortener.generate_short_urls(["https://example.com/a", "https://example.com/b",
+                                                          "https://example.com/c"])
+        assert all(isinstance(short_url, str) and short_url not in taken for short_url in short_urls)
+        assert [mongodb.documents[short_url]["original_url"] for short_url in short_urls] == [
+            "https://example.com/a", "https://example.com/b", "https://example.com/c"]
+        assert all(mongodb.documents[code]["original_url"] == "https://imported.com" for code in taken)
+
+    asyncio.run(scenario())
@@ -0,0 +1,62 @@
+import time
+
+from fastapi.testclient import TestClient
+
+from api import endpoints
+from db.mongodb import UNAVAILABLE_ERRORS
+from main import app
+from processing.circuit_breaker import CircuitBreaker
+from processing.shortener import URLShortener
+from tests.fakes import FakeMemcache, FakeMongoDB
+
+
+def test_stale_copies_are_served_while_mongodb_is_down(monkeypatch):
+    """
+    Test case for killing MongoDB in the middle of a run of redirects.
+    Redirects keep working from the stale copies, flagged with a header, a deleted short URL is never
+    served, and the short URLs served stale are revalidated once MongoDB is back.
+    """
+    mongodb, memcache = FakeMongoDB(), FakeMemcache()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0, failure_types=UNAVAILABLE_ERRORS)
+    # Authoritative entries lapse right away, so every redirect needs MongoDB or the stale copy
+    shortener = URLShortener(mongodb, memcache, negative_cache_ttl=0, breaker=breaker, cache_ttl=0.001,
+                             stale_ttl=3600)
+    monkeypatch.setattr(endpoints, "shortener", shortener)
+
+    with TestClient(app) as client:
+        original_urls = {}
+        for i in range(10):
+            original_url = f"https://example.com/{i}"
+            short_url = client.post("/shorten/", json={"original_url": original_url}).json()["short_url"]
+            original_urls[short_url.rsplit('/', 1)[-1]] = original_url
+        deleted = next(iter(original_urls))
+        client.request("DELETE", "/shorten/", json={"short_url": deleted})
+        del original_urls[deleted]
+        codes = list(original_urls)
+
+        stale_responses = 0
+        for i in range(200):
+            if i == 100:
+                mongodb.down = True
+            response = client.get(f"/{codes[i % len(codes)]}", follow_redirects=False)
+            assert response.status_code == 307
+            assert response.headers["location"] == original_urls[codes[i % len(codes)]]
+            assert ("X-Served-Stale" in response.headers) == mongodb.down
+            stale_responses += "X-Served-Stale" in response.headers
+
+            response = client.get(f"/{deleted}", follow_redirects=False)
+            assert response.status_code == 404
+        assert stale_responses == 100
+
+        resolved = client.post("/resolve/batch", json={"short_urls": codes}).json()["results"]
+        assert all(result["stale"] for result in resolved)
+
+        mongodb.down = False
+        response = client.get(f"/{codes[0]}", follow_redirects=False)
+        assert response.status_code == 307 and "X-Served-Stale" not in response.headers
+        for _ in range(100):
+            if not shortener.stale_served and shortener.revalidation.done():
+                break
+            time.sleep(0.01)
+        assert not shortener.stale_served
+        assert shortener.stats()["stale_responses"] == 100 + len(codes)
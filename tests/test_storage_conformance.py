@@ -0,0 +1,315 @@
+import asyncio
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from db.mongodb import AsyncMongoDB
+from db.sharding import ShardedStorage
+from db.sqlite import SQLiteStorage
+from main import ensure_indexes
+from processing.shortener import URLShortener
+from tests.fakes import FakeMemcache, FakeMongoDB
+
+# Set to run the suite against a MongoDB deployment as well, in a scratch database
+MONGODB_TEST_URI = os.environ.get('MONGODB_TEST_URI')
+
+
+def mongodb_storage() -> AsyncMongoDB:
+    storage = AsyncMongoDB(MONGODB_TEST_URI, serverSelectionTimeoutMS=2000)
+    storage.db = storage.client['short_urls_conformance']
+    storage.collection = storage.lookup_collection = storage.db['short_urls']
+    storage.counters = storage.db['counters']
+    storage.clicks = storage.db['clicks']
+    return storage
+
+
+@pytest.fixture(params=['sqlite', 'fake', 'sharded', 'mongodb'])
+def make_storage(request, tmp_path):
+    """ Build a fresh, empty instance of every storage backend in turn. """
+    if request.param == 'mongodb' and not MONGODB_TEST_URI:
+        pytest.skip("MONGODB_TEST_URI is not set")
+
+    async def make():
+        storage = {'sqlite': lambda: SQLiteStorage(str(tmp_path / 'short_urls.db')), 'fake': FakeMongoDB,
+                   'sharded': lambda: ShardedStorage({f'shard{i}': FakeMongoDB() for i in range(3)}),
+                   'mongodb': mongodb_storage}[request.param]()
+        if request.param == 'mongodb':
+            await storage.client.drop_database('short_urls_conformance')
+        await storage.ensure_indexes()
+        return storage
+    return make
+
+
+def run(make_storage, scenario) -> None:
+    async def main():
+        storage = await make_storage()
+        try:
+            await scenario(storage)
+        finally:
+            await storage.close_connection()
+    asyncio.run(main())
+
+
+def assert_same_time(stored: datetime, expected: datetime) -> None:
+    # MongoDB keeps milliseconds only
+    assert abs(stored - expected) < timedelta(milliseconds=1)
+
+
+def test_insert_and_lookup_by_short_url(make_storage):
+    """
+    Test case for storing short URLs and finding them again, including duplicates and expired ones.
+    """
+    async def scenario(storage):
+        future, past = datetime.now(timezone.utc) + timedelta(hours=1), datetime.now(timezone.utc) - timedelta(hours=1)
+        await storage.insert_short_url("abc", "https://example.com/a", future)
+        with pytest.raises(Exception):
+            await storage.insert_short_url("abc", "https://example.com/other", future)
+
+        url_data = await storage.lookup_by_short_url("abc")
+        assert (url_data["short_url"], url_data["original_url"]) == ("abc", "https://example.com/a")
+        assert_same_time(url_data["expiration_date"], future)
+
+        errors = await storage.insert_short_urls([
+            {"short_url": "def", "original_url": "https://example.com/d", "expiration_date": past},
+            {"short_url": "abc", "original_url": "https://example.com/x", "expiration_date": future},
+            {"short_url": "ghi", "original_url": "https://example.com/g", "expiration_date": future},
+        ])
+        assert errors[0] is None and errors[2] is None and errors[1]
+        assert await storage.insert_short_urls([]) == []
+
+        with pytest.raises(ValueError, match="not found"):
+            await storage.lookup_by_short_url("unknown")
+        with pytest.raises(ValueError, match="expired"):
+            await storage.lookup_by_short_url("def")
+
+        found = await storage.lookup_by_short_urls(["abc", "def", "unknown", "ghi"])
+        assert set(found) == {"abc", "def", "ghi"}
+        assert found["ghi"]["original_url"] == "https://example.com/g"
+
+    run(make_storage, scenario)
+
+
+def test_lookup_by_original_url(make_storage):
+    """
+    Test case for finding the unexpired short URL of any spelling of an original URL.
+    """
+    async def scenario(storage):
+        future, past = datetime.now(timezone.utc) + timedelta(hours=1), datetime.now(timezone.utc) - timedelta(hours=1)
+        await storage.insert_short_url("old", "https://example.com/a?x=1&y=2", past)
+        await storage.insert_short_url("new", "https://Example.com/a/?y=2&x=1", future)
+        await storage.insert_short_url("exp", "https://example.com/expired", past)
+
+        assert (await storage.lookup_by_original_url("https://example.com:443/a?x=1&y=2"))["short_url"] == "new"
+        assert await storage.lookup_by_original_url("https://example.com/expired") is None
+        assert await storage.lookup_by_original_url("https://example.com/unknown") is None
+
+        found = await storage.lookup_by_original_urls(["https://example.com/a?x=1&y=2", "https://example.com/A",
+                                                       "https://example.com/expired"])
+        assert {original_url: url_data["short_url"] for original_url, url_data in found.items()} == {
+            "https://example.com/a?x=1&y=2": "new"}
+
+    run(make_storage, scenario)
+
+
+def test_expiration_updates_and_deletion(make_storage):
+    """
+    Test case for setting, extending and deleting short URLs.
+    """
+    async def scenario(storage):
+        now = datetime.now(timezone.utc)
+        for short_url in ("a", "b", "c"):
+            await storage.insert_short_url(short_url, f"https://example.com/{short_url}", now + timedelta(hours=1))
+
+        await storage.update_expiration_date("a", now + timedelta(hours=5))
+        await storage.update_expiration_dates(["b", "c"], now + timedelta(hours=3))
+        await storage.extend_expiration_dates({"a": now + timedelta(hours=2), "b": now + timedelta(hours=4)})
+        found = await storage.lookup_by_short_urls(["a", "b", "c"])
+        assert_same_time(found["a"]["expiration_date"], now + timedelta(hours=5))
+        assert_same_time(found["b"]["expiration_date"], now + timedelta(hours=4))
+        assert_same_time(found["c"]["expiration_date"], now + timedelta(hours=3))
+
+        await storage.delete_short_url("a")
+        await storage.delete_short_url("unknown")
+        with pytest.raises(ValueError):
+            await storage.lookup_by_short_url("a")
+        assert set(await storage.lookup_by_short_urls(["a", "b"])) == {"b"}
+
+    run(make_storage, scenario)
+
+
+def test_scan_and_bulk_deletion(make_storage):
+    """
+    Test case for streaming every document in short URL order, resuming a scan and deleting in bulk.
+    """
+    async def scenario(storage):
+        now = datetime.now(timezone.utc)
+        short_urls = [f"s{i:02d}" for i in range(25)]
+        await storage.insert_short_urls([{"short_url": short_url, "original_url": f"https://example.com/{short_url}",
+                                          "expiration_date": now + timedelta(hours=1)}
+                                         for short_url in reversed(short_urls)])
+
+        scanned = [url_data async for url_data in storage.scan_short_urls(batch_size=4)]
+        assert [url_data["short_url"] for url_data in scanned] == short_urls
+        assert scanned[3]["original_url"] == "https://example.com/s03"
+        assert_same_time(scanned[3]["expiration_date"], now + timedelta(hours=1))
+        assert [url_data["short_url"] async for url_data in storage.scan_short_urls("s20", 4)] == short_urls[21:]
+
+        await storage.delete_short_urls(short_urls[:20])
+        await storage.delete_short_urls([])
+        assert [url_data["short_url"] async for url_data in storage.scan_short_urls()] == short_urls[20:]
+
+    run(make_storage, scenario)
+
+
+def test_upsert_short_urls(make_storage):
+    """
+    Test case for inserting new short URLs and replacing existing ones, keeping the given expiration dates.
+    """
+    async def scenario(storage):
+        now = datetime.now(timezone.utc)
+        await storage.insert_short_url("s01", "https://example.com/old", now + timedelta(hours=1))
+        await storage.upsert_short_urls([
+            {"short_url": "s01", "original_url": "https://example.com/new", "expiration_date": now + timedelta(days=2)},
+            {"short_url": "s02", "original_url": "https://example.com/2", "expiration_date": now + timedelta(hours=5)},
+        ])
+        await storage.upsert_short_urls([])
+
+        url_data = await storage.lookup_by_short_url("s01")
+        assert url_data["original_url"] == "https://example.com/new"
+        assert_same_time(url_data["expiration_date"], now + timedelta(days=2))
+        assert_same_time((await storage.lookup_by_short_url("s02"))["expiration_date"], now + timedelta(hours=5))
+        assert (await storage.lookup_by_original_url("https://example.com/new"))["short_url"] == "s01"
+        assert await storage.lookup_by_original_url("https://example.com/old") is None
+
+    run(make_storage, scenario)
+
+
+def test_latest_short_urls(make_storage):
+    """
+    Test case for streaming the unexpired short URLs that expire last, up to a limit.
+    """
+    async def scenario(storage):
+        now = datetime.now(timezone.utc)
+        await storage.insert_short_urls([{"short_url": f"s{i:02d}", "original_url": f"https://example.com/{i}",
+                                          "expiration_date": now + timedelta(minutes=i)} for i in range(1, 21)])
+        await storage.insert_short_url("old", "https://example.com/old", now - timedelta(minutes=1))
+
+        latest = [url_data["short_url"] async for url_data in storage.latest_short_urls(7, batch_size=3)]
+        assert latest == [f"s{i:02d}" for i in range(20, 13, -1)]
+        assert len([url_data async for url_data in storage.latest_short_urls(100, batch_size=3)]) == 20
+        assert [url_data async for url_data in storage.latest_short_urls(0)] == []
+
+    run(make_storage, scenario)
+
+
+def test_sequence_blocks_and_clicks(make_storage):
+    """
+    Test case for the counters leasing short URL blocks and the click counts.
+    """
+    async def scenario(storage):
+        starts = await asyncio.gather(*(storage.reserve_sequence_block("short_url", 10) for _ in range(5)))
+        assert sorted(starts) == [0, 10, 20, 30, 40]
+        assert await storage.reserve_sequence_block("other", 5) == 0
+
+        await storage.increment_clicks({("a", 0): 2, ("a", 3600): 1, ("b", 3600): 5})
+        await storage.increment_clicks({("a", 3600): 3})
+        assert await storage.top_clicked(10) == [{"short_url": "a", "count": 6}, {"short_url": "b", "count": 5}]
+        assert await storage.top_clicked(1, since=3600) == [{"short_url": "b", "count": 5}]
+        assert await storage.click_history("a") == [{"bucket": 0, "count": 2}, {"bucket": 3600, "count": 4}]
+        assert await storage.click_history("a", since=3600) == [{"bucket": 3600, "count": 4}]
+
+    run(make_storage, scenario)
+
+
+def test_sqlite_deletes_expired_short_urls(tmp_path):
+    """
+    Test case for the embedded backend removing short URLs once their grace period is over, like a TTL index.
+    """
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / 'short_urls.db'), expire_after_seconds=60, purge_interval=0)
+        await storage.ensure_indexes()
+        now = datetime.now(timezone.utc)
+        await storage.insert_short_url("gone", "https://example.com/1", now - timedelta(minutes=2))
+        await storage.insert_short_url("grace", "https://example.com/2", now - timedelta(seconds=10))
+        await storage.insert_short_url("live", "https://example.com/3", now + timedelta(hours=1))
+        assert set(await storage.lookup_by_short_urls(["gone", "grace", "live"])) == {"grace", "live"}
+        await storage.close_connection()
+
+    asyncio.run(scenario())
+
+
+def test_sqlite_concurrent_bulk_writes(tmp_path):
+    """
+    Test case for bulk writes queued on the writer thread at the same time while expired short URLs are purged.
+    """
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / 'short_urls.db'), expire_after_seconds=0, purge_interval=0)
+        await storage.ensure_indexes()
+        future = datetime.now(timezone.utc) + timedelta(hours=1)
+        url_docs = [{"short_url": f"s{i:04d}", "original_url": f"https://example.com/{i}", "expiration_date": future}
+                    for i in range(2000)]
+        batches = [url_docs[start:start + 200] for start in range(0, len(url_docs), 200)]
+        await asyncio.gather(*(storage.upsert_short_urls(batch) for batch in batches))
+        assert len(await storage.lookup_by_short_urls([url_doc["short_url"] for url_doc in url_docs])) == 2000
+        await asyncio.gather(*(storage.delete_short_urls([url_doc["short_url"] for url_doc in batch])
+                               for batch in batches))
+        assert [url_data async for url_data in storage.scan_short_urls()] == []
+        await storage.close_connection()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize('read_inline', [True, False])
+def test_shortener_on_sqlite(tmp_path, read_inline):
+    """
+    Test case for serving the shortener from the embedded backend alone, as soon as it is created,
+    with lookups on the event loop or on the dedicated thread.
+    """
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / 'short_urls.db'), read_inline=read_inline)
+        shortener = URLShortener(storage, FakeMemcache())
+        short_urls = await shortener.generate_short_urls(["https://example.com/a", "https://example.com/b"])
+        assert await shortener.generate_short_url("https://example.com/a/") == short_urls[0]
+        shortener.memcache.values.clear()
+        assert await shortener.get_original_urls(short_urls) == ["https://example.com/a", "https://example.com/b"]
+        await shortener.delete_short_url(short_urls[1])
+        with pytest.raises(ValueError):
+            await shortener.get_original_url(short_urls[1])
+        await storage.close_connection()
+
+    asyncio.run(scenario())
+
+
+def test_sqlite_retries_locked_inline_lookups_on_the_thread(tmp_path):
+    """
+    Test case for a lookup on the event loop that finds the database locked being answered from the dedicated thread.
+    """
+    class BusyConnection:
+        def execute(self, sql: str, parameters) -> None:
+            error = sqlite3.OperationalError("database is locked")
+            error.sqlite_errorcode = sqlite3.SQLITE_BUSY
+            raise error
+
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / 'short_urls.db'))
+        await storage.insert_short_url('abc', 'https://example.com', datetime.now(timezone.utc) + timedelta(hours=1))
+        reader, storage.reader = storage.reader, BusyConnection()
+        assert (await storage.lookup_by_short_url('abc'))['original_url'] == 'https://example.com'
+        storage.reader = reader
+        await storage.close_connection()
+
+    asyncio.run(scenario())
+
+
+def test_startup_reports_storage_errors(capsys):
+    """
+    Test case for startup reporting an index creation failure of the embedded backend instead of failing.
+    """
+    class LockedStorage:
+        async def ensure_indexes(self) -> None:
+            raise sqlite3.OperationalError("database is locked")
+
+    asyncio.run(ensure_indexes(LockedStorage()))
+    assert 'database is locked' in capsys.readouterr().out
@@ -0,0 +1,286 @@
+import asyncio
+import time
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api import endpoints
+from db.local_cache import LocalCache
+from db.transfer import export_short_urls, guess_format, import_short_urls
+from main import app
+from processing.allocator import KeyAllocator
+from processing.cache_values import STALE_KEY_PREFIX, unpack_cache_value
+from processing.short_url_filter import IMPORT_LEASE, IMPORT_LEASE_SECONDS, ShortURLFilter
+from processing.shortener import URLShortener
+from tests.fakes import FakeMemcache, FakeMongoDB
+
+
+async def make_storage(count: int) -> tuple[FakeMongoDB, list[str]]:
+    mongodb = FakeMongoDB()
+    allocator = KeyAllocator(mongodb, block_size=50)
+    short_urls = [await allocator.allocate() for _ in range(count)]
+    now = datetime.now(timezone.utc)
+    await mongodb.insert_short_urls([{'short_url': short_url, 'original_url': f'https://example.com/{i}?q=ü',
+                                      'expiration_date': now + timedelta(hours=i + 1)}
+                                     for i, short_url in enumerate(short_urls)])
+    await mongodb.insert_short_url('expired', 'https://example.com/expired', now - timedelta(hours=1))
+    return mongodb, short_urls
+
+
+async def chunked(data: bytes, size: int = 100):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def assert_same_documents(source: FakeMongoDB, target: FakeMongoDB, short_urls: list[str]) -> None:
+    for short_url in short_urls:
+        expected, imported = source.documents[short_url], target.documents[short_url]
+        assert imported['original_url'] == expected['original_url']
+        assert abs(imported['expiration_date'] - expected['expiration_date']) < timedelta(milliseconds=1)
+
+
+@pytest.mark.parametrize('fmt', ['ndjson', 'binary'])
+@pytest.mark.parametrize('compression', ['none', 'gzip'])
+def test_export_and_import_round_trip(fmt, compression):
+    """
+    Test case for exporting the unexpired short URLs and importing them into an empty storage in small chunks,
+    keeping their expiration dates and moving the counter past the imported codes.
+    """
+    async def scenario():
+        source, short_urls = await make_storage(120)
+        export = b''.join([data async for data, _ in export_short_urls(source, fmt, compression, batch_size=16)])
+
+        target = FakeMongoDB()
+        allocator = KeyAllocator(target)
+        progress = await import_short_urls(target, chunked(export), fmt, compression, batch_size=16,
+                                           allocator=allocator)
+        assert progress == {'read': 120, 'written': 120, 'expired': 0, 'checkpoint': 120}
+        assert set(target.documents) == set(short_urls)
+        assert_same_documents(source, target, short_urls)
+        assert await allocator.allocate() not in short_urls
+        assert target.counters['short_url'] >= source.counters['short_url']
+
+    asyncio.run(scenario())
+
+
+def test_resumed_export_continues_after_checkpoint():
+    """
+    Test case for an interrupted export continued after its last checkpoint, the two parts forming one export.
+    """
+    async def scenario():
+        source, short_urls = await make_storage(100)
+        first, after = b'', None
+        async for data, last in export_short_urls(source, 'binary', 'gzip', batch_size=10, checkpoint_every=30):
+            first += data
+            if last is not None:
+                after = last
+                break
+        second = b''.join([data async for data, _ in export_short_urls(source, 'binary', 'gzip', after,
+                                                                       include_expired=True, batch_size=10)])
+
+        target = FakeMongoDB()
+        progress = await import_short_urls(target, chunked(first + second), 'binary', 'gzip', include_expired=True)
+        assert progress['read'] == 101
+        assert set(target.documents) == set(short_urls) | {'expired'}
+
+    asyncio.run(scenario())
+
+
+class FlakyStorage(FakeMongoDB):
+    """ Fails one bulk write and records how many writes overlapped. """
+
+    def __init__(self, fail_at: int | None = None) -> None:
+        super().__init__(latency=0.001)
+        self.fail_at = fail_at
+        self.upserts = self.in_flight = self.max_in_flight = 0
+
+    async def upsert_short_urls(self, url_docs: list[dict]) -> None:
+        self.upserts += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.upserts == self.fail_at:
+                raise ConnectionError("MongoDB went away")
+            await super().upsert_short_urls(url_docs)
+        finally:
+            self.in_flight -= 1
+
+
+class CounterCheckingStorage(FakeMongoDB):
+    """ Records whether the counter was past the codes of every batch when it was written. """
+
+    def __init__(self, allocator: KeyAllocator) -> None:
+        super().__init__()
+        self.allocator = allocator
+        self.ahead = []
+
+    async def upsert_short_urls(self, url_docs: list[dict]) -> None:
+        highest = max(self.allocator.decode(url_doc['short_url']) for url_doc in url_docs)
+        self.ahead.append(self.counters.get('short_url', 0) > highest)
+        await super().upsert_short_urls(url_docs)
+
+
+def test_import_moves_the_counter_before_writing():
+    """
+    Test case for moving the counter past the codes of each batch before it is written, so live allocators do not
+    lease them meanwhile, and past the codes of skipped records on a resumed import.
+    """
+    async def scenario():
+        source, short_urls = await make_storage(100)
+        # Exported in short URL order, so the highest sequence numbers are spread over the batches
+        export = b''.join([data async for data, _ in export_short_urls(source, 'ndjson', 'none')])
+
+        target = CounterCheckingStorage(KeyAllocator(FakeMongoDB()))
+        await import_short_urls(target, chunked(export), batch_size=10, allocator=target.allocator)
+        assert len(target.ahead) == 10 and all(target.ahead)
+
+        resumed = FakeMongoDB()
+        allocator = KeyAllocator(resumed)
+        progress = await import_short_urls(resumed, chunked(export), skip=100, allocator=allocator)
+        assert progress['written'] == 0
+        assert resumed.counters['short_url'] > max(allocator.decode(short_url) for short_url in short_urls)
+
+    asyncio.run(scenario())
+
+
+def test_interrupted_import_resumes_from_checkpoint():
+    """
+    Test case for an import limiting the batches in flight, stopping at a failed write and resuming from
+    the records written in full.
+    """
+    async def scenario():
+        source, short_urls = await make_storage(200)
+        export = b''.join([data async for data, _ in export_short_urls(source, 'ndjson', 'gzip')])
+
+        target = FlakyStorage(fail_at=6)
+        checkpoints, progress = [], {}
+        with pytest.raises(ConnectionError):
+            await import_short_urls(target, chunked(export), 'ndjson', 'gzip', batch_size=10, concurrency=2,
+                                    progress=progress, on_checkpoint=checkpoints.append)
+        assert target.max_in_flight == 2
+        assert checkpoints == sorted(checkpoints) and progress['checkpoint'] == checkpoints[-1]
+        assert progress['checkpoint'] < 200 and progress['read'] < 200
+
+        target.fail_at = None
+        resumed = await import_short_urls(target, chunked(export), 'ndjson', 'gzip', skip=progress['checkpoint'],
+                                          batch_size=10)
+        assert resumed['written'] == 200 - progress['checkpoint']
+        assert set(target.documents) == set(short_urls)
+
+    asyncio.run(scenario())
+
+
+def test_invalid_input_is_rejected():
+    """
+    Test case for rejecting a truncated export and input of another format.
+    """
+    async def scenario():
+        source, _ = await make_storage(30)
+        export = b''.join([data async for data, _ in export_short_urls(source, 'ndjson', 'gzip')])
+        with pytest.raises(ValueError, match="middle"):
+            await import_short_urls(FakeMongoDB(), chunked(export[:-10]), 'ndjson', 'gzip')
+        with pytest.raises(ValueError, match="not a binary export"):
+            await import_short_urls(FakeMongoDB(), chunked(b'{"short_url": "x"}\n'), 'binary')
+        with pytest.raises(ValueError, match="Invalid record"):
+            await import_short_urls(FakeMongoDB(), chunked(b'{"short_url": "x"}\n'), 'ndjson')
+
+    asyncio.run(scenario())
+    assert guess_format('dump.bin.zst') == ('binary', 'zstd')
+
+
+def test_expiration_dates_are_imported_as_utc():
+    """
+    Test case for importing expiration dates with an offset as the same instant in UTC, and without one as UTC.
+    """
+    async def scenario():
+        target = FakeMongoDB()
+        records = (b'{"short_url": "a", "original_url": "https://a.com", '
+                   b'"expiration_date": "2100-01-01T02:00:00+02:00"}\n'
+                   b'{"short_url": "b", "original_url": "https://b.com", "expiration_date": "2100-01-01T00:00:00"}\n')
+        await import_short_urls(target, chunked(records), 'ndjson')
+        midnight = datetime(2100, 1, 1, tzinfo=timezone.utc)
+        assert [target.documents[code]['expiration_date'] for code in 'ab'] == [midnight, midnight]
+        assert all(target.documents[code]['expiration_date'].utcoffset() == timedelta(0) for code in 'ab')
+
+        export = b''.join([data async for data, _ in export_short_urls(target, 'ndjson', 'none')])
+        assert export.count(b'"2100-01-01T00:00:00+00:00"') == 2
+
+    asyncio.run(scenario())
+    assert guess_format('dump.ndjson') == ('ndjson', 'none')
+
+
+def test_export_and_import_endpoints(monkeypatch):
+    """
+    Test case for streaming an export out of one deployment and into another through the API.
+    """
+    source, short_urls = asyncio.run(make_storage(50))
+    monkeypatch.setattr(endpoints, "shortener", URLShortener(source, FakeMemcache()))
+    monkeypatch.setattr(endpoints, "settings", replace(endpoints.settings, admin_token="token"))
+    with TestClient(app, headers={"Authorization": "Bearer token"}) as client:
+        response = client.get("/admin/export", params={"format": "binary", "compression": "gzip"})
+        assert response.status_code == 200
+        assert 'short_urls.bin.gz' in response.headers["content-disposition"]
+        export = response.content
+        assert client.get("/admin/export", params={"format": "csv"}).status_code == 422
+
+    target = FakeMongoDB()
+    monkeypatch.setattr(endpoints, "shortener", URLShortener(target, FakeMemcache()))
+    with TestClient(app, headers={"Authorization": "Bearer token"}) as client:
+        response = client.post("/admin/import", params={"format": "binary", "compression": "gzip"}, content=export)
+        assert response.status_code == 200
+        assert response.json()["written"] == 50
+        response = client.post("/admin/import", params={"format": "binary", "compression": "gzip"},
+                               content=export[:-5])
+        assert response.status_code == 400 and "Resume with skip=" in response.json()["detail"]
+    assert_same_documents(source, target, short_urls)
+
+
+@pytest.mark.parametrize('admin_token', ['', 'token'])
+def test_admin_endpoints_require_the_admin_token(monkeypatch, admin_token):
+    """
+    Test case for the admin endpoints rejecting requests without the admin token, and every request
+    while no token is configured.
+    """
+    monkeypatch.setattr(endpoints, "shortener", URLShortener(FakeMongoDB(), FakeMemcache()))
+    monkeypatch.setattr(endpoints, "settings", replace(endpoints.settings, admin_token=admin_token))
+    with TestClient(app) as client:
+        for headers in ({}, {"Authorization": "Bearer wrong"}, {"Authorization": "Basic token"}):
+            for method, path in (("GET", "/admin/export"), ("POST", "/admin/import"), ("GET", "/admin/warmup"),
+                                 ("POST", "/admin/warmup")):
+                response = client.request(method, path, headers=headers, content=b"")
+                assert response.status_code == (401 if admin_token else 403)
+        response = client.get("/admin/export", headers={"Authorization": "Bearer token"})
+        assert response.status_code == (200 if admin_token else 403)
+
+
+def test_import_refreshes_the_caches_and_the_filter(monkeypatch):
+    """
+    Test case for an import replacing mappings that are cached, including their stale copies, and adding the
+    imported short URLs to the short URL filter, so they are resolved at once.
+    """
+    async def scenario():
+        source, short_urls = await make_storage(20)
+        export = b''.join([data async for data, _ in export_short_urls(source, 'ndjson', 'none')])
+
+        target, memcache = FakeMongoDB(), FakeMemcache()
+        allocator = KeyAllocator(target, max_block_age=600)
+        code_filter = ShortURLFilter(target, allocator)
+        await code_filter.rebuild()
+        shortener = URLShortener(target, memcache, LocalCache(), allocator, stale_ttl=600, code_filter=code_filter)
+        # The target knows the first short URL with another original URL
+        await target.insert_short_url(short_urls[0], 'https://old.example.com',
+                                      datetime.now(timezone.utc) + timedelta(hours=1))
+        assert await shortener.get_original_url(short_urls[0]) == 'https://old.example.com'
+
+        await import_short_urls(target, chunked(export), allocator=allocator, on_batch=shortener.refresh_short_urls)
+        for short_url in short_urls:
+            assert await shortener.get_original_url(short_url) == source.documents[short_url]['original_url']
+        assert code_filter.rejected == 0
+        # Filters of other workers keep looking short URLs up until the lease ended
+        assert target.counters[IMPORT_LEASE] >= time.time() + IMPORT_LEASE_SECONDS / 2
+        original_url, _ = unpack_cache_value(await memcache.get_cache(STALE_KEY_PREFIX + short_urls[0]))
+        assert original_url == source.documents[short_urls[0]]['original_url']
+
+    asyncio.run(scenario())
@@ -0,0 +1,98 @@
+import asyncio
+import time
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
+
+from fastapi.testclient import TestClient
+
+from api import endpoints
+from db.local_cache import LocalCache
+from main import app
+from processing.shortener import URLShortener
+from processing.warmup import CacheWarmer
+from tests.fakes import FakeMemcache, FakeMongoDB
+
+
+async def make_storage(count: int) -> FakeMongoDB:
+    mongodb = FakeMongoDB()
+    now = datetime.now(timezone.utc)
+    await mongodb.insert_short_urls([{'short_url': f'code{i}', 'original_url': f'https://example.com/{i}',
+                                      'expiration_date': now + timedelta(hours=i + 1)} for i in range(count)])
+    await mongodb.insert_short_url('expired', 'https://example.com/expired', now - timedelta(hours=1))
+    return mongodb
+
+
+def test_warm_up_loads_top_and_recent_mappings():
+    """
+    Test case for loading the most clicked and the most recent mappings with their remaining lifetime.
+    Redirects of warmed short URLs then never reach MongoDB.
+    """
+    async def scenario():
+        mongodb = await make_storage(50)
+        await mongodb.increment_clicks({('code3', 0): 5, ('code7', 0): 9, ('expired', 0): 20})
+        memcache, local_cache = FakeMemcache(), LocalCache(max_size=4)
+        warmer = CacheWarmer(mongodb, memcache, local_cache, top=3, recent=10, hours=1e6, batch_size=4, rate=0)
+
+        progress = await warmer.warm()
+        assert progress['state'] == 'done'
+        assert (progress['top'], progress['recent'], progress['loaded']) == (2, 10, 12)
+        assert {'code7', 'code3', 'code49', 'code40'} <= set(memcache.values)
+        assert 'expired' not in memcache.values and 'code39' not in memcache.values
+        # Every entry lives as long as its short URL
+        _, cached_until = memcache.values['code49']
+        assert abs(cached_until - (time.time() + 50 * 3600)) < 5
+        assert len(local_cache.entries) == 4 and local_cache.get('code7') == 'https://example.com/7'
+
+        calls = mongodb.calls
+        shortener = URLShortener(mongodb, memcache)
+        assert await shortener.get_original_urls(['code3', 'code45']) == ['https://example.com/3',
+                                                                          'https://example.com/45']
+        assert mongodb.calls == calls
+
+    asyncio.run(scenario())
+
+
+def test_warm_up_is_rate_limited_and_runs_once_per_deploy():
+    """
+    Test case for pacing the reads of a warm-up, and for the workers of a deploy sharing one warm-up.
+    """
+    async def scenario():
+        mongodb, memcache = await make_storage(40), FakeMemcache()
+        warmer = CacheWarmer(mongodb, memcache, top=0, recent=40, batch_size=10, rate=200)
+        started = time.perf_counter()
+        assert (await warmer.warm(once=True))['loaded'] == 40
+        assert time.perf_counter() - started >= 0.15
+
+        other_worker = CacheWarmer(mongodb, memcache, top=0, recent=40)
+        assert (await other_worker.warm(once=True))['state'] == 'skipped'
+        assert (await other_worker.warm())['state'] == 'done'
+
+    asyncio.run(scenario())
+
+
+def test_warm_up_endpoints(monkeypatch):
+    """
+    Test case for starting a warm-up through the API and following its progress.
+    """
+    mongodb = asyncio.run(make_storage(20))
+    memcache = FakeMemcache()
+    warmer = CacheWarmer(mongodb, memcache, top=0, recent=5, rate=0)
+    monkeypatch.setattr(endpoints, "shortener", URLShortener(mongodb, memcache))
+    monkeypatch.setattr(endpoints, "warmer", warmer)
+    monkeypatch.setattr(endpoints, "settings", replace(endpoints.settings, admin_token="token"))
+
+    def wait_for_warm_up(client: TestClient) -> dict:
+        for _ in range(100):
+            progress = client.get("/admin/warmup").json()
+            if progress["state"] not in ("idle", "running"):
+                return progress
+            time.sleep(0.01)
+
+    with TestClient(app, headers={"Authorization": "Bearer token"}) as client:
+        # Started on startup
+        assert wait_for_warm_up(client)["recent"] == 5
+
+        assert client.post("/admin/warmup", params={"recent": 15}).status_code == 202
+        progress = wait_for_warm_up(client)
+        assert progress["state"] == "done" and progress["recent"] == 15
+        assert progress["seconds"] >= 0 and warmer.runs == 2
@@ -0,0 +1,120 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api import endpoints
+from main import app
+from processing.cache_values import STALE_KEY_PREFIX, TOMBSTONE, unpack_cache_value
+from processing.shortener import URLShortener
+from processing.write_behind import ExpiryWriteBehind
+from tests.fakes import FakeMemcache, FakeMongoDB
+
+
+def test_extensions_are_coalesced():
+    """
+    Test case for buffering expiry extensions.
+    Repeated re-shortens must not write to MongoDB until the flush, which writes the latest expiry once,
+    and extensions that barely move the expiry are skipped.
+    """
+    async def scenario():
+        mongodb, memcache = FakeMongoDB(), FakeMemcache()
+        write_behind = ExpiryWriteBehind(mongodb, memcache, min_extension=3600)
+        shortener = URLShortener(mongodb, memcache, write_behind=write_behind)
+        short_url = await shortener.generate_short_url("https://gmail.com", 1)
+
+        # Less than an hour later than the current expiry
+        await shortener.generate_short_url("https://gmail.com", 1)
+        assert write_behind.skipped == 1
+        for hours in (24, 48, 12):
+            await shortener.generate_short_url("https://gmail.com", hours)
+        assert len(write_behind.pending) == 1
+        assert mongodb.documents[short_url]["expiration_date"] < datetime.now(timezone.utc) + timedelta(hours=2)
+
+        await write_behind.flush()
+        assert mongodb.documents[short_url]["expiration_date"] > datetime.now(timezone.utc) + timedelta(hours=47)
+        _, expires_at = unpack_cache_value(await memcache.get_cache(short_url))
+        assert expires_at > (datetime.now(timezone.utc) + timedelta(hours=47)).timestamp()
+
+    asyncio.run(scenario())
+
+
+def test_no_extension_is_lost_on_graceful_stop(monkeypatch):
+    """
+    Test case for shutting the application down with buffered extensions.
+    The lifespan shutdown must write every extension, even though the periodic flush never ran.
+    """
+    mongodb, memcache = FakeMongoDB(), FakeMemcache()
+    write_behind = ExpiryWriteBehind(mongodb, memcache, interval=3600, min_extension=60)
+    monkeypatch.setattr(endpoints, "shortener", URLShortener(mongodb, memcache, write_behind=write_behind))
+
+    original_urls = [f"https://example.com/{i}" for i in range(20)]
+    with TestClient(app) as client:
+        for original_url in original_urls:
+            client.post("/shorten/", json={"original_url": original_url, "expiration_in_hrs": 3})
+        for original_url in original_urls:
+            client.post("/shorten/", json={"original_url": original_url, "expiration_in_hrs": 100})
+        assert len(write_behind.pending) == 20
+
+    assert not write_behind.pending
+    assert all(url_doc["expiration_date"] > datetime.now(timezone.utc) + timedelta(hours=99)
+               for url_doc in mongodb.documents.values())
+
+
+def test_deleted_short_url_is_not_restored_by_flush():
+    """
+    Test case for deleting a short URL with a buffered extension, before and while a flush runs.
+    The flush must not bring the mapping back into Memcache, nor overwrite the tombstone of its stale copy.
+    """
+    async def scenario():
+        mongodb, memcache = FakeMongoDB(), FakeMemcache()
+        write_behind = ExpiryWriteBehind(mongodb, memcache, stale_ttl=600)
+        shortener = URLShortener(mongodb, memcache, write_behind=write_behind, stale_ttl=600)
+        short_url = await shortener.generate_short_url("https://gmail.com", 1)
+        await shortener.generate_short_url("https://gmail.com", 72)
+        assert write_behind.pending
+
+        await shortener.delete_short_url(short_url)
+        await write_behind.flush()
+        assert await memcache.get_cache(short_url) is None
+        assert await memcache.get_cache(STALE_KEY_PREFIX + short_url) == TOMBSTONE
+        with pytest.raises(ValueError):
+            await URLShortener(mongodb, memcache).get_original_url(short_url)
+
+        # Deleted after the flush read the document back, before it refreshed Memcache
+        other = await shortener.generate_short_url("https://example.com", 1)
+        await shortener.generate_short_url("https://example.com", 72)
+        lookup_by_short_urls = mongodb.lookup_by_short_urls
+
+        async def lookup_then_delete(short_urls):
+            url_docs = await lookup_by_short_urls(short_urls)
+            await shortener.delete_short_url(other)
+            return url_docs
+
+        mongodb.lookup_by_short_urls = lookup_then_delete
+        await write_behind.flush()
+        assert await memcache.get_cache(other) is None
+        assert await memcache.get_cache(STALE_KEY_PREFIX + other) == TOMBSTONE
+
+    asyncio.run(scenario())
+
+
+def test_short_urls_expiring_soon_are_extended_at_once():
+    """
+    Test case for re-shortening a URL that expires before the next flush, which must not wait for it.
+    """
+    async def scenario():
+        mongodb, memcache = FakeMongoDB(), FakeMemcache()
+        write_behind = ExpiryWriteBehind(mongodb, memcache, interval=3600)
+        shortener = URLShortener(mongodb, memcache, write_behind=write_behind)
+        short_url = await shortener.generate_short_url("https://gmail.com", 1)
+        await shortener.generate_short_url("https://gmail.com", 72)
+        other = (await shortener.generate_short_urls(["https://example.com"], 1))[0]
+        await shortener.generate_short_urls(["https://example.com"], 72)
+
+        assert not write_behind.pending
+        for code in (short_url, other):
+            assert mongodb.documents[code]["expiration_date"] > datetime.now(timezone.utc) + timedelta(hours=71)
+
+    asyncio.run(scenario())